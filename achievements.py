@@ -0,0 +1,171 @@
+"""
+Achievements
+============
+
+Badges and the points they are worth, awarded in the background after the
+writes that earn them:
+
+- RULES declare every achievement as data: the action that can earn it,
+  what is measured and the threshold to reach. Rules are indexed by
+  action, so attending an event only evaluates the attendance rules;
+- store listeners turn writes into (user, action) pairs and queue them.
+  Repeats of the same pair wait in the queue once;
+- a background task drains the queue in batches, BATCH_DELAY after the
+  first write, off the request path. Without a running event loop
+  (scripts, recovery) the queue waits for process();
+- an award adds the achievement and its points in a single store write
+  (UserStore.award), so both are persisted together or not at all, and
+  an achievement is never awarded twice. The points change is itself an
+  action, so points rules see it.
+
+Measures read the stores' own indexes at evaluation time, so nothing has
+to be rebuilt after recovery. attach() runs after storage has been
+recovered, so replayed history never queues anything.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set
+
+from store import Change
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+BATCH_DELAY = float(os.getenv("ACHIEVEMENT_BATCH_DELAY", "0.05"))
+BATCH_SIZE = int(os.getenv("ACHIEVEMENT_BATCH_SIZE", "500"))
+
+
+class Rule(NamedTuple):
+    key: str
+    title: str
+    description: str
+    points: int
+    action: str     # what can earn it: "attend", "create_event" or "points"
+    threshold: int  # earned once the action's measure reaches this
+
+
+# The Node backend's achievements; the club ones have no counterpart here
+RULES = [
+    Rule("first_event_join", "Event Attendee", "Attended your first event", 15, "attend", 1),
+    Rule("event_attendee", "Regular Attendee", "Attended 5 events", 25, "attend", 5),
+    Rule("event_creator", "Event Organizer", "Created your first event", 20, "create_event", 1),
+    Rule("loyal_member", "Loyal Member", "Earned 100+ points", 50, "points", 100),
+]
+
+
+class AchievementEngine:
+    """Evaluates the rules an action can trigger and awards what was earned"""
+
+    def __init__(self, users, events, rules: List[Rule] = RULES,
+                 batch_delay: float = BATCH_DELAY, batch_size: int = BATCH_SIZE):
+        self.users = users
+        self.events = events
+        self.rules = {rule.key: rule for rule in rules}
+        self.batch_delay = batch_delay
+        self.batch_size = batch_size
+        self._measures: Dict[str, Callable[[str, Dict[str, Any]], int]] = {
+            "attend": lambda user_id, user: len(self.events.attended_by(user_id)),
+            "create_event": lambda user_id, user: len(self.events.created_by(user_id)),
+            "points": lambda user_id, user: user.get("points", 0),
+        }
+        self._by_action: Dict[str, List[Rule]] = {}
+        for rule in sorted(rules, key=lambda rule: rule.threshold):
+            if rule.action not in self._measures:
+                raise ValueError(f"Unknown action {rule.action!r} in rule {rule.key!r}")
+            self._by_action.setdefault(rule.action, []).append(rule)
+        # user id -> actions to evaluate, in the order users were queued
+        self._pending: Dict[str, Set[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.evaluations = 0
+        self.awards = 0
+
+    def attach(self):
+        """Follow every later write"""
+        self.users.subscribe(self.apply_users)
+        self.events.subscribe(self.apply_events)
+
+    def describe(self, keys) -> List[Dict[str, Any]]:
+        """Title, description and points of the achievements with these keys"""
+        return [self.rules[key]._asdict() for key in keys if key in self.rules]
+
+    def queue(self, user_id: Optional[str], action: str):
+        if not user_id or action not in self._by_action:
+            return
+        self._pending.setdefault(user_id, set()).add(action)
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._drain())
+            except RuntimeError:
+                pass  # No event loop; process() picks it up
+
+    def process(self, limit: Optional[int] = None) -> int:
+        """Evaluate up to limit queued users (all of them if None); returns the awards made"""
+        awarded = 0
+        count = len(self._pending) if limit is None else min(limit, len(self._pending))
+        for _ in range(count):
+            user_id = next(iter(self._pending))
+            actions = self._pending.pop(user_id)
+            try:
+                awarded += self._evaluate(user_id, actions)
+            except Exception:
+                logger.exception("Evaluating achievements of user %s failed", user_id)
+        self.batches += 1
+        self.awards += awarded
+        return awarded
+
+    def stats(self):
+        return {"rules": len(self.rules), "pending_users": len(self._pending), "batches": self.batches,
+                "evaluations": self.evaluations, "awards": self.awards}
+
+    def close(self):
+        """Award what is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+        while self._pending:
+            self.process()
+
+    # Store listeners
+    def apply_users(self, changes: List[Change]):
+        for change in changes:
+            if change.op == "insert" or (change.op == "update" and "points" in change.data):
+                self.queue(change.key, "points")
+
+    def apply_events(self, changes: List[Change]):
+        for change in changes:
+            if change.op == "insert":
+                self.queue(change.data.get("created_by"), "create_event")
+                for user_id in change.data.get("attendees", ()):
+                    self.queue(user_id, "attend")
+            elif change.op == "update" and "attendees" in change.data:
+                for user_id in change.data["attendees"]:
+                    self.queue(user_id, "attend")
+            elif change.op == "attend":
+                self.queue(change.data, "attend")
+
+    # Internals
+    async def _drain(self):
+        while self._pending:
+            await asyncio.sleep(self.batch_delay)
+            self.process(self.batch_size)
+
+    def _evaluate(self, user_id: str, actions: Set[str]) -> int:
+        user = self.users.get(user_id)
+        if user is None:
+            return 0
+        awarded = 0
+        for action in actions:
+            earned = user.get("achievements", ())
+            rules = [rule for rule in self._by_action[action] if rule.key not in earned]
+            if not rules:
+                continue
+            self.evaluations += 1
+            measure = self._measures[action](user_id, user)
+            for rule in rules:
+                if measure < rule.threshold:
+                    break  # Sorted by threshold
+                if self.users.award(user_id, rule.key, rule.points):
+                    awarded += 1
+        return awarded
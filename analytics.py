@@ -0,0 +1,253 @@
+"""
+Analytics
+=========
+
+Counters behind /analytics/* and /dashboard, kept up to date by listening
+to store changes instead of scanning the stores on every request:
+
+- events per category and per month, users per role and per join month;
+- attendance per category and as day / ISO week / month time series,
+  bucketed by the date of the event attended, and the comment total;
+- active users over sliding 1-day, 7-day and 30-day windows.
+
+attach() builds the counters once from the current store contents, so it
+must run after storage has been recovered. Replayed history therefore
+never counts as activity; only live writes and logins do.
+"""
+
+import time
+from collections import Counter, deque
+from datetime import date, timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from store import Change
+
+# Configuration
+ACTIVITY_WINDOWS = {"day": 86400, "week": 7 * 86400, "month": 30 * 86400}
+# Repeated activity by the same user within this many seconds is recorded once
+ACTIVITY_RESOLUTION = 60
+
+GRANULARITIES = ("day", "week", "month")
+# Event fields the counters depend on; updates touching none of them are ignored
+EVENT_FIELDS = {"category", "date", "attendees"}
+
+
+def buckets(event_date: Optional[str]) -> Optional[Tuple[str, str, str]]:
+    """(day, ISO week, month) keys for a "YYYY-MM-DD" date, or None if invalid"""
+    try:
+        day = date.fromisoformat(event_date)
+    except (TypeError, ValueError):
+        return None
+    year, week, _ = day.isocalendar()
+    return day.isoformat(), f"{year}-W{week:02d}", event_date[:7]
+
+
+def recent_buckets(granularity: str, count: int, today: Optional[date] = None) -> List[str]:
+    """Keys of the last count periods, oldest first, ending with the current one"""
+    today = today or date.today()
+    keys = []
+    for back in range(count - 1, -1, -1):
+        if granularity == "day":
+            keys.append((today - timedelta(days=back)).isoformat())
+        elif granularity == "week":
+            year, week, _ = (today - timedelta(weeks=back)).isocalendar()
+            keys.append(f"{year}-W{week:02d}")
+        else:
+            months = today.year * 12 + today.month - 1 - back
+            keys.append(f"{months // 12:04d}-{months % 12 + 1:02d}")
+    return keys
+
+
+def _user_summary(user: Dict[str, Any]) -> Tuple[Any, str]:
+    return user.get("role"), (user.get("joined_date") or "")[:7]
+
+
+def _event_summary(event: Dict[str, Any]) -> Tuple[Any, Any, int]:
+    return event.get("category"), event.get("date"), len(event.get("attendees", ()))
+
+
+class SlidingWindow:
+    """Distinct users seen in the last `seconds` seconds"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self._entries: Deque[Tuple[float, str]] = deque()
+        self._counts: Counter = Counter()
+
+    def add(self, user_id: str, now: float):
+        # Expire here too, so memory stays bounded when nobody reads the count
+        self._expire(now)
+        self._entries.append((now, user_id))
+        self._counts[user_id] += 1
+
+    def count(self, now: float) -> int:
+        self._expire(now)
+        return len(self._counts)
+
+    def _expire(self, now: float):
+        cutoff = now - self.seconds
+        while self._entries and self._entries[0][0] < cutoff:
+            _, user_id = self._entries.popleft()
+            self._counts[user_id] -= 1
+            if not self._counts[user_id]:
+                del self._counts[user_id]
+
+
+class Analytics:
+    """Incrementally maintained counters over the user, event and comment stores"""
+
+    def __init__(self, users, events, comments):
+        self.users = users
+        self.events = events
+        self.comments = comments
+        self._windows = {name: SlidingWindow(seconds) for name, seconds in ACTIVITY_WINDOWS.items()}
+        self._last_seen: Dict[str, float] = {}
+        self._reset()
+
+    def attach(self):
+        """Count the current contents, then follow every later write"""
+        self.rebuild()
+        self.users.subscribe(self.apply)
+        self.events.subscribe(self.apply)
+        self.comments.subscribe(self.apply)
+
+    def rebuild(self):
+        self._reset()
+        for user_id, user in self.users.items():
+            self._add_user(user_id, _user_summary(user), 1)
+        for event_id, event in self.events.items():
+            self._add_event(event_id, _event_summary(event), 1)
+        self.total_comments = len(self.comments)
+
+    # Activity and queries
+    def record_activity(self, user_id: Optional[str], now: Optional[float] = None):
+        """Mark user_id as active (logins, attendance, new events)"""
+        if not user_id:
+            return
+        now = time.time() if now is None else now
+        if now - self._last_seen.get(user_id, float("-inf")) < ACTIVITY_RESOLUTION:
+            return
+        self._last_seen[user_id] = now
+        for window in self._windows.values():
+            window.add(user_id, now)
+
+    def active_users(self, now: Optional[float] = None) -> Dict[str, int]:
+        now = time.time() if now is None else now
+        return {name: window.count(now) for name, window in self._windows.items()}
+
+    def attendance_trend(self, granularity: str, periods: int) -> List[Dict[str, Any]]:
+        series = self.attendance[granularity]
+        return [{"period": key, "attendance": series.get(key, 0)}
+                for key in recent_buckets(granularity, periods)]
+
+    def popular_category(self) -> Optional[str]:
+        if not self.attendance_by_category:
+            return max(self.events_by_category, key=self.events_by_category.get, default=None)
+        return max(self.attendance_by_category, key=self.attendance_by_category.get)
+
+    # Store listener
+    def apply(self, changes: List[Change]):
+        for change in changes:
+            if change.op in ("load", "clear"):
+                self.rebuild()
+            elif change.collection == "users":
+                self._apply_user(change)
+            elif change.collection == "events":
+                self._apply_event(change)
+            elif change.collection == "comments":
+                self._apply_comment(change)
+
+    def _apply_user(self, change: Change):
+        user_id = change.key
+        if change.op == "insert":
+            if user_id in self._users:
+                self._add_user(user_id, self._users[user_id], -1)
+            self._add_user(user_id, _user_summary(change.data), 1)
+        elif change.op == "update" and ("role" in change.data or "joined_date" in change.data):
+            self._add_user(user_id, self._users[user_id], -1)
+            self._add_user(user_id, _user_summary(self.users[user_id]), 1)
+        elif change.op == "delete":
+            self._add_user(user_id, self._users[user_id], -1)
+
+    def _apply_event(self, change: Change):
+        event_id = change.key
+        if change.op == "insert":
+            if event_id in self._events:
+                self._add_event(event_id, self._events[event_id], -1)
+            else:
+                self.record_activity(change.data.get("created_by"))
+            self._add_event(event_id, _event_summary(change.data), 1)
+        elif change.op == "update" and not EVENT_FIELDS.isdisjoint(change.data):
+            self._add_event(event_id, self._events[event_id], -1)
+            self._add_event(event_id, _event_summary(self.events[event_id]), 1)
+        elif change.op == "delete":
+            self._add_event(event_id, self._events[event_id], -1)
+        elif change.op in ("attend", "unattend"):
+            delta = 1 if change.op == "attend" else -1
+            category, event_date, attendees = self._events[event_id]
+            self._count_attendance(category, event_date, delta)
+            self._events[event_id] = (category, event_date, attendees + delta)
+            if delta > 0:
+                self.record_activity(change.data)
+
+    def _apply_comment(self, change: Change):
+        if change.op == "insert":
+            self.total_comments += 1
+            self.record_activity(change.data.get("user_id"))
+        elif change.op == "delete":
+            self.total_comments -= 1
+        elif change.op == "purge":
+            self.total_comments -= change.data
+
+    # Counter maintenance
+    def _reset(self):
+        self.events_by_category: Counter = Counter()
+        self.events_by_month: Counter = Counter()
+        self.users_by_role: Counter = Counter()
+        self.users_by_join_month: Counter = Counter()
+        self.attendance_by_category: Counter = Counter()
+        self.attendance: Dict[str, Counter] = {granularity: Counter() for granularity in GRANULARITIES}
+        self.total_attendance = 0
+        self.total_comments = 0
+        # What each record was counted as, to undo it on update or delete
+        self._users: Dict[str, Tuple[Any, str]] = {}
+        self._events: Dict[str, Tuple[Any, Any, int]] = {}
+
+    def _add_user(self, user_id: str, summary: Tuple[Any, str], sign: int):
+        """Count (sign=1) or uncount (sign=-1) a user"""
+        if sign > 0:
+            self._users[user_id] = summary
+        else:
+            del self._users[user_id]
+        role, month = summary
+        self._bump(self.users_by_role, role, sign)
+        self._bump(self.users_by_join_month, month, sign)
+
+    def _add_event(self, event_id: str, summary: Tuple[Any, Any, int], sign: int):
+        """Count (sign=1) or uncount (sign=-1) an event with its attendance"""
+        if sign > 0:
+            self._events[event_id] = summary
+        else:
+            del self._events[event_id]
+        category, event_date, attendees = summary
+        self._bump(self.events_by_category, category, sign)
+        event_buckets = buckets(event_date)
+        if event_buckets is not None:
+            self._bump(self.events_by_month, event_buckets[2], sign)
+        self._count_attendance(category, event_date, sign * attendees)
+
+    def _count_attendance(self, category, event_date, delta: int):
+        if not delta:
+            return
+        self.total_attendance += delta
+        self._bump(self.attendance_by_category, category, delta)
+        event_buckets = buckets(event_date)
+        if event_buckets is not None:
+            for granularity, key in zip(GRANULARITIES, event_buckets):
+                self._bump(self.attendance[granularity], key, delta)
+
+    @staticmethod
+    def _bump(counter: Counter, key, delta: int):
+        counter[key] += delta
+        if counter[key] == 0:
+            del counter[key]
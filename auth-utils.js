@@ -21,6 +21,7 @@ class AuthManager {
             if (userData) {
                 this.currentUser = JSON.parse(userData);
                 console.log('✅ User authenticated:', this.currentUser.email);
+                shareSessionWithServiceWorker(this.authToken);
 
                 // Verify token validity on page load
                 this.verifyToken();
@@ -50,6 +51,7 @@ class AuthManager {
         otherStorage.removeItem('user');
 
         console.log('✅ Authentication updated:', user.email);
+        shareSessionWithServiceWorker(token);
         this.onAuthStateChange(true);
     }
 
@@ -57,6 +59,7 @@ class AuthManager {
      * Clear authentication state
      */
     logout() {
+        endSession(this.apiBase, this.authToken);
         this.authToken = null;
         this.currentUser = null;
 
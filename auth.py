@@ -0,0 +1,194 @@
+"""
+Authentication
+==============
+
+Access tokens and the users they authenticate:
+
+- tokens are HS256 JWTs carrying the user id, an expiry (exp) and a
+  unique id (jti);
+- a token is verified (HMAC, claims, user lookup) the first time it is
+  seen; the resulting AuthUser stays in a bounded LRU cache keyed by the
+  token string, so later requests cost a dict lookup and an expiry check;
+- /auth/logout revokes a token by its jti. Revocations live in a
+  RevocationStore, persisted and shared between workers like the other
+  stores, until the token would have expired anyway. Each revocation
+  evicts the token from the cache of every worker that sees it;
+- updating or deleting a user evicts that user's cached tokens, so a
+  cached name or role is never stale;
+- access tokens carry a fingerprint of the user's password hash, so
+  changing or resetting the password invalidates every token issued
+  before (the update evicts them from the cache, and re-verification
+  then fails);
+- emailed links (verify email, reset password) carry their own tokens,
+  valid for one purpose only and tied to the password the user had when
+  the link was sent, so a reset link stops working once it has been used.
+"""
+
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+import jwt
+
+from store import Change
+
+# Configuration
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL", str(24 * 3600)))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+VERIFY_LINK_TTL = int(os.getenv("VERIFY_LINK_TTL", str(2 * 24 * 3600)))
+RESET_LINK_TTL = int(os.getenv("RESET_LINK_TTL", "3600"))
+# How often expired revocations are dropped from the revocation list
+REVOCATION_PURGE_INTERVAL = 3600
+
+ALGORITHM = "HS256"
+
+
+class AuthUser(NamedTuple):
+    """The user behind a verified token"""
+    id: str
+    email: str
+    name: str
+    role: str
+    token_id: Optional[str]  # jti; None for the demo user
+    expires_at: float
+
+
+def _password_fingerprint(user: Dict[str, Any]) -> str:
+    return hashlib.sha256(user.get("password_hash", "").encode()).hexdigest()[:16]
+
+
+class TokenAuthenticator:
+    """Issues, verifies and revokes access tokens, caching verified ones"""
+
+    def __init__(self, secret: str, users, revocations, ttl: int = ACCESS_TOKEN_TTL,
+                 cache_size: int = TOKEN_CACHE_SIZE):
+        self.secret = secret
+        self.users = users
+        self.revocations = revocations
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, AuthUser]" = OrderedDict()
+        # Cached tokens by user and by jti, for eviction
+        self._by_user: Dict[str, Set[str]] = {}
+        self._by_jti: Dict[str, str] = {}
+        self._purged_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        users.subscribe(self.apply_users)
+        revocations.subscribe(self.apply_revocations)
+
+    def issue(self, user: Dict[str, Any]) -> str:
+        now = int(time.time())
+        return jwt.encode({
+            "sub": user["email"],
+            "user_id": user["id"],
+            "iat": now,
+            "exp": now + self.ttl,
+            "jti": uuid.uuid4().hex,
+            "pwd": _password_fingerprint(user),
+        }, self.secret, algorithm=ALGORITHM)
+
+    def authenticate(self, token: str) -> Optional[AuthUser]:
+        """The user a token belongs to; None if it is invalid, expired or revoked"""
+        cached = self._cache.get(token)
+        if cached is not None:
+            if cached.expires_at > time.time():
+                self._cache.move_to_end(token)
+                self.hits += 1
+                return cached
+            self._evict(token)
+            return None
+
+        self.misses += 1
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=[ALGORITHM],
+                                options={"require": ["exp", "jti", "pwd"]})
+        except jwt.PyJWTError:
+            return None
+        if claims["jti"] in self.revocations:
+            return None
+        user = self.users.get(claims.get("user_id"))
+        if user is None or claims["pwd"] != _password_fingerprint(user):
+            return None  # Unknown user, or the password changed since the token was issued
+        auth_user = AuthUser(user["id"], user["email"], user["name"], user["role"],
+                             claims["jti"], float(claims["exp"]))
+        self._remember(token, auth_user)
+        return auth_user
+
+    def issue_link(self, user: Dict[str, Any], purpose: str, ttl: int) -> str:
+        """Token for an emailed link, good for one purpose ("verify" or "reset")"""
+        now = int(time.time())
+        return jwt.encode({
+            "user_id": user["id"],
+            "purpose": purpose,
+            "pwd": _password_fingerprint(user),
+            "iat": now,
+            "exp": now + ttl,
+        }, self.secret, algorithm=ALGORITHM)
+
+    def verify_link(self, token: str, purpose: str) -> Optional[Dict[str, Any]]:
+        """The user a link token was issued to; None if invalid, expired, or the password changed since"""
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=[ALGORITHM],
+                                options={"require": ["exp", "purpose"]})
+        except jwt.PyJWTError:
+            return None
+        user = self.users.get(claims.get("user_id"))
+        if user is None or claims["purpose"] != purpose or claims.get("pwd") != _password_fingerprint(user):
+            return None
+        return user
+
+    def revoke(self, auth_user: AuthUser) -> bool:
+        """Revoke the token auth_user was authenticated with"""
+        if auth_user.token_id is None:
+            return False
+        now = time.time()
+        if now - self._purged_at >= REVOCATION_PURGE_INTERVAL:
+            self._purged_at = now
+            self.revocations.purge_expired(now)
+        return self.revocations.revoke(auth_user.token_id, auth_user.id, auth_user.expires_at)
+
+    def stats(self) -> Dict[str, int]:
+        return {"cached_tokens": len(self._cache), "cache_size": self.cache_size,
+                "hits": self.hits, "misses": self.misses, "revoked": len(self.revocations)}
+
+    # Store listeners
+    def apply_users(self, changes: List[Change]):
+        for change in changes:
+            if change.op in ("load", "clear"):
+                self._clear()
+            elif change.op in ("update", "delete", "insert"):
+                for token in list(self._by_user.get(change.key, ())):
+                    self._evict(token)
+
+    def apply_revocations(self, changes: List[Change]):
+        for change in changes:
+            if change.op == "load":
+                self._clear()
+            elif change.op == "insert" and change.key in self._by_jti:
+                self._evict(self._by_jti[change.key])
+
+    # Internals
+    def _remember(self, token: str, auth_user: AuthUser):
+        self._cache[token] = auth_user
+        self._by_user.setdefault(auth_user.id, set()).add(token)
+        self._by_jti[auth_user.token_id] = token
+        while len(self._cache) > self.cache_size:
+            self._evict(next(iter(self._cache)))
+
+    def _evict(self, token: str):
+        auth_user = self._cache.pop(token)
+        self._by_jti.pop(auth_user.token_id, None)
+        tokens = self._by_user.get(auth_user.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[auth_user.id]
+
+    def _clear(self):
+        self._cache.clear()
+        self._by_user.clear()
+        self._by_jti.clear()
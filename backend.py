@@ -2,18 +2,22 @@
 Campus Event Manager Backend API
 """
 
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
-import bcrypt
 import jwt
 import os
 import secrets
 
+from password_hashing import password_hasher
+from response_cache import ResponseCache
+from serialization import FastJSONResponse, record_encoder
+from store import UserStore, EventStore
+
 # Configuration
 SECRET_KEY = "your-secret-key-change-in-production"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
@@ -21,10 +25,11 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 # In-memory storage (MongoDB optional)
 class InMemoryDB:
     def __init__(self):
-        self.users = []
-        self.events = []
+        self.users = UserStore()
+        self.events = EventStore()
 
 db = InMemoryDB()
+response_cache = ResponseCache()
 
 # Pydantic Models
 class UserBase(BaseModel):
@@ -62,8 +67,12 @@ class Token(BaseModel):
 class CommentCreate(BaseModel):
     text: str
 
+# Response shapes of stored records, built without re-validating them
+user_response = record_encoder(UserResponse)
+event_response = record_encoder(EventResponse)
+
 # FastAPI app
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -81,50 +90,58 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
 
-def verify_password(plain, hashed):
-    return bcrypt.checkpw(plain.encode('utf-8'), hashed.encode('utf-8'))
+async def verify_password(plain, hashed):
+    return await password_hasher.verify(plain, hashed)
 
-def get_password_hash(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 # API Routes
-users_db = {}
-events_db = {}
-
 @app.post("/auth/register", response_model=Token)
 async def register(user_data: UserCreate):
-    if any(u['email'] == user_data.email for u in db.users):
+    # Hash first: nothing may be awaited between the email check and the insert
+    password_hash = await get_password_hash(user_data.password)
+    if db.users.get_by_email(user_data.email):
         raise HTTPException(status_code=400, detail="Email already registered")
 
     user = {
         "id": str(secrets.token_hex(8)),
         "email": user_data.email,
         "name": user_data.name,
-        "password_hash": get_password_hash(user_data.password),
+        "password_hash": password_hash,
         "role": user_data.role,
         "joined_date": datetime.utcnow()
     }
-    db.users.append(user)
+    try:
+        db.users.insert(user)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Email already registered")
 
     access_token = create_access_token({"sub": user["email"]})
-    user_response = UserResponse(**{k: v for k, v in user.items() if k != 'password_hash'})
-
-    return Token(access_token=access_token, token_type="bearer", user=user_response)
+    return FastJSONResponse({"access_token": access_token, "token_type": "bearer", "user": user_response(user)})
 
 @app.post("/auth/login", response_model=Token)
 async def login(credentials: dict):
-    user = next((u for u in db.users if u['email'] == credentials.get('email')), None)
-    if not user or not verify_password(credentials.get('password'), user['password_hash']):
+    user = db.users.get_by_email(credentials.get('email'))
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    access_token = create_access_token({"sub": user["email"]})
-    user_response = UserResponse(**{k: v for k, v in user.items() if k != 'password_hash'})
+    verified, upgraded_hash = await password_hasher.verify_and_upgrade(
+        credentials.get('password') or "", user['password_hash'])
+    if not verified:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if upgraded_hash:
+        db.users.update(user['id'], {"password_hash": upgraded_hash})
 
-    return Token(access_token=access_token, token_type="bearer", user=user_response)
+    access_token = create_access_token({"sub": user["email"]})
+    return FastJSONResponse({"access_token": access_token, "token_type": "bearer", "user": user_response(user)})
 
 @app.get("/events/", response_model=List[EventResponse])
-async def get_events():
-    return [EventResponse(**event) for event in db.events]
+async def get_events(request: Request):
+    return response_cache.respond(
+        request, "events", db.events.version,
+        lambda: [event_response(event) for event in db.events.values()]
+    )
 
 @app.post("/events/", response_model=EventResponse)
 async def create_event(event_data: EventCreate):
@@ -138,21 +155,29 @@ async def create_event(event_data: EventCreate):
         "description": event_data.description,
         "comments": []
     }
-    db.events.append(event)
-    return EventResponse(**event)
+    db.events.insert(event)
+    return FastJSONResponse(event_response(event))
+
+@app.get("/admin/metrics/password-hashing")
+async def get_password_hashing_metrics():
+    return password_hasher.stats()
+
+@app.on_event("shutdown")
+async def stop_password_hasher():
+    password_hasher.shutdown()
 
 @app.post("/events/{event_id}/comments")
 async def add_comment(event_id: str, comment_data: CommentCreate):
-    for event in db.events:
-        if event['id'] == event_id:
-            comment = {
-                "id": str(secrets.token_hex(8)),
-                "author": "Anonymous User",  # Would get from auth in real app
-                "author_id": str(secrets.token_hex(8)),
-                "text": comment_data.text,
-                "timestamp": datetime.utcnow(),
-                "timestamp_formatted": datetime.utcnow().strftime("%Y-%m-%d %H:%M")
-            }
-            event['comments'].append(comment)
-            return {"message": "Comment added successfully", "comment": comment}
-    raise HTTPException(status_code=404, detail="Event not found")
+    if event_id not in db.events:
+        raise HTTPException(status_code=404, detail="Event not found")
+
+    comment = {
+        "id": str(secrets.token_hex(8)),
+        "author": "Anonymous User",  # Would get from auth in real app
+        "author_id": str(secrets.token_hex(8)),
+        "text": comment_data.text,
+        "timestamp": datetime.utcnow(),
+        "timestamp_formatted": datetime.utcnow().strftime("%Y-%m-%d %H:%M")
+    }
+    db.events.add_comment(event_id, comment)
+    return {"message": "Comment added successfully", "comment": comment}
@@ -0,0 +1,128 @@
+"""
+Attendance Contention Benchmark
+===============================
+
+Many users clicking "attend" on one capped event at the same moment:
+
+- in-process: N concurrent POST /events/{id}/attend requests against the
+  app over an ASGI transport;
+- multi-process: W workers sharing a SQLite change log (the sqlite storage
+  backend), each claiming seats for its share of the users.
+
+Either way the event must end up with exactly `capacity` distinct
+attendees and everyone else on the waitlist.
+
+    python bench/attendance_contention.py --users 5000 --capacity 500 --workers 4
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DATA_DIR", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+from sqlite_storage import SQLiteBackend  # noqa: E402
+from store import EventStore  # noqa: E402
+
+EVENT = {"id": "concert", "title": "Concert", "date": "2030-01-01", "time": "20:00",
+         "location": "Main Hall", "category": "music", "created_by": "1"}
+
+
+def check(event, users: int, capacity: int) -> str:
+    attendees, waitlist = event["attendees"], event["waitlist"]
+    assert len(attendees) == len(set(attendees)) == min(users, capacity), "oversold or duplicated seats"
+    assert len(waitlist) == len(set(waitlist)) == max(users - capacity, 0), "waitlist lost users"
+    assert not set(attendees) & set(waitlist), "user both attending and waitlisted"
+    return f"{len(attendees)} attending, {len(waitlist)} waitlisted"
+
+
+async def in_process(users: int, capacity: int):
+    from simple_backend import app, create_access_token, events_db, users_db
+
+    event_id = events_db.insert({**EVENT, "capacity": capacity})["id"]
+    tokens = []
+    for user in range(users):
+        record = users_db.insert({"id": f"u{user}", "email": f"u{user}@bench.edu", "name": f"User {user}",
+                                  "role": "student", "password_hash": "", "joined_date": "2030-01-01",
+                                  "points": 0})
+        tokens.append(create_access_token(record))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def attend(user: int) -> float:
+            started = time.perf_counter()
+            response = await client.post(f"/events/{event_id}/attend", json={"attend": True},
+                                         headers={"Authorization": f"Bearer {tokens[user]}"})
+            response.raise_for_status()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = sorted(await asyncio.gather(*(attend(user) for user in range(users))))
+        elapsed = time.perf_counter() - started
+
+    print(f"in-process: {users} requests in {elapsed:.2f}s ({users / elapsed:,.0f} req/s), "
+          f"p50 {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+    print("  " + check(events_db[event_id], users, capacity))
+
+
+def _worker(path: str, worker: int, workers: int, users: int, barrier):
+    events = EventStore()
+    backend = SQLiteBackend([events], path=path)
+    backend.open()
+    barrier.wait()
+    for user in range(worker, users, workers):
+        events.attend(EVENT["id"], f"u{user}")
+    backend.close()
+
+
+def multi_process(users: int, capacity: int, workers: int):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "contention.db")
+        events = EventStore()
+        backend = SQLiteBackend([events], path=path)
+        backend.open()
+        events.insert({**EVENT, "capacity": capacity})
+        backend.close()
+
+        barrier = multiprocessing.Barrier(workers + 1)
+        processes = [multiprocessing.Process(target=_worker, args=(path, w, workers, users, barrier))
+                     for w in range(workers)]
+        for process in processes:
+            process.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        events = EventStore()
+        backend = SQLiteBackend([events], path=path)
+        backend.open()
+        print(f"{workers} workers (sqlite): {users} attends in {elapsed:.2f}s ({users / elapsed:,.0f}/s)")
+        print("  " + check(events[EVENT["id"]], users, capacity))
+        backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--capacity", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    asyncio.run(in_process(args.users, args.capacity))
+    if args.workers > 0:
+        multi_process(args.users, args.capacity, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Authentication Overhead Benchmark
+=================================
+
+Per-request cost of the current_user dependency:
+
+- TokenAuthenticator.authenticate() on a cached token (hit) and on a
+  token seen for the first time (miss: HMAC check, claims, user lookup);
+- current_user() itself on a cache hit: header parsing plus the lookup,
+  which is the authentication work a request pays for;
+- whole requests through the ASGI app to three identical no-op
+  endpoints: no dependency, a no-op dependency and current_user. The
+  first difference is FastAPI's cost for having any dependency at all,
+  the second what authenticating adds on top.
+
+    python bench/auth_overhead.py --iterations 20000
+
+Timings are the best of several rounds, to keep scheduler noise out.
+Exits non-zero if current_user() on a cache hit is above --budget-us.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import warnings
+
+os.environ.setdefault("DATA_DIR", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore", message=".*HMAC key.*")
+
+from fastapi import Depends, Request  # noqa: E402
+
+from simple_backend import app, authenticator, create_access_token, current_user, users_db  # noqa: E402
+
+ROUNDS = 7
+
+
+async def no_dependency(request: Request):
+    return None
+
+
+@app.get("/__bench/open")
+async def bench_open():
+    return {}
+
+
+@app.get("/__bench/dependency")
+async def bench_dependency(nothing=Depends(no_dependency)):
+    return {}
+
+
+@app.get("/__bench/authenticated")
+async def bench_authenticated(user=Depends(current_user)):
+    return {}
+
+
+# Ahead of the SPA catch-all route, which would otherwise answer all three
+app.router.routes[:0] = [app.router.routes.pop() for _ in range(3)]
+
+
+def scope_for(path: str, token: str):
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": b"", "server": ("bench", 80), "client": ("127.0.0.1", 1),
+        "headers": [(b"host", b"bench"), (b"authorization", f"Bearer {token}".encode())],
+    }
+
+
+def best_us(run, iterations: int) -> float:
+    """Best per-iteration time over ROUNDS rounds of run(iterations)"""
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        run(iterations)
+        timings.append((time.perf_counter() - started) / iterations * 1e6)
+    return min(timings)
+
+
+async def async_best_us(run, iterations: int) -> float:
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        await run(iterations)
+        timings.append((time.perf_counter() - started) / iterations * 1e6)
+    return min(timings)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--budget-us", type=float, default=20.0)
+    args = parser.parse_args()
+
+    user = users_db["1"]
+    token = create_access_token(user)
+    authenticator.authenticate(token)
+
+    def hits(n):
+        for _ in range(n):
+            authenticator.authenticate(token)
+
+    fresh = [create_access_token(user) for _ in range(1000 * ROUNDS)]
+    tokens = iter(fresh)
+
+    def misses(n):
+        for _ in range(n):
+            authenticator.authenticate(next(tokens))
+
+    print(f"authenticate(): cache hit {best_us(hits, args.iterations):.2f} us, "
+          f"miss {best_us(misses, 1000):.2f} us")
+
+    request = Request(scope_for("/", token))
+
+    async def dependency(n):
+        for _ in range(n):
+            await current_user(request)
+
+    dependency_us = await async_best_us(dependency, args.iterations)
+    print(f"current_user() on a cache hit: {dependency_us:.2f} us (budget {args.budget_us:.0f} us)")
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start" and message["status"] != 200:
+            raise RuntimeError(f"answered {message['status']}")
+
+    def requests_to(path):
+        scope = scope_for(path, token)
+
+        async def run(n):
+            for _ in range(n):
+                await app(dict(scope), receive, send)
+        return run
+
+    per_request = {}
+    for name in ("open", "dependency", "authenticated"):
+        run = requests_to(f"/__bench/{name}")
+        await run(500)  # warm up
+        per_request[name] = await async_best_us(run, max(args.iterations // 10, 100))
+    print(f"request: no dependency {per_request['open']:.1f} us, "
+          f"no-op dependency {per_request['dependency']:.1f} us, "
+          f"current_user {per_request['authenticated']:.1f} us")
+    print(f"  FastAPI dependency plumbing {per_request['dependency'] - per_request['open']:.1f} us, "
+          f"authentication {per_request['authenticated'] - per_request['dependency']:.1f} us")
+    print(f"authenticator: {authenticator.stats()}")
+    if dependency_us > args.budget_us:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+"""
+Bulk Import Benchmark
+=====================
+
+How long onboarding N events takes: one streamed CSV upload to
+/admin/import, against POST /events/ once per event (what club admins
+did before). The per-event side is timed on --per-event-sample events and
+extrapolated to N, since at 100k it runs for a long time. The export of
+everything that was imported is timed as well.
+
+    python bench/bulk_import.py --events 100000
+
+Exits non-zero if the import takes longer than --budget-s.
+"""
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+os.environ.setdefault("DATA_DIR", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore", message=".*HMAC key.*")
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from simple_backend import app, create_access_token, events_db, users_db  # noqa: E402
+
+CATEGORIES = ("academic", "social", "sports", "career", "arts")
+
+
+def event(index: int) -> dict:
+    return {"title": f"Event {index}", "date": f"2032-{index % 12 + 1:02d}-{index % 28 + 1:02d}", "time": "18:00",
+            "location": f"Hall {index % 50}", "category": CATEGORIES[index % len(CATEGORIES)],
+            "description": f"Event number {index}", "capacity": 50 + index % 200}
+
+
+def csv_body(count: int) -> bytes:
+    columns = list(event(0))
+    lines = [",".join(columns)] + [",".join(str(event(index)[column]) for column in columns) for index in range(count)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--per-event-sample", type=int, default=500)
+    parser.add_argument("--budget-s", type=float, default=30.0)
+    args = parser.parse_args()
+
+    client = TestClient(app)
+    client.headers["Authorization"] = f"Bearer {create_access_token(users_db['1'])}"
+
+    started = time.perf_counter()
+    for index in range(args.per_event_sample):
+        client.post("/events/", json=event(index)).raise_for_status()
+    per_event = (time.perf_counter() - started) / args.per_event_sample
+    print(f"POST /events/: {per_event * 1000:.2f} ms per event, "
+          f"{per_event * args.events / 60:.1f} min for {args.events:,} (extrapolated)")
+
+    body = csv_body(args.events)
+    started = time.perf_counter()
+    report = client.post("/admin/import?kind=events", content=body).json()
+    elapsed = time.perf_counter() - started
+    print(f"/admin/import: {report['imported']:,} events in {elapsed:.2f}s "
+          f"({len(body) / 2 ** 20:.1f} MiB, {report['failed']} failed)")
+
+    started = time.perf_counter()
+    with client.stream("GET", "/admin/export?kind=events") as response:
+        lines = sum(1 for _ in response.iter_lines())
+    print(f"/admin/export: {lines - 1:,} of {len(events_db):,} events in {time.perf_counter() - started:.2f}s")
+    if elapsed > args.budget_s:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Leaderboard Benchmark
+=====================
+
+What the leaderboard widget costs per page view with U users whose points
+keep changing: top 10, the viewer's rank in every scope and the users
+around them, against sorting every user on every request (what a
+leaderboard without an index has to do).
+
+    python bench/leaderboard.py --users 200000 --churn 10
+
+Exits non-zero if the p99 of a leaderboard view is above --budget-ms.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from leaderboard import SCOPES, Leaderboard  # noqa: E402
+from store import UserStore  # noqa: E402
+
+COLLEGES = 50
+ROLES = ("student", "faculty", "organizer")
+
+
+def populate(count: int, rng: random.Random) -> UserStore:
+    users = UserStore()
+    for index in range(count):
+        users.insert({"id": f"u{index}", "email": f"user{index}@bench.edu", "name": f"User {index}",
+                      "role": rng.choice(ROLES), "college": f"college-{rng.randrange(COLLEGES)}",
+                      "points": int(rng.paretovariate(1.5) * 50)})
+    return users
+
+
+def view(leaderboard: Leaderboard, user_id: str):
+    """Everything one render of the widget asks for"""
+    leaderboard.top(10)
+    leaderboard.around(user_id, 5)
+    for scope in SCOPES:
+        leaderboard.rank(user_id, scope)
+
+
+def naive_view(users: UserStore, user_id: str):
+    ranked = sorted(users.values(), key=lambda user: -user["points"])
+    ranked[:10]
+    me = users[user_id]
+    sum(1 for user in ranked if user["points"] > me["points"])
+
+
+def percentiles(latencies):
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--churn", type=int, default=10, help="points changes between views")
+    parser.add_argument("--naive-requests", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    users = populate(args.users, rng)
+    leaderboard = Leaderboard(users)
+    started = time.perf_counter()
+    leaderboard.attach()
+    print(f"{args.users:,} users; rebuild: {time.perf_counter() - started:.2f}s, {leaderboard.stats()['lists']}")
+
+    latencies, write_time = [], 0.0
+    for _ in range(args.requests):
+        for _ in range(args.churn):
+            user_id = f"u{rng.randrange(args.users)}"
+            write_started = time.perf_counter()
+            users.update(user_id, {"points": users[user_id]["points"] + rng.choice((5, 10, 25))})
+            write_time += time.perf_counter() - write_started
+        user_id = f"u{rng.randrange(args.users)}"
+        view_started = time.perf_counter()
+        view(leaderboard, user_id)
+        latencies.append(time.perf_counter() - view_started)
+    p50, p99 = percentiles(latencies)
+    print(f"leaderboard view: p50 {p50:.3f} ms, p99 {p99:.3f} ms (budget {args.budget_ms} ms)")
+    if args.churn:
+        print(f"points update (store + leaderboard): {write_time / (args.requests * args.churn) * 1e6:.1f} us")
+
+    naive = []
+    for _ in range(args.naive_requests):
+        user_id = f"u{rng.randrange(args.users)}"
+        view_started = time.perf_counter()
+        naive_view(users, user_id)
+        naive.append(time.perf_counter() - view_started)
+    p50, _ = percentiles(naive)
+    print(f"sort on every view: p50 {p50:.1f} ms")
+    if p99 > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
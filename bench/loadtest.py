@@ -0,0 +1,394 @@
+"""
+Load Test
+=========
+
+Throughput and latency of simple_backend.app or backend.app under a
+workload, per endpoint:
+
+    python bench/loadtest.py run --app simple_backend --workload mixed --duration 20 --out new.json
+    python bench/loadtest.py compare old.json new.json
+
+- the app runs in this process behind an ASGI transport (default), or
+  with --port in a uvicorn server started for the run;
+- the stores are seeded with synthetic data first (--users, --events,
+  --comments and --attendees per event); --sessions users log in before
+  the clock starts, and authenticated requests use their tokens;
+- workloads (workloads.py): browse (list-heavy reads), login (a login
+  storm), attend (bursts on a few popular events), upload and mixed for
+  simple_backend; browse, login, comment and mixed for backend;
+- the report gives requests, errors (status >= 400 or no response),
+  requests/s and p50/p95/p99 latency per endpoint; --out saves it as JSON
+  with the commit it was measured at, and compare flags endpoints whose
+  p99 or throughput got worse by more than --threshold percent (exit 1).
+
+Real traffic can be recorded and replayed:
+
+    python bench/loadtest.py serve --port 8001 --users 0 --events 0 --record
+    python bench/loadtest.py replay bench/requests.jsonl --users 0 --events 0 --speed 1
+
+serve runs the app with the same synthetic data and appends every request
+to bench/requests.jsonl (recording.py). replay sends them again in order,
+as fast as --concurrency allows or, with --speed, at the recorded pace
+(2 = twice as fast). In-process, recorded bearer tokens are swapped for
+fresh ones for the same user, so recordings outlive token expiry.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import warnings
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+os.environ.setdefault("DATA_DIR", "")
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+warnings.filterwarnings("ignore", message=".*HMAC key.*")
+
+import httpx  # noqa: E402
+
+from recording import RecordingMiddleware, load_calls  # noqa: E402
+from workloads import PASSWORD, SEEDERS, WORKLOADS, Call, Dataset, Scale, dataset, picker  # noqa: E402
+
+DEFAULT_RECORDING = os.path.join(BENCH_DIR, "requests.jsonl")
+DEFAULT_SCALE = Scale()
+SERVER_START_TIMEOUT = 60
+
+
+# Running a load
+async def run_load(client: httpx.AsyncClient, next_call: Callable[[], Optional[Call]], concurrency: int,
+                   duration: Optional[float] = None, limit: Optional[int] = None,
+                   speed: float = 0.0) -> Dict[str, Any]:
+    """Send calls from concurrency workers until duration, limit or the calls run out"""
+    samples: Dict[str, List[float]] = defaultdict(list)
+    errors: Counter = Counter()
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+    sent = 0
+
+    async def worker():
+        nonlocal sent
+        while (deadline is None or time.perf_counter() < deadline) and (limit is None or sent < limit):
+            call = next_call()
+            if call is None:
+                return
+            sent += 1
+            if speed and call.at is not None:
+                delay = started + call.at / speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            request_started = time.perf_counter()
+            try:
+                response = await client.request(call.method, call.path, params=call.params, json=call.json,
+                                                files=call.files, content=call.content, headers=call.headers)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            samples[call.label].append(time.perf_counter() - request_started)
+            statuses[call.label][status] += 1
+            if status == 0 or status >= 400:
+                errors[call.label] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(samples, errors, statuses, time.perf_counter() - started)
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+def _stats(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / elapsed, 1),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def summarize(samples: Dict[str, List[float]], errors: Counter, statuses: Dict[str, Counter],
+              elapsed: float) -> Dict[str, Any]:
+    endpoints = {}
+    for label in sorted(samples):
+        endpoints[label] = _stats(samples[label], errors[label], elapsed)
+        endpoints[label]["statuses"] = {str(status): count for status, count in sorted(statuses[label].items())}
+    everything = [latency for latencies in samples.values() for latency in latencies]
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "total": _stats(everything, sum(errors.values()), elapsed) if everything else {},
+        "endpoints": endpoints,
+    }
+
+
+# Targets
+def import_app(name: str, scale: Scale, seed: int):
+    module = importlib.import_module(name)
+    SEEDERS[name](module, scale, seed)
+    return module
+
+
+async def log_in(client: httpx.AsyncClient, data: Dataset, sessions: int) -> Dataset:
+    """data with tokens for its first sessions users"""
+    async def token(email):
+        response = await client.post("/auth/login", json={"email": email, "password": PASSWORD})
+        response.raise_for_status()
+        return response.json()["access_token"]
+
+    tokens = await asyncio.gather(*(token(email) for email in data.emails[:sessions]))
+    return data._replace(tokens=list(tokens))
+
+
+def scale_args(scale: Scale) -> List[str]:
+    return ["--users", str(scale.users), "--events", str(scale.events),
+            "--comments", str(scale.comments), "--attendees", str(scale.attendees)]
+
+
+class Server:
+    """bench/loadtest.py serve in a subprocess, for the duration of a with block"""
+
+    def __init__(self, app: str, scale: Scale, seed: int, port: int):
+        self.command = [sys.executable, os.path.abspath(__file__), "serve", "--app", app, "--port", str(port),
+                        "--seed", str(seed)] + scale_args(scale)
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.command, cwd=ROOT)
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server exited with status {self.process.returncode}")
+            try:
+                httpx.get(f"{self.base_url}/admin/metrics/password-hashing", timeout=1)
+                return self
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError(f"server did not start within {SERVER_START_TIMEOUT}s")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+
+
+async def measure(args, scale: Scale, calls: Callable[[Dataset, Any], Callable[[], Optional[Call]]]
+                  ) -> Dict[str, Any]:
+    """Start the target, log sessions in, then run the load; calls gets the app module in-process"""
+    duration = getattr(args, "duration", None)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    if args.port:
+        with Server(args.app, scale, args.seed, args.port) as server:
+            async with httpx.AsyncClient(base_url=server.base_url, limits=limits, timeout=60) as client:
+                data = await log_in(client, dataset(scale), args.sessions)
+                return await run_load(client, calls(data, None), args.concurrency, duration, args.requests,
+                                      args.speed)
+
+    module = import_app(args.app, scale, args.seed)
+    transport = httpx.ASGITransport(app=module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        data = await log_in(client, dataset(scale), args.sessions)
+        return await run_load(client, calls(data, module), args.concurrency, duration, args.requests, args.speed)
+
+
+def reissue_tokens(module) -> Callable[[str], Optional[str]]:
+    """Swaps a recorded token for a new one for the same user, if the app can issue it"""
+    import jwt
+
+    issued: Dict[str, Optional[str]] = {}
+
+    def token_for(token: str) -> Optional[str]:
+        if token not in issued:
+            try:
+                user_id = jwt.decode(token, options={"verify_signature": False}).get("user_id")
+            except jwt.PyJWTError:
+                user_id = None
+            users = getattr(module, "users_db", None)
+            user = users.get(user_id) if users is not None and user_id is not None else None
+            issued[token] = module.create_access_token(user) if user is not None else None
+        return issued[token]
+    return token_for
+
+
+# Results
+def commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results: Dict[str, Any]):
+    meta = results["meta"]
+    print(f"{meta['app']} / {meta['workload']} ({meta['mode']}, concurrency {meta['concurrency']}, "
+          f"commit {meta['commit']}): {results['elapsed_s']:.1f}s")
+    print(f"{'endpoint':<34} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    rows = list(results["endpoints"].items())
+    if results["total"]:
+        rows.append(("total", results["total"]))
+    for label, stats in rows:
+        print(f"{label:<34} {stats['requests']:>9} {stats['errors']:>7} {stats['rps']:>9.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> List[str]:
+    """Print old vs new per endpoint; returns the endpoints that regressed"""
+    def change(before, after):
+        return (after - before) / before * 100 if before else 0.0
+
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    print(f"{'endpoint':<34} {'req/s':>17} {'p50 ms':>17} {'p99 ms':>17}")
+    regressions = []
+    old_rows = {**old["endpoints"], "total": old["total"]}
+    new_rows = {**new["endpoints"], "total": new["total"]}
+    for label in [label for label in new_rows if label in old_rows]:
+        before, after = old_rows[label], new_rows[label]
+        if not before or not after:
+            continue
+        rps, p50, p99 = (change(before[key], after[key]) for key in ("rps", "p50_ms", "p99_ms"))
+        regressed = p99 > threshold or rps < -threshold
+        if regressed:
+            regressions.append(label)
+        print(f"{label:<34} {after['rps']:>9.1f} {rps:>+6.1f}% {after['p50_ms']:>9.2f} {p50:>+6.1f}% "
+              f"{after['p99_ms']:>9.2f} {p99:>+6.1f}%{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def finish(args, scale: Scale, workload: str, mode: str, results: Dict[str, Any]):
+    results["meta"] = {
+        "app": args.app,
+        "workload": workload,
+        "mode": mode,
+        "scale": scale._asdict(),
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "commit": commit(),
+        "python": platform.python_version(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+    }
+    results = {"meta": results.pop("meta"), **results}
+    report(results)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        print()
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+# Commands
+def cmd_run(args):
+    workloads = WORKLOADS[args.app]
+    if args.workload not in workloads:
+        sys.exit(f"{args.app} has no {args.workload} workload (choose from {', '.join(workloads)})")
+    scale = Scale(args.users, args.events, args.comments, args.attendees)
+    results = asyncio.run(measure(args, scale, lambda data, module: picker(workloads[args.workload], data, args.seed)))
+    finish(args, scale, args.workload, "port" if args.port else "in-process", results)
+
+
+def cmd_replay(args):
+    scale = Scale(args.users, args.events, args.comments, args.attendees)
+
+    def calls(data, module):
+        remaining = iter(load_calls(args.recording, reissue_tokens(module) if module is not None else None))
+        return lambda: next(remaining, None)
+
+    results = asyncio.run(measure(args, scale, calls))
+    finish(args, scale, f"replay:{os.path.basename(args.recording)}", "port" if args.port else "in-process",
+           results)
+
+
+def cmd_serve(args):
+    import uvicorn
+
+    module = import_app(args.app, Scale(args.users, args.events, args.comments, args.attendees), args.seed)
+    app = module.app
+    if args.record:
+        app = RecordingMiddleware(app, args.record)
+        print(f"recording requests to {args.record}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+def cmd_compare(args):
+    with open(args.old, encoding="utf-8") as file:
+        old = json.load(file)
+    with open(args.new, encoding="utf-8") as file:
+        new = json.load(file)
+    if compare(old, new, args.threshold):
+        sys.exit(1)
+
+
+def add_target_arguments(parser, port_default: int = 0):
+    parser.add_argument("--app", choices=sorted(SEEDERS), default="simple_backend")
+    parser.add_argument("--port", type=int, default=port_default,
+                        help="serve the app with uvicorn on this port (0: in-process)")
+    parser.add_argument("--users", type=int, default=DEFAULT_SCALE.users)
+    parser.add_argument("--events", type=int, default=DEFAULT_SCALE.events)
+    parser.add_argument("--comments", type=int, default=DEFAULT_SCALE.comments, help="per event")
+    parser.add_argument("--attendees", type=int, default=DEFAULT_SCALE.attendees, help="per event")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def add_load_arguments(parser, sessions_default: int):
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--sessions", type=int, default=sessions_default, help="users logged in before the run")
+    parser.add_argument("--requests", type=int, default=None, help="stop after this many requests")
+    parser.add_argument("--out", help="save the results as JSON")
+    parser.add_argument("--baseline", help="compare with earlier results (JSON)")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run a synthetic workload")
+    add_target_arguments(run)
+    add_load_arguments(run, sessions_default=20)
+    run.add_argument("--workload", default="mixed")
+    run.add_argument("--duration", type=float, default=10.0, help="seconds")
+    run.set_defaults(func=cmd_run, speed=0.0)
+
+    replay = commands.add_parser("replay", help="replay recorded requests")
+    replay.add_argument("recording", nargs="?", default=DEFAULT_RECORDING)
+    add_target_arguments(replay)
+    add_load_arguments(replay, sessions_default=0)
+    replay.add_argument("--speed", type=float, default=0.0, help="recorded pace multiplier (0: flat out)")
+    replay.set_defaults(func=cmd_replay)
+
+    serve = commands.add_parser("serve", help="serve the app with synthetic data, optionally recording")
+    add_target_arguments(serve, port_default=8001)
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--record", nargs="?", const=DEFAULT_RECORDING, help="append requests to this file")
+    serve.set_defaults(func=cmd_serve)
+
+    compare_parser = commands.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="percent")
+    compare_parser.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Recommendations Benchmark
+=========================
+
+/recommendations at campus scale: U users attending events with a skewed
+(Zipf-like) popularity, some favorites, then
+
+- a full rebuild of the model from the stores;
+- recommend() for random users while attends and favorites keep coming
+  in between (--churn writes per request), so every request also pays
+  for refreshing the rows those writes changed;
+- the cost of one write to the model (the store listener).
+
+    python bench/recommendations.py --users 200000 --events 2000 --churn 10
+
+Exits non-zero if the p99 of recommend() is above --budget-ms.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from recommendations import Recommender  # noqa: E402
+from store import EventStore, FavoriteStore  # noqa: E402
+
+
+def populate(users: int, event_count: int, per_user: float, seed: int):
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, event_count + 1) ** 0.8
+    weights /= weights.sum()
+    attendees = [[] for _ in range(event_count)]
+    for user in range(users):
+        count = min(rng.geometric(1 / per_user), event_count)
+        for event in rng.choice(event_count, size=count, replace=False, p=weights):
+            attendees[event].append(f"u{user}")
+
+    events, favorites = EventStore(), FavoriteStore()
+    for event, people in enumerate(attendees):
+        events.insert({"id": f"e{event}", "title": f"Event {event}", "date": "2030-06-01", "time": "18:00",
+                       "location": "Hall", "category": "social", "created_by": "u0",
+                       "attendees": people, "waitlist": []})
+    for user in rng.choice(users, size=users // 5, replace=False):
+        for event in rng.choice(event_count, size=rng.integers(1, 4), replace=False, p=weights):
+            favorites.add(f"u{user}", f"e{event}")
+    return events, favorites, sum(len(people) for people in attendees)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--per-user", type=float, default=8.0, help="mean events attended per user")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--churn", type=int, default=10, help="attends/favorites between requests")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    events, favorites, attendance = populate(args.users, args.events, args.per_user, args.seed)
+    print(f"{args.users:,} users, {args.events:,} events, {attendance:,} attendances "
+          f"(generated in {time.perf_counter() - started:.1f}s)")
+
+    recommender = Recommender(events, favorites)
+    started = time.perf_counter()
+    recommender.attach()
+    print(f"rebuild: {time.perf_counter() - started:.2f}s, {recommender.stats()}")
+
+    rng = random.Random(args.seed)
+    latencies, write_time, writes = [], 0.0, 0
+    for _ in range(args.requests):
+        for _ in range(args.churn):
+            user, event = f"u{rng.randrange(args.users)}", f"e{rng.randrange(args.events)}"
+            write_started = time.perf_counter()
+            if rng.random() < 0.8:
+                events.add_attendee(event, user)
+            else:
+                favorites.add(user, event)
+            write_time += time.perf_counter() - write_started
+            writes += 1
+        user = f"u{rng.randrange(args.users)}"
+        request_started = time.perf_counter()
+        recommender.recommend(user, args.limit)
+        latencies.append(time.perf_counter() - request_started)
+
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"recommend(): p50 {p50:.2f} ms, p99 {p99:.2f} ms, max {latencies[-1] * 1000:.2f} ms "
+          f"(budget {args.budget_ms:.0f} ms, {args.churn} writes between requests)")
+    if writes:
+        print(f"write (store + model): {write_time / writes * 1e6:.1f} us")
+    if p99 > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Traffic Recording and Replay
+============================
+
+RecordingMiddleware wraps an ASGI app and appends every HTTP request it
+serves to a JSON-lines file, one object per request:
+
+    {"at": 1.234, "method": "POST", "path": "/events/1/attend", "query": "",
+     "headers": {"content-type": "application/json", "authorization": "Bearer ..."},
+     "body": "<base64>", "status": 200}
+
+at is seconds since the first recorded request. Only the headers needed
+to replay a request are kept. load_calls() turns a recording back into
+Calls for bench/loadtest.py, labelled by route with ids replaced by {id}
+so a replay reports per endpoint like a synthetic run.
+"""
+
+import base64
+import json
+import re
+import time
+from typing import Callable, Dict, List, Optional
+
+from workloads import Call
+
+KEPT_HEADERS = (b"content-type", b"authorization", b"accept", b"accept-encoding")
+# Path segments that look like record ids: numbers, hex digests, bench-* ids
+ID_SEGMENT = re.compile(r"^(\d+|[0-9a-f]{16,}|bench-[a-z]\d+)$")
+
+
+class RecordingMiddleware:
+    """Appends each HTTP request passing through to a JSON-lines file"""
+
+    def __init__(self, app, path: str):
+        self.app = app
+        self.file = open(path, "a", encoding="utf-8")
+        self.started: Optional[float] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        body = []
+        status = []
+
+        async def recording_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                body.append(message.get("body", b""))
+            return message
+
+        async def recording_send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, recording_receive, recording_send)
+        finally:
+            self._write({
+                "at": round(now - self.started, 6),
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope["query_string"].decode("latin-1"),
+                "headers": {name.decode("latin-1"): value.decode("latin-1")
+                            for name, value in scope["headers"] if name in KEPT_HEADERS},
+                "body": base64.b64encode(b"".join(body)).decode("ascii"),
+                "status": status[0] if status else None,
+            })
+
+    def _write(self, entry: Dict):
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+
+
+def route_label(method: str, path: str) -> str:
+    segments = ["{id}" if ID_SEGMENT.match(segment) else segment for segment in path.split("/")]
+    return f"{method} {'/'.join(segments)}"
+
+
+def load_calls(path: str, token_for: Optional[Callable[[str], Optional[str]]] = None) -> List[Call]:
+    """The requests of a recording, in order; token_for may swap recorded bearer tokens"""
+    calls = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            headers = dict(entry.get("headers", {}))
+            authorization = headers.get("authorization", "")
+            if token_for is not None and authorization.startswith("Bearer "):
+                token = token_for(authorization[len("Bearer "):])
+                if token is not None:
+                    headers["authorization"] = f"Bearer {token}"
+            path_and_query = entry["path"] + (f"?{entry['query']}" if entry.get("query") else "")
+            calls.append(Call(route_label(entry["method"], entry["path"]), entry["method"], path_and_query,
+                              headers=headers, content=base64.b64decode(entry.get("body", "")),
+                              at=entry.get("at")))
+    return calls
@@ -0,0 +1,138 @@
+"""
+Serialization Benchmark
+=======================
+
+Cost of turning stored records into a response body, per endpoint:
+
+- before: what FastAPI did with the previous code -- build a pydantic
+  model per record (validation), run the response_model check where the
+  route has one, jsonable_encoder, then json.dumps as JSONResponse does;
+- after: record_encoder projections encoded directly by
+  serialization.dumps (orjson, or json when it is not installed).
+
+    python bench/serialization_cost.py --events 500 --comments 10
+
+Both sides produce the same JSON document; the benchmark checks that
+before timing anything. Timings are the best of several rounds.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+from datetime import datetime
+from typing import List, Union
+
+os.environ.setdefault("DATA_DIR", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore", message=".*HMAC key.*")
+warnings.filterwarnings("ignore", category=DeprecationWarning)  # .dict() on the "before" side
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+import backend  # noqa: E402
+import simple_backend as sb  # noqa: E402
+import serialization  # noqa: E402
+from workloads import Scale, seed_backend, seed_simple_backend  # noqa: E402
+
+ROUNDS = 5
+
+
+def starlette_dumps(content) -> bytes:
+    """JSONResponse.render"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def best_us(run, iterations: int) -> float:
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            run()
+        timings.append((time.perf_counter() - started) / iterations * 1e6)
+    return min(timings)
+
+
+def old_event(event):
+    return sb.EventResponse(**{**event, "comments": sb.comments_db.latest(event["id"], sb.COMMENT_PREVIEW),
+                               "comments_count": sb.comments_db.count(event["id"])})
+
+
+def cases(page_ids: List[str]):
+    events = list(sb.events_db.values())
+    page = [sb.events_db[event_id] for event_id in page_ids]
+    user = sb.users_db.get_by_email("user0@bench.edu")
+    page_adapter = TypeAdapter(Union[List[sb.EventResponse], sb.EventPage])
+    backend_events = list(backend.db.events.values())
+    backend_user = backend.db.users.get_by_email("user0@bench.edu")
+
+    return [
+        ("GET /events/ (full list)",
+         lambda: starlette_dumps(jsonable_encoder([old_event(event) for event in events])),
+         lambda: serialization.dumps([sb.event_response(event) for event in events])),
+        ("GET /events/?limit=20",
+         lambda: starlette_dumps(jsonable_encoder(page_adapter.validate_python(
+             {"events": [old_event(event).dict() for event in page], "next_cursor": None}))),
+         lambda: serialization.dumps({"events": [sb.event_response(event) for event in page],
+                                      "next_cursor": None})),
+        ("GET /events/{id}",
+         lambda: starlette_dumps(jsonable_encoder(old_event(page[0]))),
+         lambda: serialization.dumps(sb.event_response(page[0]))),
+        ("POST /auth/login",
+         lambda: starlette_dumps(jsonable_encoder({"access_token": "t", "token_type": "bearer", "user": sb.UserResponse(
+             id=user["id"], email=user["email"], name=user["name"], role=user["role"],
+             joined_date=user["joined_date"], points=user["points"]).dict()})),
+         lambda: serialization.dumps({"access_token": "t", "token_type": "bearer",
+                                      "user": sb.user_response(user)})),
+        ("backend.py GET /events/ (datetimes)",
+         lambda: starlette_dumps(jsonable_encoder([backend.EventResponse(**event) for event in backend_events])),
+         lambda: serialization.dumps([backend.event_response(event) for event in backend_events])),
+        ("backend.py POST /auth/login",
+         lambda: starlette_dumps(jsonable_encoder(backend.Token(
+             access_token="t", token_type="bearer",
+             user=backend.UserResponse(**{k: v for k, v in backend_user.items() if k != "password_hash"})))),
+         lambda: serialization.dumps({"access_token": "t", "token_type": "bearer",
+                                      "user": backend.user_response(backend_user)})),
+    ]
+
+
+def same_document(before: bytes, after: bytes) -> bool:
+    return json.loads(before) == json.loads(after)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--comments", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    scale = Scale(users=200, events=args.events, comments=args.comments, attendees=20)
+    seed_simple_backend(sb, scale)
+    seed_backend(backend, scale)
+    # backend.py keeps comment and join timestamps as datetime objects
+    for event_id, event in list(backend.db.events.items()):
+        backend.db.events.update(event_id, {"comments": [{**comment, "timestamp": datetime(2030, 1, 1, 9, 15)}
+                                                         for comment in event["comments"]]})
+    for user_id in list(backend.db.users.keys()):
+        backend.db.users.update(user_id, {"joined_date": datetime(2024, 9, 1, 12, 30)})
+
+    encoder = "orjson" if serialization.orjson is not None else "json"
+    print(f"{args.events} events, {args.comments} comments each; encoder: {encoder}")
+    print(f"{'endpoint':<38} {'before us':>12} {'after us':>12} {'speedup':>8}")
+    page_ids = [f"bench-e{i}" for i in range(min(20, args.events))]
+    for name, before, after in cases(page_ids):
+        if not same_document(before(), after()):
+            sys.exit(f"{name}: before and after produce different documents")
+        iterations = max(args.iterations // 50, 3) if "full list" in name or "backend.py GET" in name \
+            else args.iterations
+        before_us, after_us = best_us(before, iterations), best_us(after, iterations)
+        print(f"{name:<38} {before_us:>12,.1f} {after_us:>12,.1f} {before_us / after_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Load-Test Targets and Workloads
+===============================
+
+What bench/loadtest.py runs against and what it sends:
+
+- seed_<app>() fills an app's stores with synthetic users, events,
+  comments and attendees straight through the store API (no HTTP), with
+  deterministic ids, so a load generator in another process knows them
+  without asking the server;
+- every synthetic user has the password PASSWORD; the bcrypt hash is
+  computed once and shared;
+- WORKLOADS[app][name] is a weighted list of request builders; each
+  builder turns the seeded Dataset and a random generator into one Call.
+"""
+
+import io
+import random
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+PASSWORD = "benchpass"
+
+CATEGORIES = ("academic", "cultural", "social", "sports", "career", "music")
+WORDS = ("robotics", "festival", "career", "hackathon", "concert", "lecture", "workshop", "yoga",
+         "debate", "chess", "film", "poetry", "startup", "climate", "volunteer", "basketball")
+# Attend bursts all go to the first few events, like a popular event opening
+HOT_EVENTS = 5
+
+
+class Scale(NamedTuple):
+    users: int = 1000
+    events: int = 500
+    comments: int = 10   # per event
+    attendees: int = 20  # per event
+
+
+class Dataset(NamedTuple):
+    """Ids of the seeded data, plus tokens once sessions are logged in"""
+    user_ids: List[str]
+    emails: List[str]
+    event_ids: List[str]
+    tokens: List[str]
+
+
+class Call(NamedTuple):
+    """One request to send; label is the endpoint it is reported under"""
+    label: str
+    method: str
+    path: str
+    params: Optional[Dict[str, Any]] = None
+    json: Any = None
+    files: Optional[Dict[str, Any]] = None
+    headers: Optional[Dict[str, str]] = None
+    content: Optional[bytes] = None
+    at: Optional[float] = None  # seconds from the start, for timed replays
+
+
+def dataset(scale: Scale) -> Dataset:
+    user_ids = [f"bench-u{i}" for i in range(scale.users)]
+    return Dataset(user_ids, [f"user{i}@bench.edu" for i in range(scale.users)],
+                   [f"bench-e{i}" for i in range(scale.events)], [])
+
+
+def _synthetic(scale: Scale, password_hash: str, seed: int):
+    """Users, then (event, comments) pairs, generated deterministically"""
+    rng = random.Random(seed)
+    data = dataset(scale)
+    joined = datetime(2024, 9, 1).isoformat()
+    users = [{"id": user_id, "email": email, "name": f"Bench User {i}",
+              "role": rng.choice(("student", "student", "student", "faculty", "organizer")),
+              "password_hash": password_hash, "joined_date": joined, "points": rng.randrange(500),
+              "verified": True}
+             for i, (user_id, email) in enumerate(zip(data.user_ids, data.emails))]
+
+    start = datetime(2030, 1, 1)
+    events = []
+    for i, event_id in enumerate(data.event_ids):
+        words = rng.sample(WORDS, 3)
+        created_at = (start - timedelta(minutes=i)).isoformat()
+        attendees = rng.sample(data.user_ids, min(scale.attendees, len(data.user_ids)))
+        comments = [{"id": f"{event_id}-c{c}", "event_id": event_id, "author": f"Bench User {c}",
+                     "author_id": rng.choice(data.user_ids) if data.user_ids else "1",
+                     "text": " ".join(rng.sample(WORDS, 6)), "timestamp": created_at}
+                    for c in range(scale.comments)]
+        events.append(({
+            "id": event_id,
+            "title": f"{words[0].title()} {words[1]} {i}",
+            "date": (start + timedelta(days=rng.randrange(365))).strftime("%Y-%m-%d"),
+            "time": f"{rng.randrange(8, 22):02d}:00",
+            "location": f"Building {rng.randrange(40)}",
+            "category": rng.choice(CATEGORIES),
+            "description": " ".join(rng.sample(WORDS, 8)),
+            "created_by": rng.choice(data.user_ids) if data.user_ids else "1",
+            "created_at": created_at,
+            "attendees": attendees,
+            "waitlist": [],
+        }, comments))
+    return data, users, events
+
+
+def seed_simple_backend(module, scale: Scale, seed: int = 0) -> Dataset:
+    data, users, events = _synthetic(scale, module.password_hasher.hash_sync(PASSWORD), seed)
+    for user in users:
+        module.users_db.insert(user)
+    for event, comments in events:
+        module.events_db.insert(event)
+        for comment in comments:
+            module.comments_db.insert(comment)
+    return data
+
+
+def seed_backend(module, scale: Scale, seed: int = 0) -> Dataset:
+    data, users, events = _synthetic(scale, module.password_hasher.hash_sync(PASSWORD), seed)
+    for user in users:
+        module.db.users.insert(user)
+    for event, comments in events:
+        module.db.events.insert({**event, "comments": comments})
+    return data
+
+
+SEEDERS: Dict[str, Callable[[Any, Scale, int], Dataset]] = {
+    "simple_backend": seed_simple_backend,
+    "backend": seed_backend,
+}
+
+
+# Request builders
+Builder = Callable[[Dataset, random.Random], Call]
+
+
+def _auth(data: Dataset, rng: random.Random) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {rng.choice(data.tokens)}"} if data.tokens else {}
+
+
+def list_events(data, rng):
+    return Call("GET /events/", "GET", "/events/")
+
+
+def page_events(data, rng):
+    params = {"limit": 20}
+    if rng.random() < 0.5:
+        params["category"] = rng.choice(CATEGORIES)
+    return Call("GET /events/?limit", "GET", "/events/", params=params)
+
+
+def get_event(data, rng):
+    return Call("GET /events/{id}", "GET", f"/events/{rng.choice(data.event_ids)}")
+
+
+def event_comments(data, rng):
+    return Call("GET /events/{id}/comments", "GET", f"/events/{rng.choice(data.event_ids)}/comments",
+                params={"limit": 20})
+
+
+def search_events(data, rng):
+    return Call("GET /events/search", "GET", "/events/search", params={"q": rng.choice(WORDS)[:5]})
+
+
+def dashboard(data, rng):
+    return Call("GET /dashboard", "GET", "/dashboard")
+
+
+def login(data, rng):
+    return Call("POST /auth/login", "POST", "/auth/login",
+                json={"email": rng.choice(data.emails), "password": PASSWORD})
+
+
+def attend(data, rng):
+    event_id = data.event_ids[rng.randrange(min(HOT_EVENTS, len(data.event_ids)))]
+    return Call("POST /events/{id}/attend", "POST", f"/events/{event_id}/attend",
+                json={"attend": rng.random() < 0.7}, headers=_auth(data, rng))
+
+
+def comment(data, rng):
+    return Call("POST /events/{id}/comments", "POST", f"/events/{rng.choice(data.event_ids)}/comments",
+                json={"text": " ".join(rng.sample(WORDS, 5))}, headers=_auth(data, rng))
+
+
+def upload(data, rng):
+    return Call("POST /upload/file", "POST", "/upload/file",
+                files={"file": ("photo.png", _image(rng), "image/png")})
+
+
+def _image(rng: random.Random) -> bytes:
+    """A small PNG with random pixels, so every upload is a new blob"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return rng.randbytes(32 * 1024)
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (96, 96), rng.randbytes(96 * 96 * 3)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+BROWSE: List[Tuple[int, Builder]] = [(30, list_events), (25, page_events), (20, get_event),
+                                     (10, event_comments), (10, search_events), (5, dashboard)]
+
+WORKLOADS: Dict[str, Dict[str, List[Tuple[int, Builder]]]] = {
+    "simple_backend": {
+        "browse": BROWSE,
+        "login": [(1, login)],
+        "attend": [(1, attend)],
+        "upload": [(1, upload)],
+        "mixed": BROWSE + [(5, login), (8, attend), (5, comment), (2, upload)],
+    },
+    "backend": {
+        "browse": [(1, list_events)],
+        "login": [(1, login)],
+        "comment": [(1, comment)],
+        "mixed": [(80, list_events), (10, login), (10, comment)],
+    },
+}
+
+
+def picker(builders: List[Tuple[int, Builder]], data: Dataset, seed: int = 0) -> Callable[[], Call]:
+    """A function returning the next call of a weighted workload"""
+    rng = random.Random(seed)
+    weights = [weight for weight, _ in builders]
+    functions = [builder for _, builder in builders]
+    return lambda: rng.choices(functions, weights)[0](data, rng)
@@ -0,0 +1,378 @@
+"""
+Bulk Import and Export
+======================
+
+/admin/import and /admin/export move events, users and attendance as CSV
+or NDJSON, streamed in both directions.
+
+Import:
+
+- the request body is read chunk by chunk and split into records. A CSV
+  record ends at a newline outside quotes; an NDJSON record at any
+  newline. Memory therefore depends on IMPORT_BATCH, not on the size of
+  the upload;
+- every IMPORT_BATCH rows are validated together, with one pydantic call
+  per batch, and checked against the stores;
+- the rows that pass are written with one bulk store write (insert_many,
+  add_attendees). That is one version bump and one call per store
+  listener, so indexes and response caches are updated once per batch,
+  not once per row;
+- rows that fail are skipped and reported by row number (the first
+  MAX_REPORTED_ERRORS of them); the rest of the batch is still written.
+  dry_run validates without writing anything.
+
+Re-importing an exported event (same id) updates it in place and keeps
+its attendees. Imported users get no password; they set one through
+/auth/forgot-password.
+
+Organizers import users with a student, faculty or user role and no
+points, and only their own events (created_by is them, and so is the
+owner of an event re-imported by id). Admins may import anything.
+
+Attendance rows carry a status, "attending" (the default) or
+"waitlisted", as the export writes them. Waitlisted rows join the end of
+the event's waitlist. A seat goes to a waitlisted user only if they are
+first in line, and is refused to anyone else while people are waiting.
+
+Export is an async generator over a snapshot of the ids. It encodes
+EXPORT_CHUNK rows per chunk and gives the event loop back between
+chunks, so memory stays flat whatever the size of the data. Records
+deleted while an export runs are left out.
+"""
+
+import asyncio
+import codecs
+import csv
+import io
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Literal, Optional, Set, Tuple, Type
+
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+from serialization import dumps, loads
+
+# Configuration
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "1000"))
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", "500"))
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+COLUMNS = {
+    "events": ["id", "title", "date", "time", "location", "category", "description", "capacity",
+               "created_by", "created_at"],
+    "users": ["id", "email", "name", "role", "college", "points", "joined_date", "verified"],
+    "attendance": ["event_id", "event_title", "event_date", "user_id", "user_name", "user_email", "status"],
+}
+KINDS = tuple(COLUMNS)
+
+Row = Tuple[int, Any]  # row number, and the row's fields or why it could not be read
+
+
+class UserRow(BaseModel):
+    """A user an organizer may import: no admin or organizer role, no points"""
+    email: str
+    name: str
+    role: Literal["student", "faculty", "user"] = "student"
+    college: Optional[str] = None
+
+
+class AdminUserRow(UserRow):
+    """A user an admin may import"""
+    role: str = "student"
+    points: int = Field(0, ge=0)
+
+
+class AttendanceRow(BaseModel):
+    event_id: str
+    user_id: Optional[str] = None
+    user_email: Optional[str] = None  # Instead of user_id
+    status: Literal["attending", "waitlisted"] = "attending"
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[List[str]]:
+    """The complete lines of each chunk of a UTF-8 byte stream"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        if lines:
+            yield [line + "\n" for line in lines]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield [pending]
+
+
+async def parse(fmt: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[List[Row]]:
+    """Rows of a CSV (with a header line) or NDJSON stream, a list per chunk"""
+    header: Optional[List[str]] = None
+    partial = ""  # A CSV record whose quoted field continues on the next line
+    number = 0
+    async for lines in _lines(chunks):
+        rows: List[Row] = []
+        if fmt == "ndjson":
+            for line in lines:
+                if not line.strip():
+                    continue
+                number += 1
+                try:
+                    row = loads(line)
+                except ValueError as error:
+                    row = f"Invalid JSON: {error}"
+                rows.append((number, row if isinstance(row, (dict, str)) else "Not a JSON object"))
+        else:
+            records = []
+            for line in lines:
+                partial += line
+                if partial.count('"') % 2 == 0:
+                    records.append(partial)
+                    partial = ""
+            for values in csv.reader(records):
+                if not any(values):
+                    continue
+                if header is None:
+                    header = [name.strip() for name in values]
+                    continue
+                number += 1
+                if len(values) != len(header):
+                    rows.append((number, f"Expected {len(header)} columns, found {len(values)}"))
+                else:
+                    # Empty cells are missing values, so model defaults apply
+                    rows.append((number, {name: value for name, value in zip(header, values) if value != ""}))
+        if rows:
+            yield rows
+    if partial:
+        yield [(number + 1, "Unterminated quoted field")]
+
+
+class BulkIO:
+    """Batched imports into, and streamed exports from, the user and event stores"""
+
+    def __init__(self, users, events, event_model: Type[BaseModel], batch_size: int = IMPORT_BATCH):
+        self.users = users
+        self.events = events
+        self.batch_size = batch_size
+        self._adapters = {
+            "events": TypeAdapter(List[event_model]),
+            "users": TypeAdapter(List[UserRow]),
+            "admin_users": TypeAdapter(List[AdminUserRow]),
+            "attendance": TypeAdapter(List[AttendanceRow]),
+        }
+
+    # Import
+    async def import_rows(self, kind: str, fmt: str, chunks: AsyncIterator[bytes], actor_id: str,
+                          dry_run: bool = False, admin: bool = False) -> Dict[str, Any]:
+        """admin: the importer is an admin, who may also import privileged users, points and others' events"""
+        started = time.perf_counter()
+        report = {"kind": kind, "format": fmt, "dry_run": dry_run, "rows": 0, "imported": 0,
+                  "skipped": 0, "failed": 0, "errors": []}
+        state = {"emails": set(), "seats": {}, "waitlists": {}}  # Carried across batches (for dry runs, too)
+        batch: List[Row] = []
+        async for rows in parse(fmt, chunks):
+            for number, row in rows:
+                report["rows"] += 1
+                if isinstance(row, str):
+                    self._fail(report, number, row)
+                else:
+                    batch.append((number, row))
+            if len(batch) >= self.batch_size:
+                self._import_batch(kind, batch, actor_id, admin, dry_run, state, report)
+                batch = []
+                await asyncio.sleep(0)  # Let other requests in between batches
+        if batch:
+            self._import_batch(kind, batch, actor_id, admin, dry_run, state, report)
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+    def _import_batch(self, kind: str, batch: List[Row], actor_id: str, admin: bool, dry_run: bool,
+                      state: Dict[str, Any], report: Dict[str, Any]):
+        valid = self._validate("admin_users" if kind == "users" and admin else kind, batch, report)
+        if kind == "events":
+            records = self._event_records(valid, actor_id, admin, report)
+            if not dry_run:
+                self.events.insert_many(records)
+            report["imported"] += len(records)
+        elif kind == "users":
+            numbered = self._user_records(valid, state["emails"], admin, report)
+            if not dry_run and numbered:
+                try:
+                    self.users.insert_many([record for _, record in numbered])
+                except ValueError as error:  # Registered meanwhile, by another worker process
+                    for number, _ in numbered:
+                        self._fail(report, number, str(error))
+                    return
+            report["imported"] += len(numbered)
+        else:
+            pairs, waitlisted = self._attendance_pairs(valid, state["seats"], state["waitlists"], report)
+            if not dry_run:
+                self.events.add_attendees(pairs, waitlisted)
+            report["imported"] += len(pairs) + len(waitlisted)
+
+    def _validate(self, model: str, batch: List[Row], report: Dict[str, Any]) -> List[Tuple[int, Tuple[Any, Dict]]]:
+        """(row number, (model, raw fields)) of the rows that pass the model (a key of _adapters)"""
+        adapter = self._adapters[model]
+        rows = [row for _, row in batch]
+        try:
+            models = adapter.validate_python(rows)
+        except ValidationError as error:
+            failed: Dict[int, str] = {}
+            for detail in error.errors():
+                index, *field = detail["loc"]
+                failed.setdefault(index, f"{'.'.join(map(str, field)) or 'row'}: {detail['msg']}")
+            for index, message in failed.items():
+                self._fail(report, batch[index][0], message)
+            batch = [item for index, item in enumerate(batch) if index not in failed]
+            rows = [row for _, row in batch]
+            models = adapter.validate_python(rows)
+        return [(number, (model, row)) for (number, row), model in zip(batch, models)]
+
+    def _event_records(self, valid, actor_id: str, admin: bool, report: Dict[str, Any]) -> List[Dict[str, Any]]:
+        now = datetime.now().isoformat()
+        records = []
+        for number, (model, row) in valid:
+            record = model.model_dump()
+            existing = self.events.get(str(row["id"])) if row.get("id") else None
+            if not admin:
+                owners = {str(row["created_by"]) if row.get("created_by") else actor_id,
+                          (existing or {}).get("created_by", actor_id)}
+                if owners != {actor_id}:
+                    self._fail(report, number, "Only an admin can import events for another organizer")
+                    continue
+            if row.get("id"):
+                record["id"] = str(row["id"])
+            record["created_by"] = row.get("created_by") or (existing or {}).get("created_by") or actor_id
+            record["created_at"] = row.get("created_at") or (existing or {}).get("created_at") or now
+            record["attendees"] = list(existing["attendees"]) if existing else []
+            record["waitlist"] = list(existing["waitlist"]) if existing else []
+            records.append(record)
+        return records
+
+    def _user_records(self, valid, emails: Set[str], admin: bool,
+                      report: Dict[str, Any]) -> List[Tuple[int, Dict[str, Any]]]:
+        now = datetime.now().isoformat()
+        records = []
+        for number, (model, row) in valid:
+            if not admin and row.get("points") not in (None, 0, "0"):
+                self._fail(report, number, "Only an admin can set points")
+                continue
+            email = model.email.strip()
+            if email in emails or self.users.get_by_email(email) is not None:
+                self._fail(report, number, "Email already registered")
+                continue
+            emails.add(email)
+            records.append((number, {
+                "email": email,
+                "name": model.name,
+                "role": model.role,
+                "college": model.college,
+                "password_hash": "",  # Set through /auth/forgot-password
+                "joined_date": now,
+                "points": model.points if admin else 0,
+                "verified": False,
+            }))
+        return records
+
+    def _attendance_pairs(self, valid, seats: Dict[str, int], waitlists: Dict[str, Deque[str]],
+                          report: Dict[str, Any]) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        """The (event id, user id) pairs to seat and to waitlist"""
+        pairs, waitlisted = [], []
+        seen: Set[Tuple[str, str]] = set()
+        for number, (model, _) in valid:
+            event = self.events.get(model.event_id)
+            if event is None:
+                self._fail(report, number, f"Unknown event {model.event_id}")
+                continue
+            if model.user_id:
+                user = self.users.get(model.user_id)
+            else:
+                user = self.users.get_by_email((model.user_email or "").strip())
+            if user is None:
+                self._fail(report, number, "Unknown user")
+                continue
+            pair = (event["id"], user["id"])
+            if pair in seen or self.events.is_attending(*pair):
+                report["skipped"] += 1
+                continue
+            # The event's waitlist as this import leaves it (dry runs write nothing)
+            queue = waitlists.setdefault(event["id"], deque(event["waitlist"]))
+            if model.status == "waitlisted":
+                if self.events.is_waitlisted(*pair):
+                    report["skipped"] += 1
+                    continue
+                queue.append(user["id"])
+                seen.add(pair)
+                waitlisted.append(pair)
+                continue
+            if queue and queue[0] != user["id"]:
+                self._fail(report, number, "Event has a waitlist")
+                continue
+            # Seats taken by this import so far, on top of the event's attendees
+            taken = seats.get(event["id"], len(event["attendees"]))
+            if event.get("capacity") and taken >= event["capacity"]:
+                self._fail(report, number, "Event is full")
+                continue
+            if queue:
+                queue.popleft()
+            seats[event["id"]] = taken + 1
+            seen.add(pair)
+            pairs.append(pair)
+        return pairs, waitlisted
+
+    @staticmethod
+    def _fail(report: Dict[str, Any], number: int, message: str):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": number, "error": message})
+
+    # Export
+    async def export(self, kind: str, fmt: str, date_from: Optional[str] = None,
+                     date_to: Optional[str] = None) -> AsyncIterator[bytes]:
+        columns = COLUMNS[kind]
+        rows = self._export_rows(kind, date_from, date_to)
+        if fmt == "csv":
+            yield _csv_lines([columns])
+        while True:
+            chunk = [[row.get(column) for column in columns] for _, row in zip(range(EXPORT_CHUNK), rows)]
+            if not chunk:
+                break
+            if fmt == "csv":
+                yield _csv_lines(chunk)
+            else:
+                yield b"".join(dumps(dict(zip(columns, values))) + b"\n" for values in chunk)
+            await asyncio.sleep(0)  # Other requests run between chunks
+
+    def _export_rows(self, kind: str, date_from: Optional[str], date_to: Optional[str]) -> Iterator[Dict[str, Any]]:
+        if kind == "users":
+            for user_id in list(self.users.keys()):
+                user = self.users.get(user_id)
+                if user is not None:
+                    yield user
+            return
+
+        if date_from or date_to:
+            event_ids = [event["id"] for event in self.events.between_dates(date_from, date_to)]
+        else:
+            event_ids = list(self.events.keys())
+        for event_id in event_ids:
+            event = self.events.get(event_id)
+            if event is None:
+                continue
+            if kind == "events":
+                yield event
+                continue
+            for status, user_ids in (("attending", event["attendees"]), ("waitlisted", event["waitlist"])):
+                for user_id in list(user_ids):
+                    user = self.users.get(user_id) or {}
+                    yield {"event_id": event_id, "event_title": event.get("title"), "event_date": event.get("date"),
+                           "user_id": user_id, "user_name": user.get("name"), "user_email": user.get("email"),
+                           "status": status}
+
+
+def _csv_lines(rows: List[List[Any]]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue().encode("utf-8")
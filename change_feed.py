@@ -0,0 +1,134 @@
+"""
+Change Feed
+===========
+
+Revision numbers for writes to events (including their attendees and
+comments, which are part of the event payload) and favorites, so offline
+clients can ask for just what changed since their last sync instead of
+downloading everything again:
+
+- a write's revision is its position in the storage backend's change
+  log (StorageBackend.seq). The feed remembers only the latest revision
+  per record, in revision order, so "what changed since r" is a walk
+  back from the newest entry that stops at r -- its cost follows the
+  churn since r, not the size of the stores;
+- deleted records leave a tombstone. At most MAX_TOMBSTONES are kept;
+  dropping the oldest raises the floor, and clients whose revision is
+  below the floor have to start over from a full state (reset);
+- the epoch, returned with every sync, is the storage backend's: it
+  names the change log the revisions count. With the sqlite backend,
+  every worker numbers changes the same way and the log outlives
+  restarts, so a client can sync against any worker, before and after a
+  restart. A client presenting another epoch (e.g. a wiped database, or
+  the memory backend restarted) is reset, so it can never mistake one
+  log's revisions for another's;
+- attach() seeds the feed from the changes the backend still has in its
+  log, so a worker that just started knows as much history as the
+  others. Clients older than that log are reset.
+
+Reloading or clearing a store resets every client.
+"""
+
+import os
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+from store import Change
+
+# Configuration
+MAX_TOMBSTONES = int(os.getenv("SYNC_MAX_TOMBSTONES", "10000"))
+
+COLLECTIONS = ("events", "comments", "favorites")
+
+
+class Entry(NamedTuple):
+    """Latest change to one record"""
+    collection: str
+    key: str
+    rev: int
+    deleted: bool
+
+
+class ChangeFeed:
+    """Latest revision of every changed record, in revision order"""
+
+    def __init__(self, *stores, max_tombstones: int = MAX_TOMBSTONES):
+        self.stores = stores
+        self.max_tombstones = max_tombstones
+        self.storage = None
+        self.epoch: Optional[str] = None
+        # Clients at or above the floor can be brought up to date incrementally
+        self.floor = 0
+        self._log: "OrderedDict[Tuple[str, str], Entry]" = OrderedDict()
+        self._tombstones: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+
+    def attach(self, storage):
+        """Take revisions from storage (opened already), starting with the history it kept"""
+        self.storage = storage
+        self.epoch = storage.epoch
+        self.floor, history = storage.history(COLLECTIONS)
+        for rev, change in history:
+            self._record(change, rev)
+        for store in self.stores:
+            store.subscribe(self.apply)
+
+    @property
+    def rev(self) -> int:
+        """The revision everything applied so far is at"""
+        return self.storage.seq
+
+    def needs_reset(self, since: Optional[int], epoch: Optional[str]) -> bool:
+        """Whether a client at revision since of epoch must fetch a full state"""
+        return since is None or epoch != self.epoch or since < self.floor or since > self.rev
+
+    def changes(self, since: int, limit: int) -> Tuple[List[Entry], bool]:
+        """Up to limit entries newer than since, oldest first, and whether more remain"""
+        newer = []
+        for entry in reversed(self._log.values()):
+            if entry.rev <= since:
+                break
+            newer.append(entry)
+        newer.reverse()
+        return newer[:limit], len(newer) > limit
+
+    def stats(self):
+        return {"epoch": self.epoch, "rev": self.rev, "floor": self.floor,
+                "entries": len(self._log), "tombstones": len(self._tombstones)}
+
+    # Store listener
+    def apply(self, changes: List[Change]):
+        # The backend has already counted these changes: they end at seq
+        first = self.storage.seq - len(changes) + 1
+        for rev, change in enumerate(changes, first):
+            if change.collection in COLLECTIONS:
+                self._record(change, rev)
+
+    def _record(self, change: Change, rev: int):
+        if change.op in ("load", "clear"):
+            self._log.clear()
+            self._tombstones.clear()
+            self.floor = rev
+            return
+        if change.collection == "comments":
+            if change.op == "purge":
+                return  # The event is being deleted; its own delete follows
+            # A comment changes the event's payload (count and latest comments)
+            collection, record_key, deleted = "events", change.data["event_id"], False
+        else:
+            # Favorites are keyed by user, so unfavoriting the last event isn't a delete
+            collection, record_key, deleted = change.collection, change.key, change.op == "delete"
+        key = (collection, record_key)
+        self._log[key] = Entry(collection, record_key, rev, deleted)
+        self._log.move_to_end(key)
+        self._tombstones.pop(key, None)
+        if deleted:
+            self._tombstones[key] = rev
+            if len(self._tombstones) > self.max_tombstones:
+                self._compact()
+
+    def _compact(self):
+        """Forget the oldest tombstones; clients older than them are reset"""
+        while len(self._tombstones) > self.max_tombstones:
+            key, rev = self._tombstones.popitem(last=False)
+            del self._log[key]
+            self.floor = max(self.floor, rev)
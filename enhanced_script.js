@@ -426,7 +426,7 @@ function createEventCard(event, type = 'regular') {
 
             <div class="comments-section" style="margin-top: 15px;">
                 <div style="border-top: 1px solid #eee; padding-top: 15px;">
-                    <h4 style="font-size: 14px; margin-bottom: 8px;">💬 Comments (${event.comments ? event.comments.length : 0})</h4>
+                    <h4 style="font-size: 14px; margin-bottom: 8px;">💬 Comments (${event.comments_count || (event.comments ? event.comments.length : 0)})</h4>
                     <div id="comments-${event.id}" style="margin-bottom: 10px; max-height: 100px; overflow-y: auto;">
                         ${event.comments && event.comments.length > 0 ?
                             event.comments.slice(-2).map(comment => `
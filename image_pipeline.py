@@ -0,0 +1,161 @@
+"""
+Image Pipeline
+==============
+
+Generates resized variants of uploaded images on a process pool, off the
+request path:
+
+- thumbnail (160px), card (480px) and full (1600px) widths;
+- each in WebP plus a JPEG (or PNG, for images with transparency) fallback.
+
+Variants live in <upload dir>/variants/<sha256>/ next to a manifest.json
+that is written last, so a variant set is either complete or not used.
+/images/{sha256} then serves the smallest variant that covers the
+requested width, in WebP when the client's Accept header allows it.
+"""
+
+import glob
+import json
+import logging
+import mimetypes
+import os
+import re
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; uploads are then served as-is
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+VARIANT_WIDTHS = {"thumbnail": 160, "card": 480, "full": 1600}
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+
+def generate_variants(source_path: str, output_dir: str) -> Dict[str, Any]:
+    """Resize and re-encode one image (runs in a worker process)"""
+    os.makedirs(output_dir, exist_ok=True)
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+        fallback = "png" if has_alpha else "jpeg"
+
+        manifest = {"width": image.width, "height": image.height, "variants": {}}
+        for name, width in VARIANT_WIDTHS.items():
+            variant = image.copy()
+            if variant.width > width:
+                variant.thumbnail((width, width * variant.height // variant.width or 1),
+                                  Image.LANCZOS)
+            formats = {}
+            for fmt in ("webp", fallback):
+                path = os.path.join(output_dir, f"{name}.{fmt}")
+                temp_path = path + ".tmp"
+                if fmt == "webp":
+                    variant.save(temp_path, "WEBP", quality=WEBP_QUALITY, method=4)
+                elif fmt == "jpeg":
+                    variant.save(temp_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+                else:
+                    variant.save(temp_path, "PNG", optimize=True)
+                os.replace(temp_path, path)
+                formats[fmt] = os.path.getsize(path)
+            manifest["variants"][name] = {"width": variant.width, "height": variant.height,
+                                          "formats": formats}
+
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+
+class ImagePipeline:
+    """Schedules variant generation and picks the variant to serve"""
+
+    def __init__(self, upload_dir: str, workers: int = IMAGE_WORKERS):
+        self.upload_dir = upload_dir
+        self.variant_dir = os.path.join(upload_dir, "variants")
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[str, Future] = {}
+        self._manifests: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    def submit(self, sha256: str, source_path: str) -> bool:
+        """Queue variant generation for an uploaded image; False if not needed"""
+        if not self.enabled or sha256 in self._pending or self.manifest(sha256):
+            return False
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        future = self._executor.submit(generate_variants, source_path,
+                                       os.path.join(self.variant_dir, sha256))
+        self._pending[sha256] = future
+        future.add_done_callback(lambda done: self._finished(sha256, done))
+        return True
+
+    def status(self, sha256: str) -> str:
+        if self.manifest(sha256):
+            return "ready"
+        return "processing" if sha256 in self._pending else "original"
+
+    def manifest(self, sha256: str) -> Optional[Dict[str, Any]]:
+        manifest = self._manifests.get(sha256)
+        if manifest is None:
+            try:
+                with open(os.path.join(self.variant_dir, sha256, "manifest.json")) as f:
+                    manifest = self._manifests[sha256] = json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+        return manifest
+
+    def choose(self, sha256: str, accept: Optional[str],
+               width: Optional[int]) -> Optional[Tuple[str, str]]:
+        """(path, media type) of the best variant, or of the original while none exist"""
+        if not re.fullmatch(r"[0-9a-f]{64}", sha256):
+            return None
+        manifest = self.manifest(sha256)
+        if manifest is None:
+            return self._original(sha256)
+
+        variants = sorted(manifest["variants"].items(), key=lambda item: item[1]["width"])
+        name, variant = variants[-1]
+        if width:
+            name, variant = next(((n, v) for n, v in variants if v["width"] >= width), variants[-1])
+
+        formats = variant["formats"]
+        if "webp" in formats and "image/webp" in (accept or ""):
+            fmt = "webp"
+        else:
+            fmt = next(f for f in formats if f != "webp")
+        return os.path.join(self.variant_dir, sha256, f"{name}.{fmt}"), MEDIA_TYPES[fmt]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _original(self, sha256: str) -> Optional[Tuple[str, str]]:
+        for path in glob.glob(os.path.join(self.upload_dir, f"{sha256}.*")):
+            return path, mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return None
+
+    def _finished(self, sha256: str, future: Future):
+        self._pending.pop(sha256, None)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            logger.warning("Image variants for %s failed: %s", sha256, error)
+        else:
+            self._manifests[sha256] = future.result()
@@ -66,6 +66,7 @@ async function checkLogin() {
         try {
             currentUser = JSON.parse(savedUser);
             currentToken = savedToken;
+            shareSessionWithServiceWorker(currentToken);
 
             // Verify token is still valid
             const userData = await apiRequest('/users/' + currentUser.id);
@@ -125,6 +126,7 @@ async function handleLogin(event) {
         // Store in localStorage for persistence
         localStorage.setItem('currentUser', JSON.stringify(currentUser));
         localStorage.setItem('authToken', currentToken);
+        shareSessionWithServiceWorker(currentToken);
 
         // Initialize user-specific data
         await Promise.all([
@@ -166,6 +168,7 @@ async function handleRegistration(event) {
         // Store in localStorage
         localStorage.setItem('currentUser', JSON.stringify(currentUser));
         localStorage.setItem('authToken', currentToken);
+        shareSessionWithServiceWorker(currentToken);
 
         showMainApp();
         updateDashboard();
@@ -279,6 +282,7 @@ function showMainTab(tab) {
 }
 
 function logout() {
+    endSession(API_BASE, currentToken);
     currentUser = null;
     currentToken = null;
     localStorage.removeItem('currentUser');
@@ -426,7 +430,7 @@ function displayEvents(searchTerm = '', categoryFilter = '', dateFilter = '') {
                 ${currentUser && event.created_by === currentUser.id ? `<button class="delete-btn" onclick="deleteEvent('${event.id}')">Delete</button>` : ''}
             </div>
             <div class="comments-section">
-                <h4>Comments (${event.comments ? event.comments.length : 0})</h4>
+                <h4>Comments (${event.comments_count || (event.comments ? event.comments.length : 0)})</h4>
                 <div id="comments-${event.id}">
                     ${event.comments && event.comments.length > 0 ?
                         event.comments.slice(-3).map(comment => `<div class="comment"><strong>${comment.author}:</strong> ${comment.text}</div>`).join('')
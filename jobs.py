@@ -0,0 +1,330 @@
+"""
+Job Queue
+=========
+
+Slow side effects, outbound email first of all, run after the request
+that caused them has been answered:
+
+- enqueue() inserts a row into a SQLite table and returns, so request
+  handlers never wait for the work itself. The database lives in
+  DATA_DIR, so queued jobs survive a restart and worker processes can
+  share it. It is kept in memory when DATA_DIR is empty;
+- JOB_WORKERS asyncio workers per process claim due jobs, oldest first.
+  They take up to the batch size registered for the job's kind and hand
+  the whole batch to its handler, e.g. one provider call for many emails;
+- a claim is a lease: jobs held by a worker that died become due again
+  after CLAIM_TIMEOUT, so every job runs at least once;
+- a failed job is retried after an exponential backoff with jitter: up to
+  BACKOFF_BASE * 2 ** (attempts - 1) seconds, capped at BACKOFF_MAX.
+  After MAX_ATTEMPTS it moves to the dead-letter table, where it can be
+  inspected and queued again. Payloads can hold secrets (an email's
+  reset link), so dead_letters() shows only what the kind's summary
+  function picks from them, and nothing without one.
+
+SQLite calls can wait on the busy timeout and fsync, so they run in a
+thread (asyncio.to_thread), one at a time on the queue's connection;
+the event loop never makes them. counts, for metrics scrapes, which
+can't wait, is refreshed by idle workers and stats().
+
+Handlers are async and take the payloads of a batch. They either raise,
+meaning the whole batch failed, or return one error per payload, with
+None for those that succeeded.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from storage import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+JOBS_PATH = os.getenv("JOBS_PATH", os.path.join(DATA_DIR, "jobs.db") if DATA_DIR else ":memory:")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "2"))
+BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "3600"))
+CLAIM_TIMEOUT = float(os.getenv("JOB_CLAIM_TIMEOUT", "300"))
+# Longest an idle worker sleeps before looking again (for jobs other processes queued)
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+SQLITE_BUSY_TIMEOUT = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at REAL NOT NULL,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (run_at);
+CREATE TABLE IF NOT EXISTS dead_jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL,
+    last_error TEXT
+);
+"""
+
+Handler = Callable[[List[Dict[str, Any]]], Awaitable[Optional[Sequence[Optional[str]]]]]
+Summary = Callable[[Dict[str, Any]], Dict[str, Any]]
+Job = Tuple[int, str, int]  # id, payload, attempts so far
+
+
+class _Kind(NamedTuple):
+    handler: Handler
+    batch_size: int
+    max_attempts: int
+    summary: Optional[Summary]  # What dead_letters() shows of a payload
+
+
+def backoff(attempts: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """Seconds to wait before retrying a job that has failed attempts times (full jitter)"""
+    return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+class JobQueue:
+    """Durable queue of background jobs, worked off by asyncio workers"""
+
+    def __init__(self, path: str = JOBS_PATH, workers: int = JOB_WORKERS):
+        self.path = path
+        self.worker_count = workers
+        self._kinds: Dict[str, _Kind] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()  # One statement or transaction on _conn at a time
+        self._workers: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.counts = {"queued": 0, "due": 0, "running": 0, "dead": 0}  # As of the last refresh
+        self._counted_at = 0.0
+        self.completed = 0
+        self.failures = 0
+        self.dead_lettered = 0
+
+    def register(self, kind: str, handler: Handler, batch_size: int = 1, max_attempts: int = MAX_ATTEMPTS,
+                 summary: Optional[Summary] = None):
+        self._kinds[kind] = _Kind(handler, batch_size, max_attempts, summary)
+
+    # Lifecycle
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit mode; transactions are managed explicitly below
+        self._conn = sqlite3.connect(self.path, isolation_level=None,
+                                     timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        with self._lock:
+            self._count(time.time())
+
+    def start(self):
+        """Start the workers on the running event loop, unless they already run"""
+        loop = asyncio.get_running_loop()
+        self._workers = [task for task in self._workers if not task.done()]
+        if self._workers:
+            return
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._workers = [loop.create_task(self._work()) for _ in range(self.worker_count)]
+
+    async def close(self):
+        """Stop the workers; jobs they were running become due again"""
+        self._stopping = True
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        with self._lock:  # A worker's thread may still be finishing a statement
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # Queueing
+    async def enqueue(self, kind: str, payload: Dict[str, Any], delay: float = 0) -> int:
+        """Queue a job and return its id; it runs once a worker is free"""
+        if kind not in self._kinds:
+            raise ValueError(f"No handler registered for job kind {kind!r}")
+        job_id = await asyncio.to_thread(self._insert, kind, json.dumps(payload, separators=(",", ":")), delay)
+        self.start()
+        self._wake.set()
+        return job_id
+
+    async def dead_letters(self, limit: int = 50) -> List[Dict[str, Any]]:
+        rows = await asyncio.to_thread(self._locked, lambda: self._conn.execute(
+            "SELECT id, kind, payload, attempts, created_at, failed_at, last_error FROM dead_jobs "
+            "ORDER BY failed_at DESC LIMIT ?", (limit,)).fetchall())
+        return [{"id": job_id, "kind": kind, "payload": self._summary(kind, payload), "attempts": attempts,
+                 "created_at": created_at, "failed_at": failed_at, "last_error": last_error}
+                for job_id, kind, payload, attempts, created_at, failed_at, last_error in rows]
+
+    def _summary(self, kind: str, payload: str) -> Optional[Dict[str, Any]]:
+        spec = self._kinds.get(kind)
+        if spec is None or spec.summary is None:
+            return None
+        return spec.summary(json.loads(payload))
+
+    async def requeue(self, job_id: int) -> bool:
+        """Move a dead job back to the queue with fresh attempts; returns False if there is none"""
+        if not await asyncio.to_thread(self._requeue, job_id):
+            return False
+        if self._wake is not None:
+            self._wake.set()
+        return True
+
+    async def stats(self) -> Dict[str, Any]:
+        await asyncio.to_thread(self._locked, lambda: self._count(time.time()))
+        return {**self.counts,
+                "workers": sum(1 for task in self._workers if not task.done()),
+                "completed": self.completed, "failures": self.failures, "dead_lettered": self.dead_lettered}
+
+    # Workers
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            self._wake.clear()
+            claimed = await asyncio.to_thread(self._claim, time.time())
+            if claimed is None:
+                # Not wait_for(): on 3.11 it can swallow the cancellation that stops the worker
+                timer = loop.call_later(await asyncio.to_thread(self._idle_time), self._wake.set)
+                try:
+                    await self._wake.wait()
+                finally:
+                    timer.cancel()
+                continue
+            kind, jobs = claimed
+            try:
+                await self._run(kind, jobs)
+            except asyncio.CancelledError:
+                self._release(jobs)
+                raise
+            except Exception:
+                logger.exception("Finishing %s jobs failed", kind)
+
+    async def _run(self, kind: str, jobs: List[Job]):
+        spec = self._kinds[kind]
+        try:
+            errors = await spec.handler([json.loads(payload) for _, payload, _ in jobs])
+        except Exception as error:
+            logger.warning("%d %s job(s) failed: %s", len(jobs), kind, error)
+            errors = [f"{type(error).__name__}: {error}"] * len(jobs)
+        await asyncio.to_thread(self._finish, jobs, errors or [None] * len(jobs), spec.max_attempts)
+
+    # Internals; they run in a thread, holding _lock
+    def _locked(self, func):
+        with self._lock:
+            return func()
+
+    def _insert(self, kind: str, payload: str, delay: float) -> int:
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(
+                "INSERT INTO jobs (kind, payload, run_at, created_at) VALUES (?, ?, ?, ?)",
+                (kind, payload, now + delay, now),
+            ).lastrowid
+
+    def _requeue(self, job_id: int) -> bool:
+        with self._lock, self._transaction():
+            row = self._conn.execute("SELECT kind, payload, created_at FROM dead_jobs WHERE id = ?",
+                                     (job_id,)).fetchone()
+            if row is None:
+                return False
+            self._conn.execute("DELETE FROM dead_jobs WHERE id = ?", (job_id,))
+            self._conn.execute("INSERT INTO jobs (id, kind, payload, run_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                               (job_id, row[0], row[1], time.time(), row[2]))
+        return True
+
+    def _claim(self, now: float) -> Optional[Tuple[str, List[Job]]]:
+        """Lease the oldest due jobs of one kind"""
+        kinds = list(self._kinds)
+        placeholders = ",".join("?" * len(kinds))
+        with self._lock, self._transaction():
+            row = self._conn.execute(
+                f"SELECT kind FROM jobs WHERE run_at <= ? AND claimed_until <= ? AND kind IN ({placeholders}) "
+                "ORDER BY run_at LIMIT 1", (now, now, *kinds)).fetchone()
+            if row is None:
+                return None
+            kind = row[0]
+            jobs = self._conn.execute(
+                "SELECT id, payload, attempts FROM jobs WHERE run_at <= ? AND claimed_until <= ? AND kind = ? "
+                "ORDER BY run_at LIMIT ?", (now, now, kind, self._kinds[kind].batch_size)).fetchall()
+            self._conn.executemany("UPDATE jobs SET claimed_until = ? WHERE id = ?",
+                                   [(now + CLAIM_TIMEOUT, job_id) for job_id, _, _ in jobs])
+        return kind, jobs
+
+    def _finish(self, jobs: List[Job], errors: Sequence[Optional[str]], max_attempts: int):
+        now = time.time()
+        with self._lock, self._transaction():
+            for (job_id, _, attempts), error in zip(jobs, errors):
+                if error is None:
+                    self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                    self.completed += 1
+                    continue
+                attempts += 1
+                self.failures += 1
+                if attempts >= max_attempts:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO dead_jobs (id, kind, payload, attempts, created_at, failed_at, last_error) "
+                        "SELECT id, kind, payload, ?, created_at, ?, ? FROM jobs WHERE id = ?",
+                        (attempts, now, str(error), job_id))
+                    self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                    self.dead_lettered += 1
+                else:
+                    self._conn.execute(
+                        "UPDATE jobs SET attempts = ?, run_at = ?, claimed_until = 0, last_error = ? WHERE id = ?",
+                        (attempts, now + backoff(attempts), str(error), job_id))
+
+    def _release(self, jobs: List[Job]):
+        """Hand back jobs interrupted by shutdown, without counting an attempt (on the loop: it is exiting)"""
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.executemany("UPDATE jobs SET claimed_until = 0 WHERE id = ?",
+                                   [(job_id,) for job_id, _, _ in jobs])
+
+    def _idle_time(self) -> float:
+        """Until the next job comes due, at most POLL_INTERVAL; also refreshes counts"""
+        kinds = list(self._kinds)
+        with self._lock:
+            next_due = self._conn.execute(
+                f"SELECT MIN(MAX(run_at, claimed_until)) FROM jobs WHERE kind IN ({','.join('?' * len(kinds))})",
+                kinds).fetchone()[0]
+            if time.time() - self._counted_at >= POLL_INTERVAL:
+                self._count(time.time())
+        if next_due is None:
+            return POLL_INTERVAL
+        return min(POLL_INTERVAL, max(0.0, next_due - time.time()))
+
+    def _count(self, now: float):
+        queued, due, running = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(run_at <= ? AND claimed_until <= ?), 0), "
+            "COALESCE(SUM(claimed_until > ?), 0) FROM jobs", (now, now, now)).fetchone()
+        dead = self._conn.execute("SELECT COUNT(*) FROM dead_jobs").fetchone()[0]
+        self.counts = {"queued": queued, "due": due, "running": running, "dead": dead}
+        self._counted_at = now
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        else:
+            self._conn.execute("COMMIT")
@@ -0,0 +1,175 @@
+"""
+Leaderboard
+===========
+
+Users ranked by points, behind /gamification/stats and
+/gamification/leaderboard, kept up to date by listening to the user store
+instead of sorting every user on every request:
+
+- one sorted list per scope: everyone, each college and each role. Keys
+  are (-points, user id), so the best come first and ties are broken by id;
+- a points change moves the user in the lists of their scopes, O(log n)
+  each;
+- rank() is the standard competition rank (users with the same points
+  share it), found by bisecting for the first key with those points, also
+  O(log n); top() and around() slice the list, O(log n + k).
+
+attach() builds the lists from the current store contents, so it must run
+after storage has been recovered.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+from store import Change
+
+# Configuration
+POINTS_PER_LEVEL = 100
+
+# Scopes, and the user field each one groups by (None: everyone)
+SCOPES = {"global": None, "college": "college", "role": "role"}
+# User fields the lists depend on; updates touching none of them are ignored
+USER_FIELDS = {"points", "college", "role"}
+
+Key = Tuple[int, str]
+
+
+def level_progress(points: int) -> Dict[str, Any]:
+    """Level reached with points, and how far along the next one is"""
+    level = points // POINTS_PER_LEVEL + 1
+    return {
+        "level": level,
+        "next_level_points": level * POINTS_PER_LEVEL,
+        "progress_to_next": round(100 * (points % POINTS_PER_LEVEL) / POINTS_PER_LEVEL, 2),
+    }
+
+
+def _points(user: Dict[str, Any]) -> int:
+    try:
+        return int(user.get("points") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class Leaderboard:
+    """Users ordered by points, overall and per college and role"""
+
+    def __init__(self, users):
+        self.users = users
+        self._reset()
+
+    def attach(self):
+        """Rank the current contents, then follow every later write"""
+        self.rebuild()
+        self.users.subscribe(self.apply)
+
+    def _reset(self):
+        self._lists: Dict[Tuple[str, Any], SortedList] = {}
+        # user id -> (points, {scope: group})
+        self._entries: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+
+    def rebuild(self):
+        self._reset()
+        keys: Dict[Tuple[str, Any], List[Key]] = {}
+        for user_id, user in self.users.items():
+            points, groups = self._summary(user)
+            self._entries[user_id] = points, groups
+            for scope, group in groups.items():
+                keys.setdefault((scope, group), []).append((-points, user_id))
+        self._lists = {list_key: SortedList(scoped) for list_key, scoped in keys.items()}
+
+    # Queries
+    def group_of(self, user_id: str, scope: str) -> Any:
+        """The college or role user_id is ranked within for scope (None for global)"""
+        entry = self._entries.get(user_id)
+        return entry[1].get(scope) if entry else None
+
+    def total(self, scope: str = "global", group: Any = None) -> int:
+        ranked = self._lists.get((scope, group))
+        return len(ranked) if ranked is not None else 0
+
+    def rank(self, user_id: str, scope: str = "global") -> Optional[int]:
+        """1-based rank of user_id within their own group for scope, or None if not ranked there"""
+        entry = self._entries.get(user_id)
+        if entry is None or scope not in entry[1]:
+            return None
+        points, groups = entry
+        return self._lists[scope, groups[scope]].bisect_left((-points,)) + 1
+
+    def top(self, limit: int, scope: str = "global", group: Any = None) -> List[Dict[str, Any]]:
+        """The limit best users of a group, best first"""
+        return self._slice(scope, group, 0, limit)
+
+    def around(self, user_id: str, radius: int, scope: str = "global") -> List[Dict[str, Any]]:
+        """user_id with up to radius users above and below, within their own group"""
+        entry = self._entries.get(user_id)
+        if entry is None or scope not in entry[1]:
+            return []
+        points, groups = entry
+        position = self._lists[scope, groups[scope]].index((-points, user_id))
+        start = max(0, position - radius)
+        return self._slice(scope, groups[scope], start, position + radius + 1)
+
+    def stats(self):
+        return {"users": len(self._entries),
+                "lists": {scope: sum(1 for list_scope, _ in self._lists if list_scope == scope)
+                          for scope in SCOPES}}
+
+    # Store listener
+    def apply(self, changes: List[Change]):
+        for change in changes:
+            if change.op in ("load", "clear"):
+                self.rebuild()
+            elif change.op == "insert":
+                self._remove(change.key)
+                self._add(change.key, change.data)
+            elif change.op == "update" and not USER_FIELDS.isdisjoint(change.data):
+                self._remove(change.key)
+                self._add(change.key, self.users[change.key])
+            elif change.op == "delete":
+                self._remove(change.key)
+
+    # Internals
+    @staticmethod
+    def _summary(user: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        groups = {}
+        for scope, field in SCOPES.items():
+            if field is None:
+                groups[scope] = None
+            elif user.get(field):
+                groups[scope] = user[field]
+        return _points(user), groups
+
+    def _add(self, user_id: str, user: Dict[str, Any]):
+        points, groups = self._summary(user)
+        self._entries[user_id] = points, groups
+        for scope, group in groups.items():
+            ranked = self._lists.get((scope, group))
+            if ranked is None:
+                ranked = self._lists[scope, group] = SortedList()
+            ranked.add((-points, user_id))
+
+    def _remove(self, user_id: str):
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        points, groups = entry
+        for scope, group in groups.items():
+            ranked = self._lists[scope, group]
+            ranked.remove((-points, user_id))
+            if not ranked and group is not None:
+                del self._lists[scope, group]
+
+    def _slice(self, scope: str, group: Any, start: int, stop: int) -> List[Dict[str, Any]]:
+        ranked = self._lists.get((scope, group))
+        if ranked is None or start >= stop:
+            return []
+        rows = []
+        for negated, user_id in ranked.islice(start, stop):
+            if not rows:
+                rank = ranked.bisect_left((negated,)) + 1
+            elif -negated != rows[-1]["points"]:
+                rank = start + len(rows) + 1
+            rows.append({"rank": rank, "id": user_id, "points": -negated})
+        return rows
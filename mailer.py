@@ -0,0 +1,186 @@
+"""
+Outbound Email
+==============
+
+Email is sent by the job queue (jobs.py), never by a request handler.
+Handlers call Mailer.enqueue() and return; the "email" job sends what was
+queued, in batches, through a transport chosen with MAIL_TRANSPORT:
+
+- "file":     writes each message as an .eml file to MAIL_DIR. This is the
+              local stand-in for development and tests;
+- "smtp":     one SMTP connection per batch (SMTP_HOST, SMTP_PORT, ...).
+              A refused recipient fails only its own message;
+- "sendgrid": one SendGrid API call per batch, with one personalization
+              per message. Needs the sendgrid package and SENDGRID_API_KEY.
+
+A message is a dict with to, subject and text. Transports block, so they
+run in a thread: a slow provider holds up a job worker, never the event
+loop.
+"""
+
+import asyncio
+import os
+import smtplib
+import time
+import uuid
+from email.message import EmailMessage
+from typing import Any, Dict, List, Optional
+
+from storage import DATA_DIR
+
+try:
+    import sendgrid
+except ImportError:  # Only needed with MAIL_TRANSPORT=sendgrid
+    sendgrid = None
+
+# Configuration
+MAIL_TRANSPORT = os.getenv("MAIL_TRANSPORT", "file")
+MAIL_FROM = os.getenv("MAIL_FROM", "Campus Events <no-reply@campus-events.local>")
+MAIL_DIR = os.getenv("MAIL_DIR", os.path.join(DATA_DIR or ".", "outbox"))
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY", "")
+# Links in emails; {token} is replaced with the link's token
+VERIFY_EMAIL_URL = os.getenv("VERIFY_EMAIL_URL", "http://localhost:8000/auth/verify-email?token={token}")
+RESET_PASSWORD_URL = os.getenv("RESET_PASSWORD_URL", "http://localhost:8000/login.html?reset_token={token}")
+
+# Per-message errors from a server that is otherwise working; anything else fails the batch
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def mime(message: Dict[str, Any], sender: str) -> EmailMessage:
+    email = EmailMessage()
+    email["From"] = sender
+    email["To"] = message["to"]
+    email["Subject"] = message["subject"]
+    email.set_content(message["text"])
+    return email
+
+
+class FileTransport:
+    """Every message as an .eml file in a directory"""
+
+    kind = "file"
+    batch_size = 100
+
+    def __init__(self, directory: str = MAIL_DIR, sender: str = MAIL_FROM):
+        self.directory = directory
+        self.sender = sender
+
+    def send(self, messages: List[Dict[str, Any]]) -> List[Optional[str]]:
+        os.makedirs(self.directory, exist_ok=True)
+        for message in messages:
+            path = os.path.join(self.directory, f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.eml")
+            with open(path + ".tmp", "wb") as file:
+                file.write(bytes(mime(message, self.sender)))
+            os.replace(path + ".tmp", path)
+        return [None] * len(messages)
+
+
+class SMTPTransport:
+    """One SMTP session per batch"""
+
+    kind = "smtp"
+    batch_size = 50
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, username: str = SMTP_USERNAME,
+                 password: str = SMTP_PASSWORD, starttls: bool = SMTP_STARTTLS, sender: str = MAIL_FROM):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.sender = sender
+
+    def send(self, messages: List[Dict[str, Any]]) -> List[Optional[str]]:
+        errors: List[Optional[str]] = []
+        with smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for message in messages:
+                try:
+                    smtp.send_message(mime(message, self.sender))
+                    errors.append(None)
+                except MESSAGE_ERRORS as error:
+                    errors.append(f"{type(error).__name__}: {error}")
+        return errors
+
+
+class SendGridTransport:
+    """One SendGrid mail/send call per batch"""
+
+    kind = "sendgrid"
+    batch_size = 1000  # Personalizations allowed per request
+
+    def __init__(self, api_key: str = SENDGRID_API_KEY, sender: str = MAIL_FROM):
+        if sendgrid is None:
+            raise RuntimeError("MAIL_TRANSPORT=sendgrid needs the sendgrid package")
+        self.client = sendgrid.SendGridAPIClient(api_key)
+        self.sender = sender
+
+    def send(self, messages: List[Dict[str, Any]]) -> List[Optional[str]]:
+        # Each message's text goes in through a substitution into the shared content
+        self.client.client.mail.send.post(request_body={
+            "from": {"email": self.sender},
+            "content": [{"type": "text/plain", "value": "-text-"}],
+            "personalizations": [{"to": [{"email": message["to"]}], "subject": message["subject"],
+                                  "substitutions": {"-text-": message["text"]}} for message in messages],
+        })  # Raises on an error status
+        return [None] * len(messages)
+
+
+TRANSPORTS = {"file": FileTransport, "smtp": SMTPTransport, "sendgrid": SendGridTransport}
+
+
+def create_transport(kind: str = MAIL_TRANSPORT):
+    if kind not in TRANSPORTS:
+        raise ValueError(f"Unknown mail transport: {kind}")
+    return TRANSPORTS[kind]()
+
+
+class Mailer:
+    """Queues messages and sends them from the job queue"""
+
+    job_kind = "email"
+
+    def __init__(self, queue, transport):
+        self.queue = queue
+        self.transport = transport
+        queue.register(self.job_kind, self.send_batch, batch_size=transport.batch_size, summary=self.summary)
+
+    async def enqueue(self, message: Dict[str, Any]) -> int:
+        return await self.queue.enqueue(self.job_kind, message)
+
+    @staticmethod
+    def summary(message: Dict[str, Any]) -> Dict[str, Any]:
+        """A message without its text, which may hold a sign-in or reset link"""
+        return {"to": message["to"], "subject": message["subject"]}
+
+    async def send_batch(self, messages: List[Dict[str, Any]]) -> List[Optional[str]]:
+        return await asyncio.to_thread(self.transport.send, messages)
+
+
+# Messages
+def verification_email(user: Dict[str, Any], token: str) -> Dict[str, Any]:
+    return {
+        "to": user["email"],
+        "subject": "Verify your email",
+        "text": f"Hi {user['name']},\n\nWelcome to Campus Events! Confirm your email address by opening "
+                f"this link:\n\n{VERIFY_EMAIL_URL.format(token=token)}\n",
+    }
+
+
+def password_reset_email(user: Dict[str, Any], token: str) -> Dict[str, Any]:
+    return {
+        "to": user["email"],
+        "subject": "Reset your password",
+        "text": f"Hi {user['name']},\n\nSomeone asked to reset the password of your Campus Events account. "
+                f"Choose a new one here:\n\n{RESET_PASSWORD_URL.format(token=token)}\n\n"
+                f"If it wasn't you, ignore this email; your password stays the same.\n",
+    }
@@ -0,0 +1,360 @@
+"""
+Metrics and Profiling
+=====================
+
+Request-level instrumentation, exposed in the Prometheus text format at
+/metrics:
+
+- MetricsMiddleware (pure ASGI, so it adds no per-request task or body
+  buffering) counts requests by method, route template and status, and
+  keeps latency and response size histograms per route plus the number
+  of requests in flight;
+- an event loop lag monitor sleeps LOOP_LAG_INTERVAL at a time and
+  records how late it wakes up: the time some callback held the loop;
+- code paths time themselves into named sections (metrics.timed() or
+  metrics.observe()); TimedJSONResponse does it for JSON rendering;
+- other components (the password hasher) register read-only values that
+  are read at scrape time.
+
+SamplingProfiler is opt-in (PROFILE_SAMPLE_RATE > 0): that fraction of
+requests is sampled every PROFILE_INTERVAL_MS by a background thread. A
+sample is the request's stack where it is at that moment: the event loop
+thread's stack while the request runs, or its chain of awaits while it
+waits (on a database, the password pool, the network). So a profile is
+wall-clock time, and time spent waiting shows up where it is waited for.
+Samples are aggregated as folded stacks ("GET /events/;frame;frame 12"),
+the input format of flamegraph.pl and speedscope.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from serialization import FastJSONResponse
+
+# Configuration
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Distinct folded stacks kept; samples of further stacks are counted as dropped
+PROFILE_MAX_STACKS = int(os.getenv("PROFILE_MAX_STACKS", "10000"))
+PROFILE_MAX_DEPTH = 128
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Counts of observations per bucket, Prometheus style"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: str) -> Iterator[str]:
+        separator = "," if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}" if labels else f"{name}_sum {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {self.count}" if labels else f"{name}_count {self.count}"
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def route_of(scope) -> str:
+    """The template of the route that served a request, e.g. /events/{event_id}"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "<unmatched>"
+
+
+class Metrics:
+    """In-process metric registry, rendered on demand"""
+
+    def __init__(self, lag_interval: float = LOOP_LAG_INTERVAL):
+        self.lag_interval = lag_interval
+        self.requests: Counter = Counter()  # (method, route, status) -> count
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.response_size: Dict[Tuple[str, str], Histogram] = {}
+        self.sections: Dict[str, Histogram] = {}
+        self.loop_lag = Histogram(LAG_BUCKETS)
+        self.in_flight = 0
+        self._readers: List[Tuple[str, str, str, Callable[[], float]]] = []
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, size: int):
+        if method not in METHODS:
+            method = "OTHER"
+        self.requests[(method, route, status)] += 1
+        key = (method, route)
+        latency = self.latency.get(key)
+        if latency is None:
+            latency = self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.response_size[key] = Histogram(SIZE_BUCKETS)
+        latency.observe(seconds)
+        self.response_size[key].observe(size)
+
+    def observe(self, section: str, seconds: float):
+        """Record time spent in a named section of code"""
+        histogram = self.sections.get(section)
+        if histogram is None:
+            histogram = self.sections[section] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timed(self, section: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(section, time.perf_counter() - started)
+
+    def register(self, name: str, kind: str, help: str, read: Callable[[], float]):
+        """Expose a value owned elsewhere; read() is called at every scrape"""
+        self._readers.append((name, kind, help, read))
+
+    def watch_loop(self):
+        """Start the lag monitor on the running loop, unless it is already running there"""
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = asyncio.get_running_loop().create_task(self._watch_lag())
+
+    async def _watch_lag(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag.observe(max(0.0, time.perf_counter() - started - self.lag_interval))
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_requests_total Requests served, by method, route and status",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(f'http_requests_total{{method="{method}",route="{_label(route)}",status="{status}"}} {count}')
+        lines += [
+            "# HELP http_request_duration_seconds Time to the end of the response, by method and route",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in sorted(self.latency.items()):
+            lines.extend(histogram.samples("http_request_duration_seconds",
+                                           f'method="{method}",route="{_label(route)}"'))
+        lines += [
+            "# HELP http_response_size_bytes Response body size, by method and route",
+            "# TYPE http_response_size_bytes histogram",
+        ]
+        for (method, route), histogram in sorted(self.response_size.items()):
+            lines.extend(histogram.samples("http_response_size_bytes", f'method="{method}",route="{_label(route)}"'))
+        lines += [
+            "# HELP http_requests_in_flight Requests being served",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP event_loop_lag_seconds How late the event loop ran a timer",
+            "# TYPE event_loop_lag_seconds histogram",
+        ]
+        lines.extend(self.loop_lag.samples("event_loop_lag_seconds", ""))
+        lines += [
+            "# HELP section_duration_seconds Time spent in named sections of code",
+            "# TYPE section_duration_seconds histogram",
+        ]
+        for section, histogram in sorted(self.sections.items()):
+            lines.extend(histogram.samples("section_duration_seconds", f'section="{_label(section)}"'))
+        for name, kind, help, read in self._readers:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {read():g}"]
+        return "\n".join(lines) + "\n"
+
+
+class _Profile:
+    """Samples of one request in progress"""
+
+    __slots__ = ("task", "thread_id", "samples")
+
+    def __init__(self, task: asyncio.Task, thread_id: int):
+        self.task = task
+        self.thread_id = thread_id
+        self.samples: Counter = Counter()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Wall-clock stack samples of a random fraction of requests"""
+
+    def __init__(self, rate: float = PROFILE_SAMPLE_RATE, interval_ms: float = PROFILE_INTERVAL_MS,
+                 max_stacks: int = PROFILE_MAX_STACKS):
+        self.rate = rate
+        self.interval = interval_ms / 1000
+        self.max_stacks = max_stacks
+        self.stacks: Counter = Counter()  # folded stack -> samples
+        self.profiled = 0
+        self.dropped = 0
+        self._active: Dict[int, _Profile] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sampled(self) -> bool:
+        """Whether to profile the next request"""
+        return self.rate > 0 and random.random() < self.rate
+
+    def start(self) -> Optional[_Profile]:
+        """Profile the current task from now on; call from the request's task"""
+        task = asyncio.current_task()
+        if task is None:
+            return None
+        profile = _Profile(task, threading.get_ident())
+        with self._lock:
+            self._active[id(profile)] = profile
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        self._wake.set()
+        return profile
+
+    def stop(self, profile: _Profile, label: str):
+        with self._lock:
+            del self._active[id(profile)]
+            self.profiled += 1
+            for stack, count in profile.samples.items():
+                key = f"{label};{stack}" if stack else label
+                if key in self.stacks or len(self.stacks) < self.max_stacks:
+                    self.stacks[key] += count
+                else:
+                    self.dropped += count
+
+    def folded(self, prefix: Optional[str] = None) -> str:
+        """Folded stacks, optionally only those of one route label ("GET /events/")"""
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+                           if prefix is None or stack == prefix or stack.startswith(prefix + ";"))
+
+    def clear(self):
+        with self._lock:
+            self.stacks.clear()
+            self.profiled = 0
+            self.dropped = 0
+
+    def stats(self):
+        return {"sample_rate": self.rate, "interval_ms": self.interval * 1000, "profiled_requests": self.profiled,
+                "in_progress": len(self._active), "stacks": len(self.stacks),
+                "samples": sum(self.stacks.values()), "dropped_samples": self.dropped}
+
+    # Sampler thread
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wake.clear()
+                self._wake.wait()
+            with self._lock:
+                frames = sys._current_frames()
+                for profile in self._active.values():
+                    profile.samples[";".join(self._stack(profile, frames))] += 1
+            time.sleep(self.interval)
+
+    def _stack(self, profile: _Profile, frames) -> List[str]:
+        """Frame names of where a request is, outermost first"""
+        coroutine = profile.task.get_coro()
+        root = getattr(coroutine, "cr_frame", None)
+        if root is None:
+            return ["<finished>"]
+
+        # Running: the loop thread's stack, from the request's outermost coroutine in
+        stack = []
+        frame = frames.get(profile.thread_id)
+        while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+            stack.append(frame)
+            if frame is root:
+                return [_frame_name(frame) for frame in reversed(stack)]
+            frame = frame.f_back
+
+        # Waiting: follow what each coroutine awaits down to the future it is parked on
+        names = []
+        awaitable = coroutine
+        while awaitable is not None and len(names) < PROFILE_MAX_DEPTH:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                names.append(f"<await {type(awaitable).__name__}>")
+                break
+            names.append(_frame_name(frame))
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        return names
+
+
+class MetricsMiddleware:
+    """Records every HTTP request into metrics, profiling the sampled ones"""
+
+    def __init__(self, app, metrics: Metrics, profiler: Optional[SamplingProfiler] = None):
+        self.app = app
+        self.metrics = metrics
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        metrics = self.metrics
+        metrics.watch_loop()
+        status = 500  # Unless the app gets as far as starting a response
+        size = 0
+
+        async def measuring_send(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        profile = self.profiler.start() if self.profiler is not None and self.profiler.sampled() else None
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, measuring_send)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.in_flight -= 1
+            route = route_of(scope)
+            metrics.observe_request(scope["method"], route, status, elapsed, size)
+            if profile is not None:
+                self.profiler.stop(profile, f"{scope['method']} {route}")
+
+
+# Shared instances used by the backends
+metrics = Metrics()
+profiler = SamplingProfiler()
+
+
+class TimedJSONResponse(FastJSONResponse):
+    """JSONResponse that records its rendering time as the "serialization" section"""
+
+    def render(self, content) -> bytes:
+        started = time.perf_counter()
+        body = super().render(content)
+        metrics.observe("serialization", time.perf_counter() - started)
+        return body
@@ -6,6 +6,7 @@ class NotificationManager {
         this.apiBase = 'http://localhost:8001';
         this.permissionGranted = false;
         this.worker = null;
+        this.stream = null;
         this.notifications = [];
         this.unreadCount = 0;
         this.preferences = {
@@ -406,14 +407,17 @@ class NotificationManager {
             if (event.detail.authenticated) {
                 console.log('👤 User logged in - loading user notifications');
                 this.syncWithServer();
+                this.connectStream();
             } else {
                 console.log('👤 User logged out - clearing notifications');
+                this.disconnectStream();
                 // Optional: Clear notifications on logout
             }
         });
 
         // Listen for logout
         document.addEventListener('logout', () => {
+            this.disconnectStream();
             // Clear user-specific notifications
             this.notifications = this.notifications.filter(n => n.type !== 'personal');
             this.saveToLocalStorage();
@@ -458,6 +462,56 @@ class NotificationManager {
         }
     }
 
+    /**
+     * Receive notifications pushed by the server instead of polling.
+     * EventSource reconnects by itself and sends Last-Event-ID, so nothing is missed.
+     */
+    connectStream() {
+        if (this.stream || !('EventSource' in window) || !window.AuthManager?.isAuthenticated()) return;
+
+        const token = encodeURIComponent(window.AuthManager.getAuthToken());
+        this.stream = new EventSource(`${this.apiBase}/notifications/stream?token=${token}`);
+
+        this.stream.addEventListener('notification', (event) => {
+            const serverNotif = JSON.parse(event.data);
+            if (this.notifications.some(n => n.serverId === serverNotif.id)) return;
+            this.addToNotifications({
+                id: `server_${serverNotif.id}`,
+                serverId: serverNotif.id,
+                title: serverNotif.title,
+                message: serverNotif.message,
+                timestamp: new Date(serverNotif.timestamp).getTime(),
+                type: serverNotif.type || 'system',
+                read: serverNotif.read || false,
+                persistent: false
+            });
+            if (this.permissionGranted && this.preferences.browser) {
+                this.showNativeNotification(serverNotif.title, { body: serverNotif.message });
+            }
+        });
+
+        // Read elsewhere (another tab or device)
+        this.stream.addEventListener('read', (event) => {
+            const data = JSON.parse(event.data);
+            if (data.all) {
+                this.markAllAsRead();
+            } else {
+                const local = this.notifications.find(n => n.serverId === data.id);
+                if (local) this.markAsRead(local.id);
+            }
+        });
+
+        // Too far behind: fetch the current state instead
+        this.stream.addEventListener('resync', () => this.syncWithServer());
+    }
+
+    disconnectStream() {
+        if (this.stream) {
+            this.stream.close();
+            this.stream = null;
+        }
+    }
+
     /**
      * Utility function for VAPID key conversion
      */
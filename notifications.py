@@ -0,0 +1,340 @@
+"""
+Notifications
+=============
+
+Per-user notifications and a Server-Sent Events push channel, replacing
+client polling:
+
+- notifications live in a NotificationStore, so read state is persisted
+  like any other store write; notify_event_change() creates them from the
+  request that changed the event (never from replayed history);
+- every open /notifications/stream connection is a Subscriber: a bounded
+  buffer plus an asyncio.Event. The hub listens to the notification,
+  event and comment stores and appends SSE messages to the buffers of the subscribers
+  concerned, so an idle connection costs one parked coroutine and no
+  timers. A single ticker wakes every subscriber once per
+  HEARTBEAT_INTERVAL, a slice at a time, to send a keep-alive comment;
+- a client that falls more than SUBSCRIBER_BUFFER messages behind loses
+  the oldest ones and is sent a "resync" event telling it to refetch.
+
+Changes replayed from other workers (sqlite backend) reach the listeners
+too, so subscribers see writes made in any worker. Requests replay them
+as they come in; while streams are open the hub also calls its sync
+function every SYNC_INTERVAL, so a worker that serves nothing but
+streams still picks them up.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from fastapi import Response
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+SUBSCRIBER_BUFFER = int(os.getenv("SSE_BUFFER_SIZE", "100"))
+SSE_RETRY_MS = 3000
+HEARTBEAT_SLICES = 10
+# How often other workers' writes are looked for while streams are open (shared storage)
+SYNC_INTERVAL = float(os.getenv("SSE_SYNC_INTERVAL", "0.5"))
+
+# Event fields worth telling attendees about when they change
+NOTEWORTHY_FIELDS = ("title", "date", "time", "location")
+
+
+def sse_message(event: str, data: Any, message_id: Optional[str] = None) -> str:
+    lines = f"id: {message_id}\n" if message_id is not None else ""
+    return f"{lines}event: {event}\ndata: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+
+
+class Subscriber:
+    """One open stream: what it listens to and what it has not been sent yet"""
+
+    __slots__ = ("user_id", "event_ids", "buffer", "wake", "overflowed", "heartbeat_due", "closed")
+
+    def __init__(self, user_id: str, event_ids: Optional[Set[str]], buffer_size: int = SUBSCRIBER_BUFFER):
+        self.user_id = user_id
+        self.event_ids = event_ids  # None: every event
+        self.buffer: Deque[str] = deque(maxlen=buffer_size)
+        self.wake = asyncio.Event()
+        self.overflowed = False
+        self.heartbeat_due = False
+        self.closed = False
+
+    def push(self, message: str):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.overflowed = True  # deque drops the oldest message
+        self.buffer.append(message)
+        self.wake.set()
+
+
+class EventStreamResponse(Response):
+    """ASGI response for one SSE stream.
+
+    Leaner than StreamingResponse, which keeps a task group and two tasks
+    per connection: here the request coroutine writes the stream and one
+    small task waits for the client to disconnect.
+    """
+
+    media_type = "text/event-stream"
+
+    def __init__(self, body: AsyncIterator[str], subscriber: Subscriber):
+        self.status_code = 200
+        self.background = None
+        self.body = body
+        self.subscriber = subscriber
+        self.raw_headers = [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),  # nginx: don't buffer the stream
+        ]
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": self.raw_headers})
+        watcher = asyncio.get_running_loop().create_task(self._watch_disconnect(receive))
+        try:
+            async for chunk in self.body:
+                await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        finally:
+            watcher.cancel()
+            await self.body.aclose()
+
+    async def _watch_disconnect(self, receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        self.subscriber.closed = True
+        self.subscriber.wake.set()
+
+
+class NotificationHub:
+    """Routes store changes to the open streams"""
+
+    def __init__(self, notifications, events, comments, heartbeat_interval: float = HEARTBEAT_INTERVAL,
+                 sync: Optional[Callable[[], None]] = None, sync_interval: float = SYNC_INTERVAL):
+        """sync: replays other workers' writes into the stores (storage.sync), if they are shared"""
+        self.notifications = notifications
+        self.events = events
+        self.heartbeat_interval = heartbeat_interval
+        self.sync = sync
+        self.sync_interval = sync_interval
+        self._by_user: Dict[str, Set[Subscriber]] = {}
+        self._by_event: Dict[str, Set[Subscriber]] = {}
+        self._all_events: Set[Subscriber] = set()
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._syncer: Optional[asyncio.Task] = None
+        notifications.subscribe(self.apply_notifications)
+        events.subscribe(self.apply_events)
+        comments.subscribe(self.apply_comments)
+
+    @property
+    def connections(self) -> int:
+        return sum(len(subscribers) for subscribers in self._by_user.values())
+
+    # Streams
+    def subscribe(self, user_id: str, event_ids: Optional[Iterable[str]] = ()) -> Subscriber:
+        """event_ids: events to receive live changes for; None for all of them"""
+        subscriber = Subscriber(user_id, set(event_ids) if event_ids is not None else None)
+        self._by_user.setdefault(user_id, set()).add(subscriber)
+        if subscriber.event_ids is None:
+            self._all_events.add(subscriber)
+        else:
+            for event_id in subscriber.event_ids:
+                self._by_event.setdefault(event_id, set()).add(subscriber)
+        loop = asyncio.get_running_loop()
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = loop.create_task(self._heartbeat_loop())
+        if self.sync is not None and (self._syncer is None or self._syncer.done()):
+            self._syncer = loop.create_task(self._sync_loop())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._discard(self._by_user, subscriber.user_id, subscriber)
+        if subscriber.event_ids is None:
+            self._all_events.discard(subscriber)
+        else:
+            for event_id in subscriber.event_ids:
+                self._discard(self._by_event, event_id, subscriber)
+
+    async def stream(self, subscriber: Subscriber, last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+        """SSE body for one subscriber; unsubscribes when the client goes away"""
+        try:
+            first = f"retry: {SSE_RETRY_MS}\n\n"
+            # Notifications missed while disconnected, oldest first
+            if last_event_id:
+                for notification in reversed(self.notifications.for_user(subscriber.user_id, after=last_event_id)):
+                    first += sse_message("notification", notification, notification["id"])
+            first += sse_message("unread", {"unread_count": self.notifications.unread_count(subscriber.user_id)})
+            yield first
+
+            while True:
+                await subscriber.wake.wait()
+                subscriber.wake.clear()
+                if subscriber.closed:
+                    return
+                chunk = ""
+                if subscriber.overflowed:
+                    subscriber.overflowed = False
+                    chunk += sse_message("resync", {"reason": "buffer overflow"})
+                if subscriber.buffer:
+                    chunk += "".join(subscriber.buffer)
+                    subscriber.buffer.clear()
+                if subscriber.heartbeat_due:
+                    subscriber.heartbeat_due = False
+                    chunk = chunk or ": ping\n\n"
+                if chunk:
+                    yield chunk
+        finally:
+            self.unsubscribe(subscriber)
+
+    def response(self, subscriber: Subscriber, last_event_id: Optional[str] = None) -> "EventStreamResponse":
+        return EventStreamResponse(self.stream(subscriber, last_event_id), subscriber)
+
+    def close(self):
+        for task in (self._heartbeat, self._syncer):
+            if task is not None:
+                task.cancel()
+        self._heartbeat = self._syncer = None
+
+    # Store listeners
+    def apply_notifications(self, changes):
+        for change in changes:
+            if change.op == "insert":
+                user_id = change.data["user_id"]
+                if user_id in self._by_user:
+                    self._send_user(user_id, sse_message("notification", change.data, change.key))
+            elif change.op == "read":
+                notification = self.notifications.get(change.key)
+                if notification is not None and notification["user_id"] in self._by_user:
+                    self._send_user(notification["user_id"], sse_message("read", {"id": change.key}))
+            elif change.op == "read_all" and change.key in self._by_user:
+                self._send_user(change.key, sse_message("read", {"all": True}))
+
+    def apply_events(self, changes):
+        for change in changes:
+            if change.op in ("load", "clear"):
+                self._send_all(sse_message("resync", {"reason": "events reloaded"}))
+                continue
+            if not self._following(change.key):
+                continue
+            payload: Dict[str, Any] = {"event_id": change.key, "op": change.op}
+            if change.op in ("attend", "unattend", "waitlist", "unwaitlist"):
+                event = self.events.get(change.key)
+                payload["user_id"] = change.data
+                payload["attendees_count"] = len(event["attendees"]) if event else None
+                payload["waitlist_count"] = len(event["waitlist"]) if event else None
+            elif change.op == "update":
+                payload["fields"] = change.data
+            elif change.op == "insert":
+                payload["event"] = change.data
+            self._send_event(change.key, sse_message("event", payload))
+
+    def apply_comments(self, changes):
+        for change in changes:
+            if change.op in ("load", "clear"):
+                self._send_all(sse_message("resync", {"reason": "comments reloaded"}))
+            elif change.op == "insert" and self._following(change.data["event_id"]):
+                payload = {"event_id": change.data["event_id"], "op": "comment", "comment": change.data}
+                self._send_event(change.data["event_id"], sse_message("event", payload))
+
+    # Internals
+    def _following(self, event_id: str) -> bool:
+        return bool(self._all_events) or event_id in self._by_event
+
+    def _send_user(self, user_id: str, message: str):
+        for subscriber in self._by_user[user_id]:
+            subscriber.push(message)
+
+    def _send_event(self, event_id: str, message: str):
+        subscribers = self._by_event.get(event_id, ())
+        for subscriber in subscribers:
+            subscriber.push(message)
+        for subscriber in self._all_events:
+            if subscriber not in subscribers:
+                subscriber.push(message)
+
+    def _send_all(self, message: str):
+        for subscribers in self._by_user.values():
+            for subscriber in subscribers:
+                subscriber.push(message)
+
+    async def _heartbeat_loop(self):
+        # Each subscriber gets one heartbeat per interval, but they are spread over
+        # HEARTBEAT_SLICES ticks so tens of thousands of streams don't all wake at once
+        while self._by_user:
+            subscribers = [s for group in self._by_user.values() for s in group]
+            size = -(-len(subscribers) // HEARTBEAT_SLICES)
+            for start in range(0, HEARTBEAT_SLICES * size, size or 1):
+                await asyncio.sleep(self.heartbeat_interval / HEARTBEAT_SLICES)
+                for subscriber in subscribers[start:start + size]:
+                    if not subscriber.closed:
+                        subscriber.heartbeat_due = True
+                        subscriber.wake.set()
+
+    async def _sync_loop(self):
+        while self._by_user:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Replaying other workers' changes failed")
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[Subscriber]], key: str, subscriber: Subscriber):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.discard(subscriber)
+            if not bucket:
+                del index[key]
+
+
+def notify_event_change(notifications, event: Dict[str, Any], kind: str,
+                        actor_id: Optional[str], actor_name: str = "Someone",
+                        fields: Optional[Dict[str, Any]] = None,
+                        users: Iterable[str] = ()) -> List[Dict[str, Any]]:
+    """Store notifications about a change to event for the users it concerns.
+
+    kind is "comment" or "attend" (tells the organizer), "update" (tells
+    attendees, if a noteworthy field changed), "delete" (tells attendees)
+    or "promote" (tells users, just moved off the waitlist).
+    """
+    title = event.get("title", "an event")
+    if kind == "comment":
+        recipients = [event.get("created_by")]
+        heading, message = "New comment", f'{actor_name} commented on "{title}"'
+    elif kind == "attend":
+        recipients = [event.get("created_by")]
+        heading, message = "New attendee", f'{actor_name} is attending "{title}"'
+    elif kind == "update":
+        changed = [field for field in NOTEWORTHY_FIELDS if field in (fields or {})]
+        if not changed:
+            return []
+        recipients = list(event.get("attendees", ()))
+        heading, message = "Event updated", f'"{title}" changed: {", ".join(changed)}'
+    elif kind == "promote":
+        recipients = list(users)
+        heading, message = "You're in", f'A seat opened up: you are now attending "{title}"'
+    elif kind == "delete":
+        recipients = list(event.get("attendees", ()))
+        heading, message = "Event cancelled", f'"{title}" has been cancelled'
+    else:
+        raise ValueError(f"Unknown notification kind: {kind}")
+
+    timestamp = datetime.now().isoformat()
+    created = [{
+        "user_id": user_id,
+        "type": f"event_{kind}",
+        "title": heading,
+        "message": message,
+        "event_id": event.get("id"),
+        "timestamp": timestamp,
+    } for user_id in dict.fromkeys(recipients) if user_id is not None and user_id != actor_id]
+    if created:
+        # One store write for all recipients, however many attendees the event has
+        notifications.insert_many(created)
+    return created
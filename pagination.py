@@ -0,0 +1,52 @@
+"""
+Pagination Helpers
+==================
+
+Opaque cursors and field projection for paginated listings.
+"""
+
+import base64
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException
+
+
+def encode_cursor(sort_key: Optional[Sequence[str]]) -> Optional[str]:
+    """Turn a store sort key into an opaque, URL-safe cursor"""
+    if sort_key is None:
+        return None
+    raw = json.dumps(list(sort_key), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    """Inverse of encode_cursor; a malformed cursor is a client error"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_key = json.loads(raw)
+        if not (isinstance(sort_key, list) and all(isinstance(part, str) for part in sort_key)):
+            raise ValueError(sort_key)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(sort_key)
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[List[str]]:
+    """Parse a comma separated ?fields= projection ("id" is always included)"""
+    if not fields:
+        return None
+    allowed = set(allowed)
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + [name for name in requested if name != "id"]
+
+
+def project(record: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    if fields is None:
+        return record
+    return {name: record.get(name) for name in fields}
@@ -0,0 +1,190 @@
+"""
+Password Hashing Service
+========================
+
+bcrypt is deliberately slow, so hashing and verification run on a bounded
+worker pool instead of the event loop. When the pool and its queue are full
+callers get a 503 straight away rather than piling up behind each other.
+
+bcrypt only looks at the first 72 bytes of a password, and newer bcrypt
+releases raise on anything longer. Longer passwords are refused when a
+hash is made (400) and never match at login.
+
+Legacy unsalted SHA-256 hashes (written by earlier versions of
+simple_backend.py) are still accepted and are upgraded to bcrypt on the
+next successful login.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import bcrypt
+from fastapi import HTTPException
+
+# Configuration
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")  # "thread" or "process"
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+MAX_PASSWORD_BYTES = 72  # bcrypt's input limit
+
+
+def is_legacy_hash(hashed: str) -> bool:
+    """True for the old hex-encoded SHA-256 hashes"""
+    if len(hashed) != 64:
+        return False
+    try:
+        int(hashed, 16)
+    except ValueError:
+        return False
+    return True
+
+
+def is_too_long(password: str) -> bool:
+    return len(password.encode("utf-8")) > MAX_PASSWORD_BYTES
+
+
+def needs_rehash(hashed: str, rounds: int = BCRYPT_ROUNDS) -> bool:
+    """True if the hash is legacy or uses fewer bcrypt rounds than configured"""
+    if is_legacy_hash(hashed):
+        return True
+    try:
+        return int(hashed.split("$")[2]) < rounds
+    except (IndexError, ValueError):
+        return False
+
+
+# Worker functions (module level so a process pool can pickle them)
+def _hash_password(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _check_password(password: str, hashed: str) -> bool:
+    if not hashed:
+        return False  # Social login accounts have no password
+    if is_legacy_hash(hashed):
+        legacy = hashlib.sha256(password.encode("utf-8")).hexdigest()
+        return hmac.compare_digest(legacy, hashed)
+    if is_too_long(password):
+        return False  # Could never have been hashed
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+    except ValueError:
+        return False  # Malformed stored hash ("Invalid salt"): no password matches it
+
+
+def _timed(func, *args) -> Tuple[Any, float]:
+    started = time.perf_counter()
+    return func(*args), time.perf_counter() - started
+
+
+class PasswordHasher:
+    """bcrypt on a bounded thread or process pool"""
+
+    def __init__(self, executor: str = PASSWORD_HASH_EXECUTOR,
+                 workers: int = PASSWORD_HASH_WORKERS,
+                 max_queue: int = PASSWORD_HASH_MAX_QUEUE,
+                 rounds: int = BCRYPT_ROUNDS):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown password hash executor: {executor}")
+        self.executor_kind = executor
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.rounds = rounds
+        self._executor: Optional[Executor] = None
+
+        # Saturation metrics; only touched from the event loop thread
+        self._pending = 0
+        self._peak_pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._work_seconds = 0.0
+        self._wait_seconds = 0.0
+
+    async def hash(self, password: str) -> str:
+        if is_too_long(password):
+            raise HTTPException(status_code=400,
+                                detail=f"Password must be at most {MAX_PASSWORD_BYTES} bytes long")
+        return await self._submit(_hash_password, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._submit(_check_password, password, hashed)
+
+    async def verify_and_upgrade(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password, returning a replacement hash if the stored one is outdated"""
+        if not await self.verify(password, hashed):
+            return False, None
+        if needs_rehash(hashed, self.rounds):
+            return True, await self.hash(password)
+        return True, None
+
+    def hash_sync(self, password: str) -> str:
+        """Blocking hash for startup code that runs before the event loop"""
+        return _hash_password(password, self.rounds)
+
+    def stats(self) -> Dict[str, Any]:
+        busy = min(self._pending, self.workers)
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "busy_workers": busy,
+            "queued": self._pending - busy,
+            "peak_pending": self._peak_pending,
+            "saturation": busy / self.workers,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "avg_work_ms": self._average(self._work_seconds),
+            "avg_wait_ms": self._average(self._wait_seconds),
+            "work_seconds": round(self._work_seconds, 6),
+            "wait_seconds": round(self._wait_seconds, 6),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def _submit(self, func, *args):
+        if self._pending >= self.workers + self.max_queue:
+            self._rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Authentication is busy, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+
+        self._pending += 1
+        self._peak_pending = max(self._peak_pending, self._pending)
+        submitted = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, work = await loop.run_in_executor(self._get_executor(), _timed, func, *args)
+        finally:
+            self._pending -= 1
+
+        self._completed += 1
+        self._work_seconds += work
+        self._wait_seconds += max(0.0, time.perf_counter() - submitted - work)
+        return result
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="password-hash")
+        return self._executor
+
+    def _average(self, total: float) -> float:
+        return round(total * 1000 / self._completed, 3) if self._completed else 0.0
+
+
+# Shared instance used by the backends
+password_hasher = PasswordHasher()
@@ -0,0 +1,273 @@
+"""
+Persistence Engine
+==================
+
+The "wal" storage backend. Makes the in-memory stores durable without
+putting a database in the request path:
+
+- every store change is appended to a write-ahead log (NDJSON segments);
+- the log is fsynced according to the durability mode;
+- every SNAPSHOT_EVERY changes the full state is written to a snapshot and
+  log segments it covers are deleted;
+- on startup the latest snapshot is loaded and the log tail replayed.
+
+Durability modes:
+
+- "always": fsync before the write returns;
+- "batch":  writes reach the OS immediately and are fsynced in groups
+            every FSYNC_INTERVAL seconds (default);
+- "async":  writes are buffered in process and flushed and fsynced by the
+            background thread every FSYNC_INTERVAL seconds.
+"""
+
+import atexit
+import glob
+import json
+import os
+import pickle
+import threading
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from storage import DATA_DIR, StorageBackend
+from store import Change
+
+# Configuration
+DURABILITY = os.getenv("DURABILITY", "batch")
+FSYNC_INTERVAL = float(os.getenv("FSYNC_INTERVAL", "0.05"))
+SNAPSHOT_EVERY = int(os.getenv("SNAPSHOT_EVERY", "100000"))
+
+SNAPSHOT_FILE = "snapshot.pickle"
+EPOCH_FILE = "epoch"
+SEGMENT_PATTERN = "wal-*.log"
+
+
+def _segment_name(first_seq: int) -> str:
+    return f"wal-{first_seq:016d}.log"
+
+
+class PersistenceEngine(StorageBackend):
+    """Write-ahead log plus periodic snapshots for a set of stores"""
+
+    kind = "wal"
+
+    def __init__(self, stores: Iterable, directory: str = DATA_DIR,
+                 durability: str = DURABILITY, fsync_interval: float = FSYNC_INTERVAL,
+                 snapshot_every: int = SNAPSHOT_EVERY):
+        if durability not in ("always", "batch", "async"):
+            raise ValueError(f"Unknown durability mode: {durability}")
+        super().__init__(stores)
+        self.directory = directory
+        self.durability = durability
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+
+        self._seq = 0                 # sequence number of the last logged change
+        self._since_snapshot = 0
+        self._log = None
+        self._dirty = False           # written but not yet fsynced
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._snapshotting = threading.Lock()
+
+    # Lifecycle
+    def open(self):
+        """Recover state from disk, then start logging new changes"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.epoch = self._read_epoch()
+        self.recover()
+        self._open_segment(self._seq + 1)
+        for store in self.stores.values():
+            store.subscribe(self.record)
+        if self.durability != "always":
+            self._flusher = threading.Thread(target=self._flush_loop, name="wal-flusher", daemon=True)
+            self._flusher.start()
+        # Interpreter exit without a server shutdown still flushes the buffered tail
+        atexit.register(self.close)
+
+    def close(self):
+        """Flush everything and stop the background thread"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            if self._log is not None:
+                self._sync_locked()
+                self._log.close()
+                self._log = None
+
+    def recover(self) -> int:
+        """Load the latest snapshot and replay the log after it; returns changes replayed"""
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+            for name, state in snapshot["stores"].items():
+                if name in self.stores:
+                    self.stores[name].load(state)
+            self._seq = snapshot["seq"]
+
+        replayed = 0
+        for path in self._segments():
+            replayed += self._replay_segment(path)
+        return replayed
+
+    # Logging
+    def record(self, changes: List[Change]):
+        """Store listener: append changes to the log"""
+        lines = []
+        for change in changes:
+            self._seq += 1
+            lines.append(json.dumps({
+                "s": self._seq,
+                "c": change.collection,
+                "o": change.op,
+                "k": change.key,
+                "d": change.data,
+            }, separators=(",", ":")))
+        payload = "\n".join(lines) + "\n"
+
+        with self._lock:
+            self._log.write(payload)
+            if self.durability == "always":
+                self._sync_locked()
+            else:
+                if self.durability == "batch":
+                    self._log.flush()
+                self._dirty = True
+
+        self._since_snapshot += len(changes)
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        """Write a snapshot of the current state and drop the log it covers.
+
+        The state is copied on the calling thread so it is consistent with
+        the log position. That copy is one pass over the records, so the
+        write that triggers the snapshot still waits for it; pickling and
+        writing the file, the slow part, happen on a background thread.
+        """
+        if not self._snapshotting.acquire(blocking=False):
+            return  # Previous snapshot still being written
+        try:
+            state = {
+                "seq": self._seq,
+                "stores": {name: store.copy_state() for name, store in self.stores.items()},
+            }
+            with self._lock:
+                self._sync_locked()
+                self._log.close()
+                self._open_segment(self._seq + 1)
+            self._since_snapshot = 0
+        except BaseException:
+            self._snapshotting.release()
+            raise
+        threading.Thread(target=self._write_snapshot, args=(state, self._seq),
+                         name="wal-snapshot", daemon=True).start()
+
+    def history(self, collections: Iterable[str]) -> Tuple[int, List[Tuple[int, Change]]]:
+        """The changes to collections in the log segments not yet compacted"""
+        with self._lock:
+            if self._log is not None:
+                self._log.flush()
+        collections = set(collections)
+        start, changes = None, []
+        for path in self._segments():
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Torn write, dropped by the next recovery
+                    if entry["s"] > self._seq:
+                        break
+                    if start is None:
+                        start = entry["s"] - 1
+                    if entry["c"] in collections:
+                        changes.append((entry["s"], Change(entry["c"], entry["o"], entry["k"], entry["d"])))
+        return (self._seq if start is None else start), changes
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": self.kind,
+            "durability": self.durability,
+            "seq": self._seq,
+            "changes_since_snapshot": self._since_snapshot,
+            "segments": len(self._segments()),
+        }
+
+    # Internals
+    def _read_epoch(self) -> str:
+        """The id of this data directory's history, created along with it"""
+        path = os.path.join(self.directory, EPOCH_FILE)
+        if not os.path.exists(path):
+            with open(path + ".tmp", "w") as f:
+                f.write(uuid.uuid4().hex[:12])
+            os.replace(path + ".tmp", path)
+        with open(path) as f:
+            return f.read().strip()
+
+    def _segments(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)))
+
+    def _open_segment(self, first_seq: int):
+        path = os.path.join(self.directory, _segment_name(first_seq))
+        self._log = open(path, "a", encoding="utf-8")
+
+    def _replay_segment(self, path: str) -> int:
+        replayed = 0
+        with open(path, "rb+") as f:
+            offset = 0
+            for line in iter(f.readline, b""):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash: drop it and anything after it
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+                if entry["s"] <= self._seq:
+                    continue
+                store = self.stores.get(entry["c"])
+                if store is not None:
+                    store.apply(Change(entry["c"], entry["o"], entry["k"], entry["d"]))
+                self._seq = entry["s"]
+                replayed += 1
+        return replayed
+
+    def _sync_locked(self):
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._dirty = False
+
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.fsync_interval)
+            with self._lock:
+                if self._dirty and self._log is not None:
+                    self._sync_locked()
+
+    def _write_snapshot(self, state: Dict[str, object], seq: int):
+        try:
+            payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+            path = os.path.join(self.directory, SNAPSHOT_FILE)
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+
+            # Segments that start at or before the snapshot position are fully covered
+            current = _segment_name(seq + 1)
+            for segment in self._segments():
+                if os.path.basename(segment) < current:
+                    os.remove(segment)
+        finally:
+            self._snapshotting.release()
@@ -0,0 +1,361 @@
+"""
+Recommendations
+===============
+
+"Events you might like": item-to-item collaborative filtering over who
+attends and who favorites what.
+
+- A user interacts with an event by attending it, favoriting it, or both
+  (counted once). co[i][j] is the number of users who interacted with
+  both i and j, and degree[i] the number who interacted with i. co is
+  sparse, one growable row of (j, count) arrays per event, because most
+  pairs of events never share anyone: bulk imports bring in many
+  thousands of events nobody has attended yet, and their rows stay
+  empty. A count that drops to zero keeps its slot in the row.
+- Similarity is cosine: co[i][j] / sqrt(degree[i] * degree[j]). Every
+  event keeps its TOP_K most similar events.
+- An attend or favorite updates co in O(events the user has) and marks
+  the rows it changed. Requests refresh up to REFRESH_BATCH marked rows
+  first. Only those rows are recomputed, so other events' similarity to
+  an event whose popularity changed is slightly out of date until their
+  own rows are refreshed.
+- To recommend: the similarity lists of a user's events are summed per
+  candidate with one bincount. The user's own events and past or deleted
+  ones are masked out, and the best limit are picked by argpartition.
+  Users with no history, or too few candidates, get the most popular
+  upcoming events.
+
+rebuild() starts over from the stores and pairs up every user's events
+with NumPy. attach() runs it after storage has been recovered, and it
+runs again, on the next request, after a store is reloaded or cleared.
+"""
+
+import os
+from datetime import date
+from itertools import islice
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from store import Change
+
+# Configuration
+TOP_K = int(os.getenv("RECOMMENDATION_TOP_K", "50"))
+REFRESH_BATCH = int(os.getenv("RECOMMENDATION_REFRESH_BATCH", "256"))
+# Upper bound on the user-event pairs materialized at once while rebuilding
+PAIR_CHUNK = 4_000_000
+# Up to this many event pairs, pairs are counted into a dense array rather than sorted
+DENSE_COUNT_LIMIT = 1 << 23
+INITIAL_CAPACITY = 64
+
+# Interaction sources, as bits
+ATTENDED = 1
+FAVORITE = 2
+
+NO_DATE = 99991231  # Events without a valid date never count as past
+
+
+class _Row:
+    """The co-occurrence counts of one event: cols[:size] with counts[:size]"""
+
+    __slots__ = ("positions", "cols", "counts", "size")
+
+    def __init__(self, cols: Optional[np.ndarray] = None, counts: Optional[np.ndarray] = None):
+        if cols is None:
+            cols, counts = np.zeros(0, np.int32), np.zeros(0, np.int32)
+        self.cols = cols
+        self.counts = counts
+        self.size = len(cols)
+        self.positions: Dict[int, int] = dict(zip(cols.tolist(), range(self.size)))
+
+    def add(self, col: int, delta: int):
+        position = self.positions.get(col)
+        if position is None:
+            position = self.positions[col] = self.size
+            if self.size == len(self.cols):
+                capacity = max(8, self.size * 2)
+                self.cols = np.resize(self.cols, capacity)
+                self.counts = np.resize(self.counts, capacity)
+            self.cols[position] = col
+            self.counts[position] = 0
+            self.size += 1
+        self.counts[position] += delta
+
+    def get(self, col: int) -> int:
+        position = self.positions.get(col)
+        return 0 if position is None else int(self.counts[position])
+
+    def pairs(self) -> int:
+        return int(np.count_nonzero(self.counts[:self.size]))
+
+
+def _date_key(value: Optional[str]) -> int:
+    """YYYYMMDD as an int, so dates compare as numbers"""
+    try:
+        day = date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return NO_DATE
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+class Recommender:
+    """Event-to-event similarity from attendance and favorites"""
+
+    def __init__(self, events, favorites, top_k: int = TOP_K, refresh_batch: int = REFRESH_BATCH):
+        self.events = events
+        self.favorites = favorites
+        self.top_k = top_k
+        self.refresh_batch = refresh_batch
+        self._reset()
+
+    def attach(self):
+        """Build from the current contents, then follow every later write"""
+        self.rebuild()
+        self.events.subscribe(self.apply_events)
+        self.favorites.subscribe(self.apply_favorites)
+
+    def _reset(self):
+        self._index: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._capacity = 0
+        self.co: List[_Row] = []
+        self.degree = np.zeros(0, np.int32)
+        self.neighbors = np.zeros((0, self.top_k), np.int32)
+        self.similarity = np.zeros((0, self.top_k), np.float32)
+        self.alive = np.zeros(0, bool)
+        self.dates = np.zeros(0, np.int32)
+        # user id -> {event index: source bits}
+        self._items: Dict[str, Dict[int, int]] = {}
+        self._dirty: Set[int] = set()
+        self._stale = False
+        self.interactions = 0
+
+    def rebuild(self):
+        self._reset()
+        for event_id, event in self.events.items():
+            index = self._item(event_id)
+            self.alive[index] = True
+            self.dates[index] = _date_key(event.get("date"))
+            for user_id in event.get("attendees", ()):
+                self._items.setdefault(user_id, {})[index] = ATTENDED
+        for user_id, event_ids in self.favorites.items():
+            items = self._items.setdefault(user_id, {})
+            for event_id in event_ids:
+                index = self._item(event_id)
+                items[index] = items.get(index, 0) | FAVORITE
+
+        # Every item of a user paired with every item of that user, itself included (the degree)
+        batch: List[Dict[int, int]] = []
+        counted: List[Tuple[np.ndarray, np.ndarray]] = []
+        pairs = 0
+        for items in self._items.values():
+            batch.append(items)
+            pairs += len(items) ** 2
+            if pairs >= PAIR_CHUNK:
+                counted.append(self._count_pairs(batch))
+                batch, pairs = [], 0
+        counted.append(self._count_pairs(batch))
+        self._fill(counted)
+        self.interactions = sum(len(items) for items in self._items.values())
+        self._dirty = set(range(len(self._ids)))
+        self._refresh(None)
+
+    def recommend(self, user_id: str, limit: int, today: Optional[date] = None) -> List[Tuple[str, float]]:
+        """Up to limit (event id, score) pairs, best first; popular events score 0"""
+        if self._stale:
+            self.rebuild()
+        self._refresh(self.refresh_batch)
+        n = len(self._ids)
+        if not n:
+            return []
+
+        eligible = self.alive[:n] & (self.dates[:n] >= _date_key((today or date.today()).isoformat()))
+        scores = np.zeros(n)
+        items = self._items.get(user_id)
+        if items:
+            own = np.fromiter(items, np.intp, len(items))
+            neighbors = self.neighbors[own].ravel()
+            related = neighbors >= 0
+            scores = np.bincount(neighbors[related], weights=self.similarity[own].ravel()[related], minlength=n)
+            eligible[own] = False
+
+        picked = self._best(scores, eligible & (scores > 0), limit)
+        if len(picked) < limit:
+            popularity = self.degree[:n]
+            picked = np.concatenate([picked, self._best(popularity, eligible & (scores <= 0), limit - len(picked))])
+        return [(self._ids[index], float(scores[index])) for index in picked]
+
+    def stats(self):
+        return {"events": len(self._ids), "users": len(self._items), "interactions": self.interactions,
+                "pairs": sum(row.pairs() for row in self.co), "dirty_rows": len(self._dirty)}
+
+    # Store listeners
+    def apply_events(self, changes: List[Change]):
+        for change in changes:
+            if change.op == "insert":
+                index = self._item(change.key)
+                self.alive[index] = True
+                self.dates[index] = _date_key(change.data.get("date"))
+                for user_id in change.data.get("attendees", ()):
+                    self._link(user_id, index, ATTENDED)
+            elif change.op == "update" and change.key in self._index:
+                if "date" in change.data:
+                    self.dates[self._index[change.key]] = _date_key(change.data["date"])
+                if "attendees" in change.data:
+                    self._stale = True  # Replaced wholesale; rare enough to rebuild for
+            elif change.op == "delete" and change.key in self._index:
+                self.alive[self._index[change.key]] = False
+            elif change.op == "attend":
+                self._link(change.data, self._item(change.key), ATTENDED)
+            elif change.op == "unattend" and change.key in self._index:
+                self._unlink(change.data, self._index[change.key], ATTENDED)
+            elif change.op in ("load", "clear"):
+                self._stale = True
+
+    def apply_favorites(self, changes: List[Change]):
+        for change in changes:
+            if change.op == "favorite":
+                self._link(change.key, self._item(change.data), FAVORITE)
+            elif change.op == "unfavorite" and change.data in self._index:
+                self._unlink(change.key, self._index[change.data], FAVORITE)
+            elif change.op in ("load", "clear"):
+                self._stale = True
+
+    # Internals
+    def _item(self, event_id: str) -> int:
+        """The row of an event, added if new"""
+        index = self._index.get(event_id)
+        if index is None:
+            index = len(self._ids)
+            if index == self._capacity:
+                self._grow(max(INITIAL_CAPACITY, self._capacity * 2))
+            self._index[event_id] = index
+            self._ids.append(event_id)
+            self.co.append(_Row())
+        return index
+
+    def _grow(self, capacity: int):
+        n = self._capacity
+        degree = np.zeros(capacity, np.int32)
+        degree[:n] = self.degree
+        neighbors = np.full((capacity, self.top_k), -1, np.int32)
+        neighbors[:n] = self.neighbors
+        similarity = np.zeros((capacity, self.top_k), np.float32)
+        similarity[:n] = self.similarity
+        alive = np.zeros(capacity, bool)
+        alive[:n] = self.alive
+        dates = np.full(capacity, NO_DATE, np.int32)
+        dates[:n] = self.dates
+        self.degree, self.neighbors, self.similarity, self.alive, self.dates = degree, neighbors, similarity, alive, dates
+        self._capacity = capacity
+
+    def _link(self, user_id: str, index: int, source: int):
+        items = self._items.setdefault(user_id, {})
+        bits = items.get(index, 0)
+        items[index] = bits | source
+        if bits:
+            return  # Already an interaction
+        row = self.co[index]
+        for other in items:
+            if other != index:
+                row.add(other, 1)
+                self.co[other].add(index, 1)
+        self.degree[index] += 1
+        self.interactions += 1
+        self._dirty.update(items)
+
+    def _unlink(self, user_id: str, index: int, source: int):
+        items = self._items.get(user_id)
+        bits = items.get(index, 0) if items else 0
+        if not bits & source:
+            return
+        if bits & ~source:
+            items[index] = bits & ~source
+            return  # Still an interaction through the other source
+        del items[index]
+        row = self.co[index]
+        for other in items:
+            row.add(other, -1)
+            self.co[other].add(index, -1)
+        self.degree[index] -= 1
+        self.interactions -= 1
+        self._dirty.add(index)
+        self._dirty.update(items)
+        if not items:
+            del self._items[user_id]
+
+    def _count_pairs(self, batch: List[Dict[int, int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Every (item, item) pair of each user in batch, as distinct row * n + col codes and their counts"""
+        if not batch:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        sizes = np.fromiter((len(items) for items in batch), np.int64, len(batch))
+        flat = np.fromiter((index for items in batch for index in items), np.int64, int(sizes.sum()))
+        # For each interaction: where its user's block starts, and how long it is
+        lengths = np.repeat(sizes, sizes)
+        starts = np.repeat(np.cumsum(sizes) - sizes, sizes)
+        rows = np.repeat(flat, lengths)
+        offsets = np.arange(rows.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        cols = flat[np.repeat(starts, lengths) + offsets]
+        n = len(self._ids)
+        codes = rows * n + cols
+        if n * n <= DENSE_COUNT_LIMIT:
+            counts = np.bincount(codes, minlength=n * n)
+            codes = np.flatnonzero(counts)
+            return codes, counts[codes]
+        return np.unique(codes, return_counts=True)
+
+    def _fill(self, counted: List[Tuple[np.ndarray, np.ndarray]]):
+        """Set degree and co from the pair counts of all batches"""
+        n = len(self._ids)
+        codes = np.concatenate([codes for codes, _ in counted])
+        counts = np.concatenate([counts for _, counts in counted])
+        if len(counted) > 1:
+            codes, inverse = np.unique(codes, return_inverse=True)
+            counts = np.bincount(inverse, weights=counts).astype(np.int64)
+        rows, cols = codes // n, codes % n
+        diagonal = rows == cols
+        self.degree[rows[diagonal]] = counts[diagonal]
+        rows, cols, counts = rows[~diagonal], cols[~diagonal], counts[~diagonal]
+        # codes are sorted, so each row's entries are contiguous
+        bounds = np.searchsorted(rows, np.arange(n + 1))
+        cols, counts = cols.astype(np.int32), counts.astype(np.int32)
+        for index in range(n):
+            start, end = bounds[index], bounds[index + 1]
+            if start < end:
+                self.co[index] = _Row(cols[start:end].copy(), counts[start:end].copy())
+
+    def _refresh(self, limit: Optional[int]):
+        """Recompute the top-k lists of up to limit changed rows (all of them if None)"""
+        if not self._dirty:
+            return
+        rows = np.fromiter(islice(self._dirty, limit), np.intp)
+        self._dirty.difference_update(rows.tolist())
+        n = len(self._ids)
+        k = min(self.top_k, n - 1)
+        if k <= 0:
+            return
+        degree = self.degree.astype(np.float32)
+        self.neighbors[rows] = -1
+        self.similarity[rows] = 0
+        for index in rows.tolist():
+            row = self.co[index]
+            others, counts = row.cols[:row.size], row.counts[:row.size]
+            norm = np.sqrt(degree[index] * degree[others])
+            similarity = np.divide(counts, norm, out=np.zeros(row.size, np.float32), where=norm > 0)
+            if row.size > k:
+                top = np.argpartition(-similarity, k - 1)[:k]
+                others, similarity = others[top], similarity[top]
+            found = similarity > 0  # Counts that dropped to zero
+            others, similarity = others[found], similarity[found]
+            self.neighbors[index, :len(others)] = others
+            self.similarity[index, :len(others)] = similarity
+
+    @staticmethod
+    def _best(values: np.ndarray, mask: np.ndarray, limit: int) -> np.ndarray:
+        """Indices of the limit largest values where mask is set, largest first"""
+        candidates = np.flatnonzero(mask)
+        if limit <= 0:
+            return candidates[:0]
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-values[candidates], limit - 1)[:limit]]
+        return candidates[np.argsort(-values[candidates], kind="stable")]
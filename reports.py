@@ -0,0 +1,307 @@
+"""
+Reports
+=======
+
+Ad-hoc time-range reports (attendance per category per week over two
+years, comments-per-event histograms, ...) answered from a columnar NumPy
+snapshot of the event and comment stores rather than by looping over dicts.
+
+The snapshot is materialized at most every REPORT_REFRESH_SECONDS, and
+only if the stores changed since the last one, in a single pass over the
+events and one over the comments; day, week and month numbers are computed once per row at that
+point. Each report is then a mask, one np.bincount over a combined
+(group, period) key and a reshape.
+
+A refresh reads the stores on the event loop thread, which is the only
+one that writes them, and copies out plain lists; the NumPy work on those
+lists runs on a background thread.
+
+Spans are limited to MAX_REPORT_DAYS, so a time_range cannot ask for
+arbitrarily many periods.
+
+Attendance is attributed to the date of the event attended, like the live
+counters in analytics.py; comments to the day they were posted.
+"""
+
+import os
+import re
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Configuration
+REPORT_REFRESH_SECONDS = float(os.getenv("REPORT_REFRESH_SECONDS", "30"))
+MAX_REPORT_DAYS = int(os.getenv("MAX_REPORT_DAYS", str(100 * 366)))
+
+INTERVALS = ("day", "week", "month")
+GROUPS = (None, "category")
+UNIX_EPOCH = date(1970, 1, 1).toordinal()
+NO_DATE = np.iinfo(np.int32).min
+
+_SPAN = re.compile(r"(\d+)([dwmy])")
+_UNIT_INTERVALS = {"d": "day", "w": "week", "m": "month", "y": "month"}
+_UNIT_DAYS = {"d": 1, "w": 7, "m": 31, "y": 366}  # At most
+
+
+def parse_time_range(time_range: Optional[str], today: Optional[date] = None) -> Tuple[Optional[int], Optional[int], Optional[str]]:
+    """(first day, last day, default interval) for a time_range; days are since 1970-01-01.
+
+    Accepts "all", a span ending today ("30d", "12w", "6m", "2y") or an
+    explicit "YYYY-MM-DD..YYYY-MM-DD", covering at most MAX_REPORT_DAYS.
+    Raises ValueError for anything else.
+    """
+    today = today or date.today()
+    if not time_range or time_range == "all":
+        return None, None, None
+    span = _SPAN.fullmatch(time_range)
+    if span:
+        count, unit = int(span.group(1)), span.group(2)
+        if count < 1:
+            raise ValueError("time_range span must be positive")
+        if count * _UNIT_DAYS[unit] > MAX_REPORT_DAYS:
+            raise ValueError(f"time_range may span at most {MAX_REPORT_DAYS} days")
+        if unit == "d":
+            first = today - timedelta(days=count - 1)
+        elif unit == "w":
+            first = today - timedelta(days=today.weekday(), weeks=count - 1)
+        else:
+            months = today.year * 12 + today.month - 1 - (count * 12 if unit == "y" else count) + 1
+            first = date(months // 12, months % 12 + 1, 1)
+        return _day(first), _day(today), _UNIT_INTERVALS[unit]
+    start, separator, end = time_range.partition("..")
+    if separator:
+        first, last = date.fromisoformat(start), date.fromisoformat(end)
+        if first > last:
+            raise ValueError("time_range starts after it ends")
+        if (last - first).days >= MAX_REPORT_DAYS:
+            raise ValueError(f"time_range may span at most {MAX_REPORT_DAYS} days")
+        return _day(first), _day(last), None
+    raise ValueError(f"Unsupported time_range: {time_range}")
+
+
+def _day(value: date) -> int:
+    return value.toordinal() - UNIX_EPOCH
+
+
+def _days(dates: List[str]) -> np.ndarray:
+    """Vectorized "YYYY-MM-DD..." -> days since epoch; NO_DATE where unparseable"""
+    prefixes = np.array([d[:10] if isinstance(d, str) else "" for d in dates], dtype="U10")
+    result = np.full(len(prefixes), NO_DATE, dtype=np.int32)
+    valid = np.char.str_len(prefixes) == 10
+    if valid.any():
+        try:
+            result[valid] = prefixes[valid].astype("datetime64[D]").astype(np.int64)
+        except ValueError:  # Malformed dates: fall back to parsing one by one
+            for i in np.flatnonzero(valid):
+                try:
+                    result[i] = _day(date.fromisoformat(prefixes[i]))
+                except ValueError:
+                    pass
+    return result
+
+
+def _periods(days: np.ndarray, interval: str) -> np.ndarray:
+    """Period number of each day: days, Monday-based weeks or months since the epoch"""
+    if interval == "day":
+        return days.astype(np.int64)
+    if interval == "week":
+        return (days.astype(np.int64) + 3) // 7  # 1970-01-01 was a Thursday
+    return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def _period_label(period: int, interval: str) -> str:
+    if interval == "day":
+        return date.fromordinal(period + UNIX_EPOCH).isoformat()
+    if interval == "week":
+        year, week, _ = date.fromordinal(period * 7 - 3 + UNIX_EPOCH).isocalendar()
+        return f"{year}-W{week:02d}"
+    return f"{1970 + period // 12:04d}-{period % 12 + 1:02d}"
+
+
+class _Columns:
+    """Day, period and category columns of one table, with optional row weights"""
+
+    def __init__(self, days: np.ndarray, categories: np.ndarray, weights: Optional[np.ndarray] = None):
+        self.days = days
+        self.categories = categories
+        self.weights = weights
+        # Period numbers are computed once here, not per report
+        self.periods = {interval: _periods(days, interval).astype(np.int32) for interval in INTERVALS}
+
+    def mask(self, first: Optional[int], last: Optional[int]) -> np.ndarray:
+        mask = self.days != NO_DATE
+        if first is not None:
+            mask &= self.days >= first
+        if last is not None:
+            mask &= self.days <= last
+        return mask
+
+
+def _version(events, comments) -> int:
+    # Both only ever grow, so their sum changes whenever either store does
+    return events.version + comments.version
+
+
+def capture(events, comments) -> Dict[str, Any]:
+    """What a snapshot needs from the stores, as plain lists.
+
+    Must run on the thread that writes the stores (the event loop); the
+    result can then be turned into a ColumnarSnapshot on any thread.
+    """
+    rows: Dict[str, int] = {}
+    categories, dates, attendees = [], [], []
+    for row, (event_id, event) in enumerate(events.items()):
+        rows[event_id] = row
+        categories.append(str(event.get("category")))
+        dates.append(event.get("date"))
+        attendees.append(len(event["attendees"]))
+    posted = [(rows[c["event_id"]], c.get("timestamp")) for c in comments.values() if c["event_id"] in rows]
+    return {"version": _version(events, comments), "categories": categories, "dates": dates,
+            "attendees": attendees, "posted": posted}
+
+
+class ColumnarSnapshot:
+    """The event and comment stores as NumPy columns, as of one version"""
+
+    def __init__(self, columns: Dict[str, Any]):
+        self.version = columns["version"]
+        self.built_at = time.time()
+
+        categories = sorted(set(columns["categories"]))
+        codes = {category: code for code, category in enumerate(categories)}
+        self.categories = categories
+
+        # One row per event. Every attendance row of an event shares its category
+        # and date, so attendance is kept run-length encoded: a count per event row,
+        # used as bincount weights, which stays fast at tens of millions of rows.
+        count = len(columns["dates"])
+        event_category = np.fromiter((codes[category] for category in columns["categories"]),
+                                     dtype=np.int32, count=count)
+        self.event_attendees = np.array(columns["attendees"], dtype=np.int64)
+        self.events = _Columns(_days(columns["dates"]), event_category)
+        self.attendance = _Columns(self.events.days, event_category, self.event_attendees)
+        self.attendance.periods = self.events.periods
+
+        # One row per comment, dated by when it was posted
+        posted = columns["posted"]
+        comment_event = np.fromiter((row for row, _ in posted), dtype=np.int32, count=len(posted))
+        self.event_comments = np.bincount(comment_event, minlength=count).astype(np.int64)
+        self.comments = _Columns(_days([timestamp for _, timestamp in posted]),
+                                 event_category[comment_event])
+
+    @property
+    def attendance_rows(self) -> int:
+        return int(self.event_attendees.sum())
+
+    def attendance_report(self, first: Optional[int], last: Optional[int], interval: str,
+                          group_by: Optional[str] = None) -> Dict[str, Any]:
+        """Attendance per period (and per category), by event date"""
+        return self._series(self.attendance, first, last, interval, group_by)
+
+    def comments_report(self, first: Optional[int], last: Optional[int], interval: str,
+                        group_by: Optional[str] = None, bins: int = 10) -> Dict[str, Any]:
+        """Comments per period, plus a histogram of comments per event for events in range"""
+        report = self._series(self.comments, first, last, interval, group_by)
+        counts, edges = np.histogram(self.event_comments[self.events.mask(first, last)], bins=bins)
+        report["per_event_histogram"] = {"bin_edges": edges.tolist(), "counts": counts.tolist()}
+        return report
+
+    def _series(self, table: _Columns, first: Optional[int], last: Optional[int],
+                interval: str, group_by: Optional[str]) -> Dict[str, Any]:
+        mask = table.mask(first, last)
+        periods = table.periods[interval][mask]
+        if first is not None:
+            start, end = (int(p) for p in _periods(np.array([first, last]), interval))
+        elif len(periods):
+            start, end = int(periods.min()), int(periods.max())
+        else:
+            return {"interval": interval, "periods": [], "total": [], "groups": {}}
+        width = end - start + 1
+        offsets = periods - np.int32(start)
+        weights = table.weights[mask] if table.weights is not None else None
+
+        report: Dict[str, Any] = {
+            "interval": interval,
+            "periods": [_period_label(p, interval) for p in range(start, end + 1)],
+        }
+        if group_by == "category":
+            groups = len(self.categories)
+            # One bincount over (category, period) pairs, then reshape to a matrix
+            keys = table.categories[mask].astype(np.int64) * width + offsets
+            matrix = np.bincount(keys, weights, minlength=groups * width).astype(np.int64)
+            matrix = matrix.reshape(groups, width)
+            report["total"] = matrix.sum(axis=0).tolist()
+            report["groups"] = {self.categories[g]: matrix[g].tolist()
+                                for g in np.flatnonzero(matrix.any(axis=1))}
+        else:
+            report["total"] = np.bincount(offsets, weights, minlength=width).astype(np.int64).tolist()
+        return report
+
+
+class ReportEngine:
+    """Keeps a reasonably fresh ColumnarSnapshot of the event and comment stores"""
+
+    def __init__(self, events, comments, refresh_seconds: float = REPORT_REFRESH_SECONDS):
+        self.events = events
+        self.comments = comments
+        self.refresh_seconds = refresh_seconds
+        self._snapshot: Optional[ColumnarSnapshot] = None
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> ColumnarSnapshot:
+        """Current snapshot; a stale one is refreshed in the background meanwhile"""
+        current = self._snapshot
+        if current is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = ColumnarSnapshot(capture(self.events, self.comments))
+                return self._snapshot
+        if (current.version != _version(self.events, self.comments)
+                and time.time() - current.built_at >= self.refresh_seconds
+                and self._lock.acquire(blocking=False)):
+            try:
+                columns = capture(self.events, self.comments)
+            except BaseException:
+                self._lock.release()
+                raise
+            threading.Thread(target=self._refresh, args=(columns,), name="report-snapshot", daemon=True).start()
+        return current
+
+    def _refresh(self, columns: Dict[str, Any]):
+        try:
+            self._snapshot = ColumnarSnapshot(columns)
+        finally:
+            self._lock.release()
+
+    def report(self, name: str, time_range: Optional[str], interval: Optional[str] = None,
+               group_by: Optional[str] = None, **options) -> Dict[str, Any]:
+        """Run the attendance or comments report; ValueError on bad parameters"""
+        if interval is not None and interval not in INTERVALS:
+            raise ValueError(f"interval must be one of: {', '.join(INTERVALS)}")
+        if group_by not in GROUPS:
+            raise ValueError("group_by must be category or omitted")
+        first, last, default_interval = parse_time_range(time_range)
+        if interval is None:
+            interval = default_interval or _interval_for(first, last)
+
+        snapshot = self.snapshot()
+        started = time.perf_counter()
+        if name == "attendance":
+            result = snapshot.attendance_report(first, last, interval, group_by)
+        elif name == "comments":
+            result = snapshot.comments_report(first, last, interval, group_by, **options)
+        else:
+            raise ValueError(f"Unknown report: {name}")
+        result["time_range"] = time_range or "all"
+        result["as_of_version"] = snapshot.version
+        result["computed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+
+def _interval_for(first: Optional[int], last: Optional[int]) -> str:
+    if first is None or last - first > 180:
+        return "month"
+    return "week" if last - first > 31 else "day"
@@ -0,0 +1,68 @@
+"""
+Response Cache
+==============
+
+Keeps the serialized JSON body of hot read endpoints so they are encoded
+once per change instead of once per request. Each entry remembers the
+store version it was built from; any write to the store bumps the version
+and the next read rebuilds the body.
+"""
+
+import hashlib
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+from serialization import dumps
+
+
+class ResponseCache:
+    """Serialized response bodies keyed by name and source version"""
+
+    def __init__(self, observe: Optional[Callable[[float], None]] = None):
+        # key -> (version, body, etag)
+        self._entries: Dict[str, Tuple[Any, bytes, str]] = {}
+        # Called with the seconds spent encoding each rebuilt body
+        self._observe = observe
+
+    def get(self, key: str, version: Any, build: Callable[[], Any]) -> Tuple[bytes, str]:
+        """Return (body, etag) for key, rebuilding it if version moved on"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            content = build()
+            started = time.perf_counter()
+            body = dumps(content)
+            if self._observe is not None:
+                self._observe(time.perf_counter() - started)
+            # Content hash rather than the version number, so ETags stay valid across restarts
+            etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+            entry = (version, body, etag)
+            self._entries[key] = entry
+        return entry[1], entry[2]
+
+    def respond(self, request: Request, key: str, version: Any,
+                build: Callable[[], Any]) -> Response:
+        """Serve the cached body, or 304 if the client already has it"""
+        body, etag = self.get(key, version, build)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def invalidate(self, key: Optional[str] = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
@@ -148,6 +148,7 @@ async function handleLogin(event) {
 
         // Save to localStorage
         localStorage.setItem('accessToken', accessToken);
+        shareSessionWithServiceWorker(accessToken);
         localStorage.setItem('currentUserInfo', JSON.stringify(currentUser));
 
         showMainApp();
@@ -187,6 +188,7 @@ async function handleRegistration(event) {
 
         // Save to localStorage
         localStorage.setItem('accessToken', accessToken);
+        shareSessionWithServiceWorker(accessToken);
         localStorage.setItem('currentUserInfo', JSON.stringify(currentUser));
 
         showNotification('Registration successful! Welcome!', 'success');
@@ -339,7 +341,7 @@ function displayEvents(searchTerm = '') {
             <button class="comment-btn" onclick="showCommentForm('${event.id}')">💬 Comment</button>
 
             <div id="comments-${event.id}" class="comments-section" style="margin-top: 15px; border-top: 1px solid #eee; padding-top: 15px;">
-                <h4 style="font-size: 14px; margin-bottom: 8px; color: #666;">💬 Comments (${event.comments ? event.comments.length : 0})</h4>
+                <h4 style="font-size: 14px; margin-bottom: 8px; color: #666;">💬 Comments (${event.comments_count || (event.comments ? event.comments.length : 0)})</h4>
                 <div class="comments-display" style="margin-bottom: 10px;">
                     ${event.comments && event.comments.length > 0 ?
                         event.comments.slice(-3).map(comment => `
@@ -509,6 +511,7 @@ function showCommentFeedback(eventId, message, type) {
 function checkLogin() {
     if (accessToken && currentUserInfo) {
         currentUser = currentUserInfo;
+        shareSessionWithServiceWorker(accessToken);
         showMainApp();
         updateDashboard();
     } else {
@@ -521,6 +524,7 @@ function checkLogin() {
 }
 
 function logout() {
+    endSession(API_BASE_URL, accessToken);
     currentUser = null;
     accessToken = null;
     localStorage.removeItem('accessToken');
@@ -0,0 +1,178 @@
+"""
+Event Search
+============
+
+In-process inverted index over event title, description, location and
+category with BM25 ranking and prefix matching on the last query term
+for type-ahead. The index subscribes to the event store and is updated
+incrementally on every create, update and delete.
+"""
+
+import heapq
+import math
+import re
+from bisect import bisect_left, insort
+from typing import Any, Dict, List, Optional, Tuple
+
+from store import Change
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Field weights: a hit in the title counts for more than one in the description
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "category": 2.0,
+    "location": 1.5,
+    "description": 1.0,
+}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Prefix expansion: shorter prefixes only match whole words, and a prefix
+# expands to at most this many vocabulary terms
+MIN_PREFIX_LENGTH = 3
+MAX_PREFIX_EXPANSIONS = 32
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+class SearchIndex:
+    """Inverted index with BM25 scoring over the records of a store"""
+
+    def __init__(self, source):
+        # Update changes only carry the changed fields, so re-read the full record
+        self._source = source
+        self._postings: Dict[str, Dict[str, float]] = {}  # term -> {doc_id: weighted tf}
+        self._doc_terms: Dict[str, Dict[str, float]] = {}  # doc_id -> {term: weighted tf}
+        self._doc_length: Dict[str, float] = {}
+        self._total_length = 0.0
+        self._vocabulary: List[str] = []  # sorted, for prefix lookups
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def add(self, doc_id: str, record: Dict[str, Any]):
+        """Index (or re-index) a record"""
+        if doc_id in self._doc_terms:
+            self.remove(doc_id)
+
+        terms: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(record.get(field)):
+                terms[term] = terms.get(term, 0.0) + weight
+
+        for term, frequency in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                insort(self._vocabulary, term)
+            postings[doc_id] = frequency
+
+        length = sum(terms.values())
+        self._doc_terms[doc_id] = terms
+        self._doc_length[doc_id] = length
+        self._total_length += length
+
+    def remove(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+                del self._vocabulary[bisect_left(self._vocabulary, term)]
+        self._total_length -= self._doc_length.pop(doc_id)
+
+    def clear(self):
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_length.clear()
+        self._total_length = 0.0
+        self._vocabulary.clear()
+
+    def search(self, query: str, limit: int = 20, prefix: bool = True) -> List[Tuple[str, float]]:
+        """Best matching (doc_id, score) pairs; every query term must match.
+
+        With prefix=True the last term also matches longer words starting
+        with it, so "mus" finds "music" while the user is still typing.
+        """
+        terms = tokenize(query)
+        if not terms or not self._doc_terms:
+            return []
+
+        groups = [[term] for term in dict.fromkeys(terms[:-1])]
+        groups.append(self._expand(terms[-1]) if prefix else [terms[-1]])
+
+        # Score the rarest group first so the candidate set shrinks quickly
+        groups.sort(key=lambda group: sum(len(self._postings.get(t, ())) for t in group))
+        scores: Optional[Dict[str, float]] = None
+        for group in groups:
+            group_scores = self._score_group(group, scores)
+            if not group_scores:
+                return []
+            if scores is None:
+                scores = group_scores
+            else:
+                scores = {doc_id: scores[doc_id] + score for doc_id, score in group_scores.items()}
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def apply(self, changes: List[Change]):
+        """Store listener: keep the index in step with event writes"""
+        for change in changes:
+            if change.op == "insert":
+                self.add(change.key, change.data)
+            elif change.op == "update":
+                if any(field in FIELD_WEIGHTS for field in change.data):
+                    self.add(change.key, self._source[change.key])
+            elif change.op == "delete":
+                self.remove(change.key)
+            elif change.op == "clear":
+                self.clear()
+            elif change.op == "load":
+                self.clear()
+                for doc_id, record in self._source.items():
+                    self.add(doc_id, record)
+
+    def _expand(self, prefix: str) -> List[str]:
+        if len(prefix) < MIN_PREFIX_LENGTH:
+            return [prefix]
+        start = bisect_left(self._vocabulary, prefix)
+        end = bisect_left(self._vocabulary, prefix + "\uffff", start)
+        return self._vocabulary[start:min(end, start + MAX_PREFIX_EXPANSIONS)]
+
+    def _score_group(self, group: List[str],
+                     candidates: Optional[Dict[str, float]]) -> Dict[str, float]:
+        """BM25 score per doc for a set of alternative terms (best alternative wins)"""
+        doc_count = len(self._doc_terms)
+        average_length = self._total_length / doc_count or 1.0
+        # tf / (tf + K1 * (1 - B + B * length / average)), with the constants hoisted
+        base = K1 * (1.0 - B)
+        per_length = K1 * B / average_length
+        doc_length = self._doc_length
+        scores: Dict[str, float] = {}
+        best = scores.get
+        for term in group:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            weight = math.log(1.0 + (doc_count - df + 0.5) / (df + 0.5)) * (K1 + 1.0)
+            if candidates is None:
+                hits = postings.items()
+            elif len(candidates) < df:
+                hits = [(doc_id, postings[doc_id]) for doc_id in candidates if doc_id in postings]
+            else:
+                hits = [(doc_id, tf) for doc_id, tf in postings.items() if doc_id in candidates]
+            for doc_id, tf in hits:
+                score = weight * tf / (tf + base + per_length * doc_length[doc_id])
+                if score > best(doc_id, 0.0):
+                    scores[doc_id] = score
+        return scores
+
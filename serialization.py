@@ -0,0 +1,90 @@
+"""
+JSON Serialization
+==================
+
+The response encoding path of the backends:
+
+- dumps() encodes straight to bytes with orjson when it is installed
+  (the standard library json module otherwise); loads() decodes the same
+  way. datetime, date and time values, pydantic models, sets and numpy
+  values are handled by the encoder itself, so responses no longer need
+  a jsonable_encoder pass first;
+- FastJSONResponse is a JSONResponse using dumps(). Returning one from an
+  endpoint also skips FastAPI's response_model validation;
+- record_encoder(Model) turns a store record into the dict of Model's
+  fields (defaults filled in, everything else -- password hashes,
+  internal bookkeeping -- left out) without validating it. Records the
+  stores hold were validated when they were written, so checking them
+  again on every read only costs time.
+"""
+
+import json
+from copy import copy
+from datetime import date, datetime, time
+from enum import Enum
+from typing import Any, Callable, Dict, Mapping, Type
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the json module produces the same output, slower
+    orjson = None
+
+_MISSING = object()
+
+
+def _default(value: Any) -> Any:
+    """Values the encoder does not handle by itself"""
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if hasattr(value, "tolist"):  # numpy arrays and scalars
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(content: Any) -> bytes:
+        return orjson.dumps(content, default=_default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+    loads = orjson.loads
+else:
+    def dumps(content: Any) -> bytes:
+        return json.dumps(content, default=_default, ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":")).encode("utf-8")
+
+    loads = json.loads
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with dumps()"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def record_encoder(model: Type[BaseModel]) -> Callable[[Mapping[str, Any]], Dict[str, Any]]:
+    """A function returning the fields of model found in a trusted record, without validation"""
+    fields = [(name, _MISSING if field.is_required() else field.get_default(call_default_factory=True))
+              for name, field in model.model_fields.items()]
+
+    def encode(record: Mapping[str, Any]) -> Dict[str, Any]:
+        payload = {}
+        for name, default in fields:
+            value = record.get(name, default)
+            if value is default:
+                if default is _MISSING:
+                    value = None
+                elif isinstance(default, (list, dict)):
+                    value = copy(default)  # Never hand out the model's own default
+            payload[name] = value
+        return payload
+    return encode
@@ -0,0 +1,30 @@
+// Session Helpers
+// Shared by auth-utils.js, integrated-script.js and script.js; load this file before them
+
+/**
+ * Hand the access token to the service worker, which needs it for background sync
+ */
+function shareSessionWithServiceWorker(token) {
+    if (!token || !('serviceWorker' in navigator)) return;
+    navigator.serviceWorker.ready
+        .then(registration => registration.active.postMessage({ type: 'AUTH_TOKEN', data: { token } }))
+        .catch(() => {});
+}
+
+/**
+ * End the session: revoke the token server-side and make the service worker forget it.
+ * The local session ends either way, so callers clear their own state without waiting.
+ */
+function endSession(apiBase, token) {
+    if (token) {
+        fetch(`${apiBase}/auth/logout`, {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${token}` }
+        }).catch(() => {});
+    }
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.ready
+            .then(registration => registration.active.postMessage({ type: 'LOGOUT' }))
+            .catch(() => {});
+    }
+}
@@ -6,30 +6,107 @@ Works with in-memory storage (no MongoDB required)
 Complete API for full-stack event management
 """
 
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Request, Query
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Any, Union
+from datetime import datetime
 
-import jwt
 import os
+
+from achievements import AchievementEngine
+from analytics import GRANULARITIES, Analytics
+from auth import RESET_LINK_TTL, VERIFY_LINK_TTL, AuthUser, TokenAuthenticator
+from bulk import FORMATS as BULK_FORMATS, KINDS as BULK_KINDS, BulkIO
+from change_feed import ChangeFeed
+from image_pipeline import ImagePipeline
+from jobs import JobQueue
+from leaderboard import SCOPES as LEADERBOARD_SCOPES, Leaderboard, level_progress
+from mailer import Mailer, create_transport, password_reset_email, verification_email
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, TimedJSONResponse, metrics, profiler
+from notifications import NotificationHub, notify_event_change
+from reports import ReportEngine
+from pagination import decode_cursor, encode_cursor, parse_fields, project
+from recommendations import Recommender
+from password_hashing import password_hasher
+from response_cache import ResponseCache
+from search import SearchIndex
+from serialization import record_encoder
+from static_assets import StaticAssets, file_response
+from storage import create_backend
+from store import UserStore, EventStore, CommentStore, FavoriteStore, NotificationStore, RevocationStore
+from uploads import BlobStore, FormSizeLimit, iter_upload
 # import motor.motor_asyncio  # Optional - uncomment for MongoDB
 # Configuration
-SECRET_KEY = "test-secret-key"
+SECRET_KEY = os.getenv("SECRET_KEY", "test-secret-key")
+# Requests without a token act as this user when set (development only)
+AUTH_DEMO_USER = os.getenv("AUTH_DEMO_USER", "")
+# Roles that can't be picked at registration; they gate the /admin bulk routes
+PRIVILEGED_ROLES = ("admin", "organizer")
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+blob_store = BlobStore(UPLOAD_DIR)
+image_pipeline = ImagePipeline(UPLOAD_DIR)
+
+# Frontend files, served from memory by the catch-all route
+static_assets = StaticAssets()
+
+ANALYTICS_TREND_PERIODS = 7
+# Newest comments embedded in each event payload; the rest via /events/{id}/comments
+COMMENT_PREVIEW = 3
 
 # In-memory storage
-users_db = {}
-events_db = {}
-next_user_id = 1
-next_event_id = 1
+users_db = UserStore()
+events_db = EventStore()
+comments_db = CommentStore()
+favorites_db = FavoriteStore()
+notifications_db = NotificationStore()
+revocations_db = RevocationStore()
+
+# Durability / sharing between workers, chosen with STORAGE_BACKEND (see storage.py)
+storage = create_backend([users_db, events_db, comments_db, favorites_db, notifications_db,
+                          revocations_db])
+
+# Verifies access tokens, caching the result per token; see current_user
+authenticator = TokenAuthenticator(SECRET_KEY, users_db, revocations_db)
+
+# Durable background jobs with retries; outbound email is sent from here, never from a request
+job_queue = JobQueue()
+mailer = Mailer(job_queue, create_transport())
+
+# Serialized bodies of hot read endpoints, rebuilt when the store changes
+response_cache = ResponseCache(observe=lambda seconds: metrics.observe("serialization", seconds))
+
+# Full-text index over events, kept up to date by the store
+search_index = SearchIndex(events_db)
+events_db.subscribe(search_index.apply)
+
+# Dashboard counters; attached once storage has been recovered (see the bottom of the file)
+analytics = Analytics(users_db, events_db, comments_db)
+
+# Pushes notifications and live event changes to open SSE streams
+notification_hub = NotificationHub(notifications_db, events_db, comments_db,
+                                   sync=storage.sync if storage.shared else None)
+
+# Revisions of event and favorite writes, for delta sync (/sync)
+change_feed = ChangeFeed(events_db, comments_db, favorites_db)
+
+# Columnar snapshots for ad-hoc time-range reports
+report_engine = ReportEngine(events_db, comments_db)
+
+# "Events you might like" from attendance and favorites; attached with analytics
+recommender = Recommender(events_db, favorites_db)
+
+# Users ranked by points, overall and per college and role; attached with analytics
+leaderboard = Leaderboard(users_db)
+
+# Awards achievements and their points in the background after the writes that earn them
+achievement_engine = AchievementEngine(users_db, events_db)
 
 # FastAPI app
-app = FastAPI(title="Event Manager API")
+app = FastAPI(title="Event Manager API", default_response_class=TimedJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -38,31 +115,127 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Refuses oversized multipart uploads before they are spooled to disk
+app.add_middleware(FormSizeLimit, path="/upload/file")
+
+if storage.shared:
+    @app.middleware("http")
+    async def sync_storage(request: Request, call_next):
+        # Pick up writes made by other worker processes before handling the request
+        storage.sync()
+        return await call_next(request)
+
+# Outermost, so it sees every request end to end (see metrics.py)
+app.add_middleware(MetricsMiddleware, metrics=metrics, profiler=profiler)
+for metric_name, kind, stat, description in (
+    ("password_hash_operations_total", "counter", "completed", "Password hashes and checks completed"),
+    ("password_hash_rejected_total", "counter", "rejected", "Password hashes and checks refused (pool full)"),
+    ("password_hash_work_seconds_total", "counter", "work_seconds", "Time spent hashing and checking passwords"),
+    ("password_hash_wait_seconds_total", "counter", "wait_seconds", "Time password operations waited for a worker"),
+    ("password_hash_busy_workers", "gauge", "busy_workers", "Password hash workers in use"),
+    ("password_hash_queued", "gauge", "queued", "Password operations waiting for a worker"),
+):
+    metrics.register(metric_name, kind, description, lambda stat=stat: password_hasher.stats()[stat])
+for metric_name, stat, description in (
+    ("jobs_queued", "queued", "Background jobs waiting or running"),
+    ("jobs_dead", "dead", "Background jobs that failed every attempt"),
+):
+    metrics.register(metric_name, "gauge", description, lambda stat=stat: job_queue.counts[stat])
+
 # Security
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
-import hashlib
 
 # Helper functions
-def get_password_hash(password: str) -> str:
-    # Simple SHA256 hashing for demo purposes
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    # Simple verification for demo purposes
-    return hashlib.sha256(plain_password.encode()).hexdigest() == hashed_password
+async def get_password_hash(password: str) -> str:
+    # bcrypt on the password hashing pool, off the event loop
+    return await password_hasher.hash(password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    # Also accepts legacy SHA256 hashes; see login() for the upgrade
+    return await password_hasher.verify(plain_password, hashed_password)
+
+def create_access_token(user: Dict[str, Any]) -> str:
+    # Expires after ACCESS_TOKEN_TTL; carries a jti so /auth/logout can revoke it
+    return authenticator.issue(user)
+
+async def current_user(request: Request) -> AuthUser:
+    """The authenticated user, from the bearer token.
+
+    Async so it runs on the event loop rather than the threadpool, and reads
+    the header itself rather than through oauth2_scheme, a sub-dependency
+    that would cost more than the (cached) verification. A token seen before
+    is answered from the authenticator's cache.
+    """
+    authorization = request.headers.get("authorization", "")
+    return authenticate_request(authorization[7:] if authorization[:7].lower() == "bearer " else None)
+
+async def stream_user(request: Request) -> AuthUser:
+    """current_user(), also accepting ?token=, which EventSource needs (it can't send headers).
+
+    Only for /notifications/stream: a token in the URL ends up in access
+    logs and Referer headers.
+    """
+    authorization = request.headers.get("authorization", "")
+    return authenticate_request(authorization[7:] if authorization[:7].lower() == "bearer "
+                                else request.query_params.get("token"))
+
+def authenticate_request(token: Optional[str]) -> AuthUser:
+    if token:
+        user = authenticator.authenticate(token)
+    elif AUTH_DEMO_USER and AUTH_DEMO_USER in users_db:
+        demo = users_db[AUTH_DEMO_USER]
+        user = AuthUser(demo["id"], demo["email"], demo["name"], demo["role"], None, float("inf"))
+    else:
+        user = None
+    if user is None:
+        raise HTTPException(status_code=401, detail="Not authenticated" if not token else "Invalid or expired token",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return user
+
+def privileged_user(user: AuthUser = Depends(current_user)) -> AuthUser:
+    """current_user(), if they are an admin or organizer; the /admin routes need one"""
+    if user.role not in PRIVILEGED_ROLES:
+        raise HTTPException(status_code=403, detail="Admin or organizer role required")
+    return user
+
+def insert_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Insert an event, moving the comments embedded in it (if any) to comments_db"""
+    comments = event.pop("comments", None)
+    events_db.insert(event)
+    if comments is not None:
+        comments_db.purge(event["id"])
+        for comment in comments:
+            comments_db.insert({**comment, "event_id": event["id"]})
+    return event
+
+def migrate_embedded_comments():
+    """Move comments recovered inside events (data from before comments_db) to comments_db"""
+    for event_id, event in list(events_db.items()):
+        if event.get("comments"):
+            for comment in event["comments"]:
+                comments_db.insert({**comment, "event_id": event_id})
+            events_db.update(event_id, {"comments": []})
+
+def event_response(event: Dict[str, Any]) -> Dict[str, Any]:
+    """API shape of an event: its comment count and newest comments instead of all of them"""
+    return event_payload({
+        **event,
+        "comments": comments_db.latest(event["id"], COMMENT_PREVIEW),
+        "comments_count": comments_db.count(event["id"]),
+    })
 
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
-    return encoded_jwt
+def json_response(content: Any, status_code: int = 200) -> Response:
+    """Content built from store records, encoded as is: no response_model validation or jsonable_encoder"""
+    return TimedJSONResponse(content, status_code=status_code)
 
 def initialize_sample_data():
     """Initialize sample data on startup if not already done"""
-    global users_db, events_db, next_user_id, next_event_id
-
     if users_db:
         return  # Already initialized
 
+    # All sample users share a password, so hash it once
+    sample_password_hash = password_hasher.hash_sync("password123")
+
     # Create sample users
     sample_users = [
         {
@@ -70,7 +243,7 @@ def initialize_sample_data():
             "email": "john@university.edu",
             "name": "John Smith",
             "role": "organizer",
-            "password_hash": get_password_hash("password123"),
+            "password_hash": sample_password_hash,
             "joined_date": datetime.now().isoformat(),
             "points": 150,
             "verified": True
@@ -80,7 +253,7 @@ def initialize_sample_data():
             "email": "sarah@university.edu",
             "name": "Sarah Johnson",
             "role": "student",
-            "password_hash": get_password_hash("password123"),
+            "password_hash": sample_password_hash,
             "joined_date": datetime.now().isoformat(),
             "points": 200,
             "verified": True
@@ -90,7 +263,7 @@ def initialize_sample_data():
             "email": "mike@university.edu",
             "name": "Mike Chen",
             "role": "student",
-            "password_hash": get_password_hash("password123"),
+            "password_hash": sample_password_hash,
             "joined_date": datetime.now().isoformat(),
             "points": 180,
             "verified": True
@@ -100,7 +273,7 @@ def initialize_sample_data():
             "email": "emma@university.edu",
             "name": "Emma Davis",
             "role": "faculty",
-            "password_hash": get_password_hash("password123"),
+            "password_hash": sample_password_hash,
             "joined_date": datetime.now().isoformat(),
             "points": 220,
             "verified": True
@@ -109,7 +282,7 @@ def initialize_sample_data():
 
     # Add users to database
     for user in sample_users:
-        users_db[user["id"]] = user
+        users_db.insert(user)
 
     # Create sample events
     now = datetime.now()
@@ -174,11 +347,7 @@ def initialize_sample_data():
 
     # Add events to database
     for event in sample_events:
-        events_db[event["id"]] = event
-
-    # Set next IDs
-    next_user_id = len(sample_users) + 1
-    next_event_id = len(sample_events) + 1
+        insert_event(event)
 
 # Models
 class UserBase(BaseModel):
@@ -193,6 +362,7 @@ class UserResponse(UserBase):
     id: str
     joined_date: str
     points: int = 0
+    college: Optional[str] = None
 
 class EventBase(BaseModel):
     title: str
@@ -201,6 +371,7 @@ class EventBase(BaseModel):
     location: str
     category: str
     description: Optional[str] = ""
+    capacity: Optional[int] = Field(None, ge=1)  # None: unlimited
 
 class EventCreate(EventBase):
     pass
@@ -210,7 +381,17 @@ class EventResponse(EventBase):
     created_by: str
     created_at: str
     attendees: List[str] = []
-    comments: List[Dict[str, Any]] = []
+    waitlist: List[str] = []
+    comments: List[Dict[str, Any]] = []  # the newest COMMENT_PREVIEW, oldest first
+    comments_count: int = 0
+
+class EventPage(BaseModel):
+    events: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+
+# Response shapes of stored records, built without re-validating them (see serialization.py)
+user_response = record_encoder(UserResponse)
+event_payload = record_encoder(EventResponse)
 
 class Token(BaseModel):
     access_token: str
@@ -227,10 +408,15 @@ class RegisterRequest(BaseModel):
     email: str
     password: str
     role: str = "student"
+    college: Optional[str] = None
 
 class ForgotPasswordRequest(BaseModel):
     email: str
 
+class ResetPasswordRequest(BaseModel):
+    token: str
+    new_password: str
+
 class EventUpdate(BaseModel):
     title: Optional[str] = None
     date: Optional[str] = None
@@ -238,6 +424,7 @@ class EventUpdate(BaseModel):
     location: Optional[str] = None
     category: Optional[str] = None
     description: Optional[str] = None
+    capacity: Optional[int] = Field(None, ge=1)
 
 class ProfileUpdateRequest(BaseModel):
     name: Optional[str] = None
@@ -247,6 +434,11 @@ class ChangePasswordRequest(BaseModel):
     current_password: str
     new_password: str
 
+class UploadSessionRequest(BaseModel):
+    filename: str
+    content_type: Optional[str] = None
+    size: Optional[int] = None
+
 
 
 # Authentication Routes
@@ -257,87 +449,85 @@ async def login(request: LoginRequest):
     password = request.password
 
     # Find user by email
-    user = None
-    user_id = None
-    for uid, user_data in users_db.items():
-        if user_data["email"] == email:
-            user = user_data
-            user_id = uid
-            break
-
-    if not user or not verify_password(password, user["password_hash"]):
+    user = users_db.get_by_email(email)
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
+    verified, upgraded_hash = await password_hasher.verify_and_upgrade(password, user["password_hash"])
+    if not verified:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    user_id = user["id"]
+    if upgraded_hash:
+        # Legacy SHA256 (or weaker bcrypt) hash: replace it now we know the password
+        users_db.update(user_id, {"password_hash": upgraded_hash})
+
+    analytics.record_activity(user_id)
+
     # Create access token
-    access_token = create_access_token(data={"sub": email, "user_id": user_id})
-
-    user_response = UserResponse(
-        id=user_id,
-        email=user["email"],
-        name=user["name"],
-        role=user["role"],
-        joined_date=user["joined_date"],
-        points=user["points"]
-    )
+    access_token = create_access_token(user)
 
-    return {
+    return json_response({
         "access_token": access_token,
         "token_type": "bearer",
-        "user": user_response.dict()
-    }
+        "user": user_response(user)
+    })
 
 @app.post("/auth/register")
 async def register(request: RegisterRequest):
     """Register new user"""
-    # Check if email already exists
-    for user_data in users_db.values():
-        if user_data["email"] == request.email:
-            raise HTTPException(status_code=400, detail="Email already registered")
+    if request.role in PRIVILEGED_ROLES:
+        raise HTTPException(status_code=403, detail=f"Can't register as {request.role}")
+    # Hash first: nothing may be awaited between the email check and the insert
+    password_hash = await get_password_hash(request.password)
 
-    global next_user_id
-    user_id = str(next_user_id)
-    next_user_id += 1
+    # Check if email already exists
+    if users_db.get_by_email(request.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
 
     # Create user
-    users_db[user_id] = {
-        "id": user_id,
-        "email": request.email,
-        "name": f"{request.first_name} {request.last_name}",
-        "role": request.role,
-        "password_hash": get_password_hash(request.password),
-        "joined_date": datetime.now().isoformat(),
-        "points": 100,
-        "verified": False
-    }
-
+    try:
+        user = users_db.insert({
+            "email": request.email,
+            "name": f"{request.first_name} {request.last_name}",
+            "role": request.role,
+            "college": request.college,
+            "password_hash": password_hash,
+            "joined_date": datetime.now().isoformat(),
+            "points": 100,
+            "verified": False
+        })
+    except ValueError:  # Registered meanwhile, by another worker process
+        raise HTTPException(status_code=400, detail="Email already registered")
+    await mailer.enqueue(verification_email(user, authenticator.issue_link(user, "verify", VERIFY_LINK_TTL)))
     # Create access token
-    access_token = create_access_token(data={"sub": request.email, "user_id": user_id})
-
-    user_response = UserResponse(
-        id=user_id,
-        email=request.email,
-        name=f"{request.first_name} {request.last_name}",
-        role=request.role,
-        joined_date=users_db[user_id]["joined_date"],
-        points=users_db[user_id]["points"]
-    )
+    access_token = create_access_token(user)
 
-    return {
+    return json_response({
         "access_token": access_token,
         "token_type": "bearer",
-        "user": user_response.dict(),
+        "user": user_response(user),
         "message": "Account created successfully! Please verify your email."
-    }
+    })
+
+@app.post("/auth/logout")
+async def logout(user: AuthUser = Depends(current_user)):
+    """Revoke the token used for this request"""
+    authenticator.revoke(user)
+    return {"message": "Logged out successfully"}
+
+@app.get("/auth/me")
+async def get_me(user: AuthUser = Depends(current_user)):
+    """The user the token belongs to"""
+    return json_response({"user": user_response(users_db[user.id])})
 
 @app.post("/auth/forgot-password")
 async def forgot_password(request: ForgotPasswordRequest):
     """Forgot password - send reset link"""
     # Find user by email
-    user_found = False
-    for user_data in users_db.values():
-        if user_data["email"] == request.email:
-            user_found = True
-            break
+    user = users_db.get_by_email(request.email)
+    if user is not None:
+        await mailer.enqueue(password_reset_email(user, authenticator.issue_link(user, "reset", RESET_LINK_TTL)))
 
     # Always return success for security (don't reveal if email exists)
     return {
@@ -345,6 +535,29 @@ async def forgot_password(request: ForgotPasswordRequest):
         "success":True
     }
 
+@app.post("/auth/reset-password")
+async def reset_password(request: ResetPasswordRequest):
+    """Set a new password with the token from a reset email"""
+    user = authenticator.verify_link(request.token, "reset")
+    if user is None:
+        raise HTTPException(status_code=400, detail="Invalid or expired reset link")
+    # Also signs out every session: access tokens are tied to the old password
+    users_db.update(user["id"], {
+        "password_hash": await get_password_hash(request.new_password),
+        "updated_at": datetime.now().isoformat()
+    })
+    return {"message": "Password reset successfully"}
+
+@app.get("/auth/verify-email")
+async def verify_email(token: str):
+    """Confirm an email address with the token from a verification email"""
+    user = authenticator.verify_link(token, "verify")
+    if user is None:
+        raise HTTPException(status_code=400, detail="Invalid or expired verification link")
+    if not user.get("verified"):
+        users_db.update(user["id"], {"verified": True})
+    return {"message": "Email verified", "verified": True}
+
 @app.post("/auth/social/google")
 async def login_with_google(credentials: dict):
     """Google OAuth login (mock implementation)"""
@@ -352,18 +565,10 @@ async def login_with_google(credentials: dict):
     email = credentials.get("email", "google_user@example.com")
 
     # Find or create user
-    user_id = None
-    for uid, user_data in users_db.items():
-        if user_data["email"] == email:
-            user_id = uid
-            break
-
-    if not user_id:
-        global next_user_id
-        user_id = str(next_user_id)
-        next_user_id += 1
-        users_db[user_id] = {
-            "id": user_id,
+    user = users_db.get_by_email(email)
+
+    if not user:
+        user = users_db.insert({
             "email": email,
             "name": credentials.get("name", "Google User"),
             "role": "student",
@@ -371,43 +576,25 @@ async def login_with_google(credentials: dict):
             "joined_date": datetime.now().isoformat(),
             "points": 100,
             "verified": True
-        }
+        })
 
-    access_token = create_access_token(data={"sub": email, "user_id": user_id})
-    user = users_db[user_id]
-    user_response = UserResponse(
-        id=user_id,
-        email=user["email"],
-        name=user["name"],
-        role=user["role"],
-        joined_date=user["joined_date"],
-        points=user["points"]
-    )
-
-    return {
+    access_token = create_access_token(user)
+    return json_response({
         "access_token": access_token,
         "token_type": "bearer",
-        "user": user_response.dict(),
+        "user": user_response(user),
         "message": "Logged in with Google successfully!"
-    }
+    })
 
 @app.post("/auth/social/facebook")
 async def login_with_facebook(credentials: dict):
     """Facebook OAuth login (mock implementation)"""
     email = credentials.get("email", "facebook_user@example.com")
 
-    user_id = None
-    for uid, user_data in users_db.items():
-        if user_data["email"] == email:
-            user_id = uid
-            break
-
-    if not user_id:
-        global next_user_id
-        user_id = str(next_user_id)
-        next_user_id += 1
-        users_db[user_id] = {
-            "id": user_id,
+    user = users_db.get_by_email(email)
+
+    if not user:
+        user = users_db.insert({
             "email": email,
             "name": credentials.get("name", "Facebook User"),
             "role": "student",
@@ -415,60 +602,85 @@ async def login_with_facebook(credentials: dict):
             "joined_date": datetime.now().isoformat(),
             "points": 100,
             "verified": True
-        }
+        })
 
-    access_token = create_access_token(data={"sub": email, "user_id": user_id})
-    user = users_db[user_id]
-    user_response = UserResponse(
-        id=user_id,
-        email=user["email"],
-        name=user["name"],
-        role=user["role"],
-        joined_date=user["joined_date"],
-        points=user["points"]
-    )
-
-    return {
+    access_token = create_access_token(user)
+    return json_response({
         "access_token": access_token,
         "token_type": "bearer",
-        "user": user_response.dict(),
+        "user": user_response(user),
         "message": "Logged in with Facebook successfully!"
-    }
+    })
 
-@app.get("/events/", response_model=List[EventResponse])
-async def get_events():
-    """Get all events"""
-    return list(events_db.values())
+@app.get("/events/", response_model=Union[List[EventResponse], EventPage])
+async def get_events(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=100),
+    cursor: Optional[str] = None,
+    category: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    created_by: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """Get all events, or one page of them when any paging/filter parameter is given"""
+    paging = (limit, cursor, category, date_from, date_to, created_by, fields)
+    if all(param is None for param in paging):
+        return response_cache.respond(
+            request, "events", (events_db.version, comments_db.version),
+            lambda: [event_response(event) for event in events_db.values()]
+        )
+
+    selected = parse_fields(fields, EventResponse.model_fields)
+    events, next_key = events_db.page(
+        limit or 20,
+        after=decode_cursor(cursor),
+        date_from=date_from,
+        date_to=date_to,
+        category=category,
+        created_by=created_by,
+    )
+    return json_response({
+        "events": [project(event_response(event), selected) for event in events],
+        "next_cursor": encode_cursor(next_key),
+    })
 
 @app.post("/events/", response_model=EventResponse)
-async def create_event(event: EventCreate):
+async def create_event(event: EventCreate, user: AuthUser = Depends(current_user)):
     """Create new event"""
-    global next_event_id
-    event_id = str(next_event_id)
-    next_event_id += 1
-
-    # For demo purposes, set created_by to current user ID (would get from JWT token in production)
-    # In production, decode JWT token to get user_id
-    current_user_id = "1"  # Mock: would be extracted from Authorization Bearer token
-
     event_data = event.dict()
     event_data.update({
-        "id": event_id,
-        "created_by": current_user_id,
+        "created_by": user.id,
         "created_at": datetime.now().isoformat(),
         "attendees": [],
-        "comments": []
+        "waitlist": [],
     })
 
-    events_db[event_id] = event_data
-    return EventResponse(**event_data)
+    events_db.insert(event_data)
+    return json_response(event_response(event_data))
+
+@app.get("/events/search")
+async def search_events(
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    prefix: bool = True,
+    fields: Optional[str] = None,
+):
+    """Search events by title, description, location and category"""
+    selected = parse_fields(fields, EventResponse.model_fields)
+    results = []
+    for event_id, score in search_index.search(q, limit=limit, prefix=prefix):
+        event = project(event_response(events_db[event_id]), selected)
+        event["score"] = round(score, 4)
+        results.append(event)
+    return json_response({"query": q, "results": results})
 
 @app.get("/events/{event_id}")
 async def get_event(event_id: str):
     """Get single event by ID"""
     if event_id not in events_db:
         raise HTTPException(status_code=404, detail="Event not found")
-    return EventResponse(**events_db[event_id])
+    return json_response(event_response(events_db[event_id]))
 
 @app.put("/events/{event_id}")
 async def update_event(event_id: str, event_update: EventUpdate):
@@ -477,12 +689,17 @@ async def update_event(event_id: str, event_update: EventUpdate):
         raise HTTPException(status_code=404, detail="Event not found")
 
     # Update only provided fields
-    for field, value in event_update.dict(exclude_unset=True).items():
-        if value is not None:
-            events_db[event_id][field] = value
-
-    events_db[event_id]["updated_at"] = datetime.now().isoformat()
-    return EventResponse(**events_db[event_id])
+    changes = {field: value for field, value in event_update.dict(exclude_unset=True).items()
+               if value is not None}
+    changes["updated_at"] = datetime.now().isoformat()
+
+    event = events_db.update(event_id, changes)
+    notify_event_change(notifications_db, event, "update", event.get("created_by"), fields=changes)
+    if "capacity" in changes:
+        # A larger capacity lets waitlisted users in
+        promoted = events_db.promote(event_id)
+        notify_event_change(notifications_db, event, "promote", None, users=promoted)
+    return json_response(event_response(event))
 
 @app.delete("/events/{event_id}")
 async def delete_event(event_id: str):
@@ -490,57 +707,80 @@ async def delete_event(event_id: str):
     if event_id not in events_db:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    deleted_event = events_db.pop(event_id)
+    comments_db.purge(event_id)
+    deleted_event = events_db.delete(event_id)
+    notify_event_change(notifications_db, deleted_event, "delete", deleted_event.get("created_by"))
     return {"message": "Event deleted successfully", "event": deleted_event}
 
+@app.get("/events/{event_id}/comments")
+async def get_comments(event_id: str, before: Optional[str] = None,
+                       limit: int = Query(20, ge=1, le=100)):
+    """Comments on an event, newest first; before: only those older than this comment id"""
+    if event_id not in events_db:
+        raise HTTPException(status_code=404, detail="Event not found")
+    comments, next_before = comments_db.page(event_id, before, limit)
+    return json_response({"comments": comments, "next_before": next_before,
+                          "comments_count": comments_db.count(event_id)})
+
 @app.post("/events/{event_id}/comments")
-async def add_comment(event_id: str, comment: dict):
+async def add_comment(event_id: str, comment: dict, user: AuthUser = Depends(current_user)):
     """Add comment to event"""
     if event_id not in events_db:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    new_comment = {
-        "author": "Anonymous",
+    new_comment = comments_db.insert({
+        "event_id": event_id,
+        "user_id": user.id,
+        "author": user.name,
         "text": comment.get("text", ""),
         "timestamp": datetime.now().isoformat()
-    }
-
-    events_db[event_id]["comments"].append(new_comment)
-    return {"message": "Comment added"}
+    })
+    notify_event_change(notifications_db, events_db[event_id], "comment", user.id, user.name)
+    return {"message": "Comment added", "comment": new_comment}
 
 @app.post("/events/{event_id}/attend")
-async def attend_event(event_id: str, user_data: dict = None):
-    """Attend or unattend an event"""
+async def attend_event(event_id: str, user_data: dict = None, user: AuthUser = Depends(current_user)):
+    """Attend or unattend an event.
+
+    With {"attend": true/false} the request is idempotent; without it, it
+    toggles. A full event puts the user on its waitlist instead.
+    """
     if event_id not in events_db:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    # Mock user ID - in real app would get from JWT token
-    user_id = user_data.get("user_id", "user1") if user_data else "user1"
-
-    attendees = events_db[event_id]["attendees"]
-    if user_id in attendees:
-        attendees.remove(user_id)
-        action = "unattended"
+    user_id = user.id
+    attend = (user_data or {}).get("attend")
+    if attend is None:
+        attend = not (events_db.is_attending(event_id, user_id) or events_db.is_waitlisted(event_id, user_id))
+
+    # attend() and leave() check and update the event atomically
+    if attend:
+        was_attending = events_db.is_attending(event_id, user_id)
+        status = events_db.attend(event_id, user_id)
+        if status == "attending" and not was_attending:
+            notify_event_change(notifications_db, events_db[event_id], "attend", user_id, user.name)
+        action = "attended" if status == "attending" else "joined the waitlist for"
     else:
-        attendees.append(user_id)
-        action = "attended"
+        left, promoted = events_db.leave(event_id, user_id)
+        notify_event_change(notifications_db, events_db[event_id], "promote", user_id, users=promoted)
+        status = None
+        action = "left the waitlist for" if left == "waitlisted" else "unattended"
 
+    event = events_db[event_id]
     return {
         "message": f"Successfully {action} event",
-        "attendees_count": len(attendees),
-        "attended": action == "attended"
+        "status": status,
+        "attendees_count": len(event["attendees"]),
+        "capacity": event.get("capacity"),
+        "waitlist_position": events_db.waitlist_position(event_id, user_id),
+        "attended": status == "attending"
     }
 
 # Profile Management
 @app.get("/profile")
-async def get_profile():
+async def get_profile(current: AuthUser = Depends(current_user)):
     """Get current user profile"""
-    # Mock user profile - in real app would get from JWT token
-    user_id = "1"  # Would get from token
-    if user_id not in users_db:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    user = users_db[user_id]
+    user = users_db[current.id]
     return {
         "id": user["id"],
         "email": user["email"],
@@ -552,28 +792,24 @@ async def get_profile():
     }
 
 @app.put("/profile")
-async def update_profile(profile_update: ProfileUpdateRequest):
+async def update_profile(profile_update: ProfileUpdateRequest, current: AuthUser = Depends(current_user)):
     """Update user profile"""
-    # Mock user profile update - in real app would get from JWT token
-    user_id = "1"  # Would get from token
-    if user_id not in users_db:
-        raise HTTPException(status_code=404, detail="User not found")
-
+    user_id = current.id
     user = users_db[user_id]
 
     # Check if email is being changed and if it's already taken
     if profile_update.email and profile_update.email != user["email"]:
-        for uid, u in users_db.items():
-            if uid != user_id and u["email"] == profile_update.email:
-                raise HTTPException(status_code=400, detail="Email already registered")
+        if users_db.get_by_email(profile_update.email):
+            raise HTTPException(status_code=400, detail="Email already registered")
 
     # Update fields
+    changes = {"updated_at": datetime.now().isoformat()}
     if profile_update.name:
-        user["name"] = profile_update.name
+        changes["name"] = profile_update.name
     if profile_update.email:
-        user["email"] = profile_update.email
+        changes["email"] = profile_update.email
 
-    user["updated_at"] = datetime.now().isoformat()
+    users_db.update(user_id, changes)
 
     return {
         "message": "Profile updated successfully",
@@ -589,201 +825,464 @@ async def update_profile(profile_update: ProfileUpdateRequest):
     }
 
 @app.put("/auth/change-password")
-async def change_password(password_change: ChangePasswordRequest):
+async def change_password(password_change: ChangePasswordRequest, current: AuthUser = Depends(current_user)):
     """Change user password"""
-    # Mock user - in real app would get from JWT token
-    user_id = "1"  # Would get from token
-    if user_id not in users_db:
-        raise HTTPException(status_code=404, detail="User not found")
-
+    user_id = current.id
     user = users_db[user_id]
 
     # Verify current password
-    if not verify_password(password_change.current_password, user["password_hash"]):
+    if not await verify_password(password_change.current_password, user["password_hash"]):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
 
-    # Update password
-    user["password_hash"] = get_password_hash(password_change.new_password)
-    user["updated_at"] = datetime.now().isoformat()
+    # Update password; this invalidates every access token issued before
+    user = users_db.update(user_id, {
+        "password_hash": await get_password_hash(password_change.new_password),
+        "updated_at": datetime.now().isoformat()
+    })
 
-    return {"message": "Password changed successfully"}
+    return {"message": "Password changed successfully", "access_token": create_access_token(user),
+            "token_type": "bearer"}
 
 # File Upload
 @app.post("/upload/file")
 async def upload_file(file: UploadFile = File(...)):
     """Upload file (image, document, etc.)"""
     try:
-        # Generate unique filename
-        file_extension = file.filename.split(".")[-1] if "." in file.filename else ""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{file.filename}"
-
-        file_path = os.path.join(UPLOAD_DIR, filename)
-
-        # Save file
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-
-        # Return file info
-        return {
-            "filename": filename,
-            "original_filename": file.filename,
-            "size": len(content),
-            "content_type": file.content_type,
-            "url": f"/uploads/{filename}"
-        }
+        # Streamed to disk in chunks and stored under its SHA-256
+        blob = await blob_store.save(iter_upload(file), file.filename, file.content_type)
+        return with_image_variants({**blob, "content_type": file.content_type})
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+# Resumable uploads: create a session, PUT the bytes at increasing offsets, then complete
+@app.post("/upload/sessions")
+async def create_upload_session(request: UploadSessionRequest):
+    """Start a resumable upload"""
+    return await blob_store.create_session(request.filename, request.content_type, request.size)
+
+@app.get("/upload/sessions/{upload_id}")
+async def get_upload_session(upload_id: str):
+    """Where to resume an interrupted upload from"""
+    return await blob_store.session(upload_id)
+
+@app.put("/upload/sessions/{upload_id}")
+async def append_upload_session(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    """Append the raw request body at the given offset"""
+    return await blob_store.append(upload_id, offset, request.stream())
+
+@app.post("/upload/sessions/{upload_id}/complete")
+async def complete_upload_session(upload_id: str):
+    """Finish a resumable upload and store the file"""
+    return with_image_variants(await blob_store.complete(upload_id))
+
+def with_image_variants(blob: Dict[str, Any]) -> Dict[str, Any]:
+    """Queue thumbnail/card/full variants for image uploads"""
+    if (blob.get("content_type") or "").startswith("image/") and image_pipeline.enabled:
+        image_pipeline.submit(blob["sha256"], blob_store.path(blob["filename"]))
+        blob["image_url"] = f"/images/{blob['sha256']}"
+    return blob
+
+@app.get("/images/{sha256}")
+async def get_image(sha256: str, request: Request, w: Optional[int] = Query(None, ge=1, le=4096)):
+    """Best image variant for the client's Accept header and width hint"""
+    chosen = image_pipeline.choose(sha256, request.headers.get("accept"), w)
+    if chosen is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    path, media_type = chosen
+    ready = image_pipeline.status(sha256) == "ready"
+    return FileResponse(path, media_type=media_type, headers={
+        "Vary": "Accept",
+        # Content-addressed, so final variants never change; originals are a stopgap
+        "Cache-Control": "public, max-age=31536000, immutable" if ready else "no-cache",
+    })
+
 # Notifications
 @app.get("/notifications")
-async def get_notifications():
-    """Get user notifications"""
-    # Mock notifications - in real app would get from database
-    notifications = [
-        {
-            "id": "1",
-            "type": "event_reminder",
-            "title": "Event Reminder",
-            "message": "Don't forget about the Welcome Event tomorrow!",
-            "timestamp": datetime.now().isoformat(),
-            "read": False
-        },
-        {
-            "id": "2",
-            "type": "achievement",
-            "title": "Achievement Unlocked!",
-            "message": "Congratulations! You earned 'First Steps' badge",
-            "timestamp": (datetime.now() - timedelta(hours=1)).isoformat(),
-            "read": True
-        }
-    ]
-
+async def get_notifications(unread_only: bool = False, since: Optional[str] = None,
+                            limit: int = Query(50, ge=1, le=200), user: AuthUser = Depends(current_user)):
+    """Get user notifications, newest first; since: only those newer than this id"""
+    user_id = user.id
     return {
-        "notifications": notifications,
-        "unread_count": sum(1 for n in notifications if not n["read"])
+        "notifications": notifications_db.for_user(user_id, limit, unread_only, after=since),
+        "unread_count": notifications_db.unread_count(user_id)
     }
 
+@app.get("/notifications/stream")
+async def stream_notifications(request: Request, events: Optional[str] = None,
+                               user: AuthUser = Depends(stream_user)):
+    """Server-Sent Events: notifications for the user, plus live changes to events.
+
+    events: comma-separated event ids to follow, or "*" for all events.
+    """
+    user_id = user.id
+    event_ids = None if events == "*" else [e for e in (events or "").split(",") if e]
+    subscriber = notification_hub.subscribe(user_id, event_ids)
+    return notification_hub.response(subscriber, request.headers.get("last-event-id"))
+
+@app.get("/sync")
+async def sync_changes(since: Optional[int] = None, epoch: Optional[str] = None,
+                       limit: int = Query(500, ge=1, le=5000), user: AuthUser = Depends(current_user)):
+    """Events and favorites changed since revision since of feed epoch.
+
+    Without since, or when the client is too far behind (or on another
+    epoch), returns everything with reset: true. Call again with the
+    returned rev and epoch while has_more is true.
+    """
+    user_id = user.id
+    response = {"epoch": change_feed.epoch, "reset": False, "has_more": False}
+    if change_feed.needs_reset(since, epoch):
+        response.update({
+            "rev": change_feed.rev,
+            "reset": True,
+            "events": {"upserted": [event_response(event) for event in events_db.values()],
+                       "deleted": []},
+            "favorites": favorites_db.for_user(user_id),
+        })
+        return json_response(response)
+
+    entries, response["has_more"] = change_feed.changes(since, limit)
+    upserted, deleted, favorites = [], [], None
+    for entry in entries:
+        if entry.collection == "events":
+            event = events_db.get(entry.key)
+            if event is None:
+                deleted.append(entry.key)
+            else:
+                upserted.append(event_response(event))
+        elif entry.key == user_id:
+            favorites = favorites_db.for_user(user_id)
+    response.update({
+        "rev": entries[-1].rev if response["has_more"] else change_feed.rev,
+        "events": {"upserted": upserted, "deleted": deleted},
+        "favorites": favorites,  # null: unchanged
+    })
+    return json_response(response)
+
+@app.get("/sync/notifications")
+async def sync_notifications(user: AuthUser = Depends(current_user)):
+    """Notifications in the shape notifications.js merges on login"""
+    return json_response([
+        {**notification, "createdAt": notification["timestamp"]}
+        for notification in notifications_db.for_user(user.id, 50)
+    ])
+
+@app.put("/notifications/read-all")
+async def mark_all_notifications_read(user: AuthUser = Depends(current_user)):
+    """Mark all of the user's notifications as read"""
+    marked = notifications_db.mark_all_read(user.id)
+    return {"message": "Notifications marked as read", "marked": marked}
+
 @app.put("/notifications/{notification_id}/read")
-async def mark_notification_read(notification_id: str):
+async def mark_notification_read(notification_id: str, user: AuthUser = Depends(current_user)):
     """Mark notification as read"""
-    # Mock acknowledgment - in real app would update database
+    notification = notifications_db.get(notification_id)
+    if notification is None or notification["user_id"] != user.id:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    notifications_db.mark_read(notification_id)
     return {"message": "Notification marked as read", "notification_id": notification_id}
 
 # Favorites System
-favorites_db = {}
-
 @app.post("/favorites/{event_id}")
-async def add_to_favorites(event_id: str):
+async def add_to_favorites(event_id: str, user: AuthUser = Depends(current_user)):
     """Add event to favorites"""
     if event_id not in events_db:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    user_id = "1"  # Would get from JWT token
-    if user_id not in favorites_db:
-        favorites_db[user_id] = []
+    user_id = user.id
+    favorites_db.add(user_id, event_id)
 
-    if event_id not in favorites_db[user_id]:
-        favorites_db[user_id].append(event_id)
-
-    return {"message": "Added to favorites", "favorites": favorites_db[user_id]}
+    return {"message": "Added to favorites", "favorites": favorites_db.for_user(user_id)}
 
 @app.delete("/favorites/{event_id}")
-async def remove_from_favorites(event_id: str):
+async def remove_from_favorites(event_id: str, user: AuthUser = Depends(current_user)):
     """Remove event from favorites"""
-    user_id = "1"  # Would get from JWT token
-    if user_id in favorites_db and event_id in favorites_db[user_id]:
-        favorites_db[user_id].remove(event_id)
+    user_id = user.id
+    favorites_db.remove(user_id, event_id)
 
-    return {"message": "Removed from favorites", "favorites": favorites_db.get(user_id, [])}
+    return {"message": "Removed from favorites", "favorites": favorites_db.for_user(user_id)}
 
 @app.get("/favorites")
-async def get_favorites():
+async def get_favorites(user: AuthUser = Depends(current_user)):
     """Get user's favorite events"""
-    user_id = "1"  # Would get from JWT token
-    user_favorites = favorites_db.get(user_id, [])
+    user_id = user.id
+    user_favorites = favorites_db.for_user(user_id)
 
     favorite_events = []
     for event_id in user_favorites:
         if event_id in events_db:
-            favorite_events.append(EventResponse(**events_db[event_id]))
+            favorite_events.append(event_response(events_db[event_id]))
+
+    return json_response({"favorites": favorite_events})
 
-    return {"favorites": favorite_events}
+@app.get("/recommendations")
+async def get_recommendations(limit: int = Query(10, ge=1, le=50), user: AuthUser = Depends(current_user)):
+    """Upcoming events the user may like, based on what people who chose the same events chose"""
+    recommendations = []
+    for event_id, score in recommender.recommend(user.id, limit):
+        event = event_response(events_db[event_id])
+        event["score"] = round(score, 4)
+        recommendations.append(event)
+    return json_response({"recommendations": recommendations})
 
 # Advanced Dashboard and Analytics
 @app.get("/analytics/events")
 async def get_event_analytics(time_range: str = "month"):
     """Get detailed event analytics"""
-    # Mock analytics data
-    analytics = {
+    this_month = datetime.now().strftime("%Y-%m")
+    if time_range in GRANULARITIES:
+        # Recent periods straight from the live counters
+        attendance_trend = analytics.attendance_trend(time_range, ANALYTICS_TREND_PERIODS)
+    else:
+        report = run_report("attendance", time_range)
+        attendance_trend = [{"period": period, "attendance": count}
+                            for period, count in zip(report["periods"], report["total"])]
+    return {
         "total_events": len(events_db),
-        "events_this_month": len([e for e in events_db.values() if e["date"].startswith("2025-")]),
-        "popular_category": "social",
-        "attendance_trend": [5, 8, 12, 15, 20, 25, 30],
-        "category_breakdown": {
-            "academic": 10,
-            "sports": 15,
-            "cultural": 8,
-            "social": 22
-        }
+        "events_this_month": analytics.events_by_month.get(this_month, 0),
+        "popular_category": analytics.popular_category(),
+        "total_attendance": analytics.total_attendance,
+        "total_comments": analytics.total_comments,
+        "attendance_trend": attendance_trend,
+        "category_breakdown": dict(analytics.events_by_category),
+        "attendance_by_category": dict(analytics.attendance_by_category),
     }
 
-    return analytics
+@app.get("/analytics/reports/{report}")
+async def get_analytics_report(report: str, time_range: Optional[str] = None,
+                               interval: Optional[str] = None, group_by: Optional[str] = None,
+                               bins: int = Query(10, ge=1, le=1000)):
+    """Attendance or comment counts per period over any time range.
+
+    time_range: "all", "30d", "12w", "6m", "2y" or "YYYY-MM-DD..YYYY-MM-DD";
+    interval: day, week or month; group_by: category.
+    """
+    options = {"bins": bins} if report == "comments" else {}
+    return run_report(report, time_range, interval, group_by, **options)
+
+def run_report(report: str, time_range: Optional[str], interval: Optional[str] = None,
+               group_by: Optional[str] = None, **options) -> Dict[str, Any]:
+    try:
+        return report_engine.report(report, time_range, interval, group_by, **options)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/analytics/users")
 async def get_user_analytics():
     """Get user analytics"""
-    # Mock user analytics
-    analytics = {
-        "total_users": len(users_db),
-        "active_users": 45,
-        "new_this_month": 8,
-        "engagement_rate": 78.5,
-        "role_distribution": {
-            "student": 85,
-            "organizer": 10,
-            "faculty": 3,
-            "admin": 2
-        }
+    total_users = len(users_db)
+    active = analytics.active_users()
+    return {
+        "total_users": total_users,
+        "active_users": active["month"],
+        "active_users_by_window": active,
+        "new_this_month": analytics.users_by_join_month.get(datetime.now().strftime("%Y-%m"), 0),
+        "engagement_rate": round(100 * active["month"] / total_users, 1) if total_users else 0.0,
+        "role_distribution": dict(analytics.users_by_role),
     }
 
-    return analytics
-
 @app.get("/dashboard")
 async def get_dashboard():
     """Get dashboard stats"""
-    total_events = len(events_db)
-    upcoming = sum(1 for e in events_db.values() if e["date"] >= datetime.now().strftime("%Y-%m-%d"))
     return {
-        "totalEvents": total_events,
-        "upcomingEvents": upcoming,
+        "totalEvents": len(events_db),
+        "upcomingEvents": events_db.count_from_date(datetime.now().strftime("%Y-%m-%d")),
         "myEvents": 1,  # Mock
         "averageRating": 4.0,
-        "totalAttendees": 10,
-        "totalComments": 5
+        "totalAttendees": analytics.total_attendance,
+        "totalComments": analytics.total_comments,
     }
 
 @app.get("/gamification/stats")
-async def get_gamification_stats():
-    """Get gamification stats (mock)"""
-    return {
-        "points": 150,
-        "level": 1,
-        "achievements": ["account_created"],
-        "streak": 3
+async def get_gamification_stats(user: AuthUser = Depends(current_user)):
+    """Points, level and leaderboard ranks of the current user"""
+    record = users_db.get(user.id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    points = record.get("points", 0)
+    achievements = achievement_engine.describe(record.get("achievements", ()))
+    return json_response({
+        "points": points,
+        **level_progress(points),
+        "achievements": achievements,
+        "total_achievements": len(achievements),
+        "streak": record.get("streak", 0),
+        "rank": {scope: leaderboard.rank(user.id, scope) for scope in LEADERBOARD_SCOPES},
+        "total_users": leaderboard.total(),
+    })
+
+@app.get("/gamification/achievements")
+async def get_achievements():
+    """Every achievement there is to earn"""
+    return json_response({"achievements": achievement_engine.describe(achievement_engine.rules)})
+
+@app.get("/gamification/leaderboard")
+async def get_leaderboard(
+    scope: str = "global",
+    limit: int = Query(10, ge=1, le=100),
+    around: int = Query(0, ge=0, le=50),
+    user: AuthUser = Depends(current_user),
+):
+    """Top users overall or in the current user's college or role, and optionally those around them"""
+    if scope not in LEADERBOARD_SCOPES:
+        raise HTTPException(status_code=400, detail=f"scope must be one of {', '.join(LEADERBOARD_SCOPES)}")
+    group = leaderboard.group_of(user.id, scope)
+    if scope != "global" and group is None:
+        raise HTTPException(status_code=404, detail=f"No {scope} set for this user")
+
+    def named(rows):
+        return [{**row, "name": users_db[row["id"]]["name"]} for row in rows]
+
+    content = {
+        "scope": scope,
+        "group": group,
+        "total": leaderboard.total(scope, group),
+        "rank": leaderboard.rank(user.id, scope),
+        "leaders": named(leaderboard.top(limit, scope, group)),
     }
+    if around:
+        content["around"] = named(leaderboard.around(user.id, around, scope))
+    return json_response(content)
+
+@app.get("/admin/metrics/password-hashing")
+async def get_password_hashing_metrics(user: AuthUser = Depends(privileged_user)):
+    """Password hashing pool saturation"""
+    return password_hasher.stats()
+
+@app.get("/admin/metrics/auth")
+async def get_auth_metrics(user: AuthUser = Depends(privileged_user)):
+    """Token cache effectiveness and revocation list size"""
+    return authenticator.stats()
+
+@app.get("/admin/metrics/notifications")
+async def get_notification_metrics(user: AuthUser = Depends(privileged_user)):
+    """Open notification streams"""
+    return {"connections": notification_hub.connections}
+
+@app.get("/admin/metrics/sync")
+async def get_sync_metrics(user: AuthUser = Depends(privileged_user)):
+    """Change feed position and retained history"""
+    return change_feed.stats()
+
+@app.get("/admin/metrics/profiler")
+async def get_profiler_metrics(user: AuthUser = Depends(privileged_user)):
+    """Sampling profiler settings and how much it has collected"""
+    return profiler.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request, event loop and hot path metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/admin/profile", response_class=PlainTextResponse)
+async def get_profile_samples(route: Optional[str] = None, user: AuthUser = Depends(privileged_user)):
+    """Sampled request stacks as folded stacks (flamegraph.pl, speedscope); route like "GET /events/" """
+    return PlainTextResponse(profiler.folded(route))
+
+@app.delete("/admin/profile")
+async def clear_profile(user: AuthUser = Depends(privileged_user)):
+    """Discard the samples collected so far"""
+    profiler.clear()
+    return profiler.stats()
+
+@app.get("/admin/metrics/recommendations")
+async def get_recommendation_metrics(user: AuthUser = Depends(privileged_user)):
+    """Size of the recommendation model and rows waiting to be refreshed"""
+    return recommender.stats()
+
+@app.get("/admin/metrics/achievements")
+async def get_achievement_metrics(user: AuthUser = Depends(privileged_user)):
+    """Queued evaluations and awards made"""
+    return achievement_engine.stats()
+
+# Batched CSV/NDJSON imports and streamed exports
+bulk_io = BulkIO(users_db, events_db, EventCreate)
+
+def check_bulk_request(kind: str, fmt: str):
+    if kind not in BULK_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(BULK_KINDS)}")
+    if fmt not in BULK_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(BULK_FORMATS)}")
+
+@app.post("/admin/import")
+async def bulk_import(
+    request: Request,
+    kind: str,
+    fmt: str = Query("csv", alias="format"),
+    dry_run: bool = False,
+    user: AuthUser = Depends(privileged_user),
+):
+    """Import events, users or attendance from a CSV or NDJSON request body; reports per-row errors"""
+    check_bulk_request(kind, fmt)
+    report = await bulk_io.import_rows(kind, fmt, request.stream(), user.id, dry_run, admin=user.role == "admin")
+    return json_response(report)
+
+@app.get("/admin/export")
+async def bulk_export(
+    kind: str,
+    fmt: str = Query("csv", alias="format"),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    user: AuthUser = Depends(privileged_user),
+):
+    """Stream events, users or attendance as CSV or NDJSON; events and attendance filter by event date"""
+    check_bulk_request(kind, fmt)
+    return StreamingResponse(bulk_io.export(kind, fmt, date_from, date_to), media_type=BULK_FORMATS[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{kind}.{fmt}"'})
+
+@app.get("/admin/metrics/jobs")
+async def get_job_metrics(user: AuthUser = Depends(privileged_user)):
+    """Background job queue depth, failures and dead letters"""
+    return await job_queue.stats()
+
+@app.get("/admin/jobs/dead")
+async def get_dead_jobs(limit: int = Query(50, ge=1, le=500), user: AuthUser = Depends(privileged_user)):
+    """Jobs that failed every attempt, most recent first; payloads are summarized, not shown"""
+    return {"jobs": await job_queue.dead_letters(limit)}
+
+@app.post("/admin/jobs/dead/{job_id}/retry")
+async def retry_dead_job(job_id: int, user: AuthUser = Depends(privileged_user)):
+    """Queue a dead job again with fresh attempts"""
+    if not await job_queue.requeue(job_id):
+        raise HTTPException(status_code=404, detail="Dead job not found")
+    return {"message": "Job queued", "id": job_id}
+
+@app.get("/admin/metrics/leaderboard")
+async def get_leaderboard_metrics(user: AuthUser = Depends(privileged_user)):
+    """Users ranked and sorted lists per scope"""
+    return leaderboard.stats()
+
+@app.get("/admin/metrics/persistence")
+async def get_persistence_metrics(user: AuthUser = Depends(privileged_user)):
+    """Storage backend position and snapshot state"""
+    return storage.stats()
+
+@app.post("/admin/snapshot")
+async def take_snapshot(user: AuthUser = Depends(privileged_user)):
+    """Write a snapshot now and compact the stored change history"""
+    storage.snapshot()
+    return {"message": "Snapshot started", **storage.stats()}
+
+@app.on_event("startup")
+async def start_jobs():
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def close_storage():
+    notification_hub.close()
+    achievement_engine.close()
+    await job_queue.close()
+    storage.close()
+    image_pipeline.shutdown()
+    password_hasher.shutdown()
 
 # Initialize sample data
 @app.post("/admin/init-sample-data")
 async def init_sample_data():
     """Initialize rich sample data for the event management system"""
-    global events_db, users_db, next_user_id, next_event_id
-
-    # Reset counters
-    next_event_id = 1
-
+    sample_password_hash = await get_password_hash("password123")
     # Create sample users
     sample_users = [
         {
@@ -791,7 +1290,7 @@ async def init_sample_data():
             "email": "john@university.edu",
             "name": "John Smith",
             "role": "organizer",
-            "password_hash": get_password_hash("password123"),
+            "password_hash": sample_password_hash,
             "joined_date": datetime.now().isoformat(),
             "points": 150,
             "verified": True
@@ -801,7 +1300,7 @@ async def init_sample_data():
             "email": "sarah@university.edu",
             "name": "Sarah Johnson",
             "role": "student",
-            "password_hash": get_password_hash("password123"),
+            "password_hash": sample_password_hash,
             "joined_date": datetime.now().isoformat(),
             "points": 200,
             "verified": True
@@ -811,7 +1310,7 @@ async def init_sample_data():
             "email": "mike@university.edu",
             "name": "Mike Chen",
             "role": "student",
-            "password_hash": get_password_hash("password123"),
+            "password_hash": sample_password_hash,
             "joined_date": datetime.now().isoformat(),
             "points": 180,
             "verified": True
@@ -821,7 +1320,7 @@ async def init_sample_data():
             "email": "emma@university.edu",
             "name": "Emma Davis",
             "role": "faculty",
-            "password_hash": get_password_hash("password123"),
+            "password_hash": sample_password_hash,
             "joined_date": datetime.now().isoformat(),
             "points": 220,
             "verified": True
@@ -830,7 +1329,7 @@ async def init_sample_data():
 
     # Add users to database
     for user in sample_users:
-        users_db[user["id"]] = user
+        users_db.insert(user)
 
     # Create sample events with past, current, and future dates
     now = datetime.now()
@@ -895,11 +1394,7 @@ async def init_sample_data():
 
     # Add events to database
     for event in sample_events:
-        events_db[event["id"]] = event
-
-    # Set next IDs
-    next_user_id = len(sample_users) + 1
-    next_event_id = len(sample_events) + 1
+        insert_event(event)
 
     return {
         "message": f"Initialized with {len(sample_users)} users and {len(sample_events)} events",
@@ -915,37 +1410,40 @@ async def init_sample_data():
 
 # Static file serving - Catch-all route for SPA (must be last)
 @app.get("/{full_path:path}", response_class=HTMLResponse)
-async def serve_static_or_spa(full_path: str):
+async def serve_static_or_spa(full_path: str, request: Request):
     """Serve static files or SPA fallback"""
-    # Try to serve the requested file if it exists
-    file_path = full_path if full_path != "/" else "index.html"
-
-    if os.path.isfile(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        # Set appropriate content type based on extension
-        if file_path.endswith('.html'):
-            return HTMLResponse(content)
-        elif file_path.endswith('.css'):
-            return HTMLResponse(content, media_type='text/css')
-        elif file_path.endswith('.js'):
-            return HTMLResponse(content, media_type='application/javascript')
-        else:
-            return HTMLResponse(content, media_type='text/plain')
+    # Uploads are content-addressed, so they never change once stored
+    if full_path.startswith("uploads/"):
+        name = full_path[len("uploads/"):]
+        path = blob_store.path(name)
+        if "/" not in name and not name.startswith(".") and os.path.isfile(path):
+            return file_response(request, path, {"Cache-Control": "public, max-age=31536000, immutable"})
+        return HTMLResponse("File not found", status_code=404)
+
+    response = static_assets.respond(request, full_path or "index.html")
+    if response is not None:
+        return response
 
     # For SPA routing, fallback to index.html for any unmatched route
     if not full_path.startswith(("api", "auth", "dashboard", "analytics", "admin")) and "." not in full_path:
-        try:
-            with open("index.html", "r", encoding="utf-8") as f:
-                return HTMLResponse(f.read())
-        except FileNotFoundError:
-            pass
+        response = static_assets.respond(request, "index.html")
+        if response is not None:
+            return response
 
     # Return 404 for unmatched files
     return HTMLResponse("File not found", status_code=404)
 
-# Initialize sample data on first run (not async)
+# Recover persisted data, then seed sample data only if nothing was recovered
+storage.open()
+job_queue.open()
+migrate_embedded_comments()
 initialize_sample_data()
+change_feed.attach(storage)
+analytics.attach()
+recommender.attach()
+leaderboard.attach()
+achievement_engine.attach()
+static_assets.load()
 
 if __name__ == "__main__":
     import uvicorn
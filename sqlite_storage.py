@@ -0,0 +1,267 @@
+"""
+SQLite Storage
+==============
+
+The "sqlite" storage backend, for running several worker processes on the
+same data:
+
+    STORAGE_BACKEND=sqlite gunicorn -w 4 -k uvicorn.workers.UvicornWorker simple_backend:app
+
+Each worker still serves reads from its in-memory stores. The database (in
+WAL mode, so readers never block the writer) holds the shared, ordered log
+of changes plus a compacting snapshot:
+
+- a write takes the database write lock (BEGIN IMMEDIATE), replays whatever
+  other workers committed since this worker last looked, and only then runs
+  the store write, so uniqueness checks and id allocation see the latest
+  state; the resulting changes are appended before the commit;
+- before a request is served, sync() checks PRAGMA data_version and replays
+  new changes if another worker has committed. Replayed changes go through
+  the store listeners, so search indexes and response caches in every
+  worker are invalidated too.
+
+seq is a change's position in the shared log, the same in every worker,
+and the epoch is stored in the database, so both outlive any one process.
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from persistence import SNAPSHOT_EVERY
+from storage import DATA_DIR, StorageBackend
+from store import Change
+
+# Configuration
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(DATA_DIR or ".", "event-manager.db"))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection TEXT NOT NULL,
+    op TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    seq INTEGER PRIMARY KEY,
+    state BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SQLiteBackend(StorageBackend):
+    """Shared change log in SQLite, replayed into every worker's stores"""
+
+    kind = "sqlite"
+    shared = True
+
+    def __init__(self, stores: Iterable, path: str = SQLITE_PATH,
+                 snapshot_every: int = SNAPSHOT_EVERY):
+        super().__init__(stores)
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self._conn: Optional[sqlite3.Connection] = None
+        self._seq = 0               # last change applied to the local stores
+        self._snapshot_seq = 0      # position of the newest snapshot we know of
+        self._data_version = None
+        self._depth = 0             # nesting of transaction()
+        self._replaying = False
+        self._snapshotting = threading.Lock()
+
+    # Lifecycle
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit mode; transactions are managed explicitly below.
+        # Requests may run on a different thread than startup (e.g. TestClient).
+        self._conn = sqlite3.connect(self.path, isolation_level=None,
+                                     timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)", (uuid.uuid4().hex[:12],))
+        self.epoch = self._conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+
+        self._data_version = self._read_data_version()
+        self._read(self._catch_up)
+        for store in self.stores.values():
+            store.coordinator = self
+            store.subscribe(self.record)
+
+    def close(self):
+        with self._snapshotting:  # Let a snapshot being written finish
+            pass
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # Coordination
+    @contextmanager
+    def transaction(self):
+        """Hold the cross-process write lock with the local stores caught up"""
+        if self._depth or self._replaying:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._depth = 1
+        try:
+            self._catch_up()
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        else:
+            self._conn.execute("COMMIT")
+        finally:
+            self._depth = 0
+
+        if self._seq - self._snapshot_seq >= self.snapshot_every:
+            self.snapshot()
+
+    def record(self, changes: List[Change]):
+        """Store listener: append local changes to the shared log"""
+        if self._replaying:
+            return
+        if not self._depth:
+            raise RuntimeError("Store written outside a storage transaction")
+        self._conn.executemany(
+            "INSERT INTO changes (collection, op, key, data) VALUES (?, ?, ?, ?)",
+            [(change.collection, change.op, change.key,
+              json.dumps(change.data, separators=(",", ":"))) for change in changes],
+        )
+        self._seq = self._conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+
+    def sync(self):
+        """Replay other workers' changes, if any were committed since last time"""
+        if self._depth:
+            return
+        version = self._read_data_version()
+        if version != self._data_version:
+            self._data_version = version
+            self._read(self._catch_up)
+
+    def snapshot(self):
+        """Store the full state and drop the log before the previous snapshot.
+
+        One snapshot interval of log is kept, so a worker that is only a
+        little behind can still catch up change by change. The local state
+        is copied here, at the position it was caught up to; pickling it and
+        storing it happen on a background thread with its own connection,
+        which takes the write lock only for the short INSERT and DELETEs.
+        """
+        if not self._snapshotting.acquire(blocking=False):
+            return  # Previous snapshot still being written
+        try:
+            state = {name: store.copy_state() for name, store in self.stores.items()}
+        except BaseException:
+            self._snapshotting.release()
+            raise
+        threading.Thread(target=self._write_snapshot, args=(state, self._seq),
+                         name="sqlite-snapshot", daemon=True).start()
+
+    def history(self, collections: Iterable[str]) -> Tuple[int, List[Tuple[int, Change]]]:
+        """The changes to collections still in the shared log, up to the ones applied here"""
+        collections = list(collections)
+
+        def read():
+            oldest, = self._conn.execute("SELECT MIN(seq) FROM changes").fetchone()
+            rows = self._conn.execute(
+                f"SELECT seq, collection, op, key, data FROM changes WHERE seq <= ? "
+                f"AND collection IN ({','.join('?' * len(collections))}) ORDER BY seq",
+                (self._seq, *collections)).fetchall()
+            start = self._seq if oldest is None or oldest > self._seq else oldest - 1
+            return start, [(seq, Change(collection, op, key, json.loads(data)))
+                           for seq, collection, op, key, data in rows]
+        return self._read(read)
+
+    def stats(self) -> Dict[str, Any]:
+        pending = self._conn.execute("SELECT COUNT(*) FROM changes").fetchone()[0]
+        return {
+            "backend": self.kind,
+            "path": self.path,
+            "seq": self._seq,
+            "snapshot_seq": self._snapshot_seq,
+            "logged_changes": pending,
+        }
+
+    # Internals
+    def _read(self, func):
+        """Run func in a read transaction so it sees one consistent state"""
+        self._conn.execute("BEGIN")
+        try:
+            return func()
+        finally:
+            self._conn.execute("COMMIT")
+
+    def _read_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _write_snapshot(self, state: Dict[str, Any], seq: int):
+        try:
+            payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    latest, = conn.execute("SELECT MAX(seq) FROM snapshots").fetchone()
+                    # Another worker may have stored a newer one meanwhile
+                    if latest is None or latest < seq:
+                        conn.execute("INSERT INTO snapshots (seq, state) VALUES (?, ?)", (seq, payload))
+                        conn.execute("DELETE FROM snapshots WHERE seq < ?", (seq,))
+                        conn.execute("DELETE FROM changes WHERE seq <= ?", (latest or 0,))
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+            self._snapshot_seq = max(self._snapshot_seq, seq)
+        finally:
+            self._snapshotting.release()
+
+    def _catch_up(self):
+        oldest, = self._conn.execute("SELECT MIN(seq) FROM changes").fetchone()
+        snapshot_seq, = self._conn.execute("SELECT MAX(seq) FROM snapshots").fetchone()
+
+        self._replaying = True
+        try:
+            if snapshot_seq is not None:
+                self._snapshot_seq = max(self._snapshot_seq, snapshot_seq)
+                # The changes we are missing were compacted away: start from the snapshot
+                if snapshot_seq > self._seq and (oldest is None or oldest > self._seq + 1):
+                    row = self._conn.execute("SELECT state FROM snapshots WHERE seq = ?",
+                                             (snapshot_seq,)).fetchone()
+                    # Set first: listeners read seq while the stores reload
+                    self._seq = snapshot_seq
+                    for name, state in pickle.loads(row[0]).items():
+                        if name in self.stores:
+                            self.stores[name].load(state)
+
+            rows = self._conn.execute(
+                "SELECT seq, collection, op, key, data FROM changes WHERE seq > ? ORDER BY seq",
+                (self._seq,),
+            )
+            for seq, collection, op, key, data in rows:
+                self._seq = seq
+                store = self.stores.get(collection)
+                if store is not None:
+                    store.apply(Change(collection, op, key, json.loads(data)))
+        finally:
+            self._replaying = False
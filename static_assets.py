@@ -0,0 +1,239 @@
+"""
+Static Assets
+=============
+
+Serves the frontend (index.html, style.css, script.js, sw.js,
+manifest.json, ...) from memory instead of reading it from disk on every
+request:
+
+- files are loaded once at startup and fingerprinted with a content hash,
+  used as a strong ETag (so revalidation is a cheap 304);
+- text assets get gzip (and brotli, when the package is installed) bodies
+  precomputed, picked by the request's Accept-Encoding;
+- binary assets are sent as bytes and support single Range requests;
+- requests carrying ?v=<fingerprint> are cached as immutable for a year,
+  everything else is revalidated (no-cache);
+- with STATIC_RELOAD=1 (development) changed files are picked up without
+  a restart.
+
+Only files with a known frontend extension in the top-level directory are
+served, so the backend sources and data files never are.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+from response_cache import etag_matches
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Configuration
+STATIC_ROOT = os.getenv("STATIC_ROOT", ".")
+STATIC_RELOAD = os.getenv("STATIC_RELOAD", "").lower() in ("1", "true", "yes")
+STATIC_RELOAD_INTERVAL = float(os.getenv("STATIC_RELOAD_INTERVAL", "1"))
+
+STATIC_EXTENSIONS = {
+    ".html", ".css", ".js", ".json", ".webmanifest", ".txt", ".svg",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".ico", ".woff", ".woff2",
+}
+# Compressing tiny files costs more than it saves
+MIN_COMPRESS_SIZE = 256
+IMMUTABLE = "public, max-age=31536000, immutable"
+RANGE_CHUNK_SIZE = 64 * 1024
+
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+mimetypes.add_type("font/woff2", ".woff2")
+
+
+def media_type(path: str) -> str:
+    # Starlette appends "; charset=utf-8" to text/* types itself
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def is_compressible(media: str) -> bool:
+    return media.startswith("text/") or media in (
+        "application/javascript", "application/json", "application/manifest+json", "image/svg+xml")
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> set:
+    """Content codings the client accepts (ignores q-values other than q=0)"""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding and params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end inclusive) of a single "bytes=" range; ValueError if unsatisfiable"""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None  # Absent, or multipart ranges: serve the whole body
+    start, _, end = header[6:].strip().partition("-")
+    try:
+        if start:
+            first, last = int(start), int(end) if end else size - 1
+        else:
+            first, last = size - int(end), size - 1
+    except ValueError:
+        return None
+    first, last = max(first, 0), min(last, size - 1)
+    if first > last:
+        raise ValueError("Unsatisfiable range")
+    return first, last
+
+
+def _not_satisfiable(size: int) -> Response:
+    return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+
+
+class Asset:
+    """One file held in memory with its precompressed bodies"""
+
+    __slots__ = ("path", "mtime", "media_type", "fingerprint", "etag", "bodies")
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            body = f.read()
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.media_type = media_type(path)
+        self.fingerprint = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.etag = f'"{self.fingerprint}"'
+        # encoding -> (body, etag); each representation needs its own strong ETag
+        self.bodies: Dict[str, Tuple[bytes, str]] = {"identity": (body, self.etag)}
+        if is_compressible(self.media_type) and len(body) >= MIN_COMPRESS_SIZE:
+            self.bodies["gzip"] = (gzip.compress(body, 9, mtime=0), f'"{self.fingerprint}-gz"')
+            if brotli is not None:
+                self.bodies["br"] = (brotli.compress(body, quality=11), f'"{self.fingerprint}-br"')
+
+    def representation(self, accept_encoding: Optional[str]) -> Tuple[str, bytes, str]:
+        """(encoding, body, etag) to send for the given Accept-Encoding"""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and encoding in accepted:
+                return (encoding,) + self.bodies[encoding]
+        return ("identity",) + self.bodies["identity"]
+
+
+class StaticAssets:
+    """In-memory frontend files keyed by URL path"""
+
+    def __init__(self, root: str = STATIC_ROOT, reload: bool = STATIC_RELOAD):
+        self.root = root
+        self.reload = reload
+        self._assets: Dict[str, Asset] = {}
+        self._checked_at = 0.0
+
+    def load(self):
+        """Read every servable file under root into memory"""
+        self._assets = {name: Asset(os.path.join(self.root, name)) for name in self._servable()}
+        self._checked_at = time.monotonic()
+
+    def get(self, name: str) -> Optional[Asset]:
+        if self.reload:
+            self._maybe_reload()
+        return self._assets.get(name)
+
+    def fingerprint(self, name: str) -> Optional[str]:
+        asset = self.get(name)
+        return asset.fingerprint if asset is not None else None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "assets": len(self._assets),
+            "bytes": sum(len(a.bodies["identity"][0]) for a in self._assets.values()),
+            "gzip_bytes": sum(len(a.bodies["gzip"][0]) for a in self._assets.values() if "gzip" in a.bodies),
+        }
+
+    def respond(self, request: Request, name: str) -> Optional[Response]:
+        """Response for the asset called name, or None if there is none"""
+        asset = self.get(name)
+        if asset is None:
+            return None
+
+        encoding, body, etag = asset.representation(request.headers.get("accept-encoding"))
+        headers = {
+            "ETag": etag,
+            "Cache-Control": IMMUTABLE if request.query_params.get("v") == asset.fingerprint else "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        if encoding == "identity" and not is_compressible(asset.media_type):
+            headers["Accept-Ranges"] = "bytes"
+            if_range = request.headers.get("if-range")
+            if if_range is None or if_range == etag:
+                try:
+                    byte_range = parse_range(request.headers.get("range"), len(body))
+                except ValueError:
+                    return _not_satisfiable(len(body))
+                if byte_range is not None:
+                    first, last = byte_range
+                    headers["Content-Range"] = f"bytes {first}-{last}/{len(body)}"
+                    return Response(body[first:last + 1], status_code=206,
+                                    media_type=asset.media_type, headers=headers)
+        return Response(body, media_type=asset.media_type, headers=headers)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < STATIC_RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            changed = self._servable() != set(self._assets) or any(
+                os.path.getmtime(asset.path) != asset.mtime for asset in self._assets.values())
+        except FileNotFoundError:
+            changed = True  # Deleted between listing and stat
+        if changed:
+            self.load()
+
+    def _servable(self) -> set:
+        return {
+            name for name in os.listdir(self.root)
+            if not name.startswith(".")
+            and os.path.splitext(name)[1].lower() in STATIC_EXTENSIONS
+            and os.path.isfile(os.path.join(self.root, name))
+        }
+
+
+def file_response(request: Request, path: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Stream a file from disk, honouring a single Range request"""
+    size = os.path.getsize(path)
+    headers = {"Accept-Ranges": "bytes", **(headers or {})}
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return _not_satisfiable(size)
+    first, last = byte_range or (0, size - 1)
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    headers["Content-Length"] = str(last - first + 1)
+    return StreamingResponse(_read_range(path, first, last), status_code=206 if byte_range else 200,
+                             media_type=media_type(path), headers=headers)
+
+
+def _read_range(path: str, first: int, last: int) -> Iterator[bytes]:
+    # A sync iterator: Starlette runs each read on the threadpool
+    with open(path, "rb") as f:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,89 @@
+"""
+Storage Backends
+================
+
+The stores in store.py always serve reads from memory. A storage backend
+decides what happens to their writes:
+
+- "memory": nothing; state is lost on restart;
+- "wal":    write-ahead log plus snapshots in DATA_DIR (persistence.py);
+- "sqlite": a change log in a shared SQLite database, so several worker
+            processes stay in step (sqlite_storage.py).
+
+Pick one with STORAGE_BACKEND; it defaults to "wal", or "memory" when
+DATA_DIR is empty.
+
+Every backend numbers changes in the order they are applied (seq), and
+names the history those numbers belong to (epoch). With a shared backend
+every worker applies the same changes in the same order, so a seq means
+the same state in all of them.
+"""
+
+import os
+import uuid
+from typing import Any, Dict, Iterable, List, Tuple
+
+from store import Change
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "wal" if DATA_DIR else "memory")
+
+
+class StorageBackend:
+    """Base class: no durability and nothing to share"""
+
+    kind = "memory"
+    # True when other processes write to the same data, so reads must sync first
+    shared = False
+
+    def __init__(self, stores: Iterable):
+        self.stores = {store.name: store for store in stores}
+        self._seq = 0
+        # Nothing survives a restart, so neither does the history
+        self.epoch = uuid.uuid4().hex[:12]
+
+    @property
+    def seq(self) -> int:
+        """Position of the last change logged or replayed.
+
+        Store listeners subscribed after open() run after the backend's
+        own, so for them it already counts the changes they are given.
+        """
+        return self._seq
+
+    def open(self):
+        """Load existing state into the stores and start capturing writes"""
+        # Nothing is stored, but changes are still numbered
+        for store in self.stores.values():
+            store.subscribe(self._count)
+
+    def close(self):
+        """Flush pending writes"""
+
+    def sync(self):
+        """Apply changes committed by other processes"""
+
+    def snapshot(self):
+        """Compact the stored history, if the backend keeps one"""
+
+    def history(self, collections: Iterable[str]) -> Tuple[int, List[Tuple[int, Change]]]:
+        """The changes to collections still in the log, as (seq, change), and the seq the log starts after"""
+        return self._seq, []
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.kind}
+
+    def _count(self, changes: List[Change]):
+        self._seq += len(changes)
+
+
+def create_backend(stores: Iterable, kind: str = STORAGE_BACKEND) -> StorageBackend:
+    if kind == "memory":
+        return StorageBackend(stores)
+    if kind == "wal":
+        from persistence import PersistenceEngine
+        return PersistenceEngine(stores)
+    if kind == "sqlite":
+        from sqlite_storage import SQLiteBackend
+        return SQLiteBackend(stores)
+    raise ValueError(f"Unknown storage backend: {kind}")
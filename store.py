@@ -0,0 +1,1025 @@
+"""
+In-memory Store
+===============
+
+Indexed collections used by the backends instead of bare dicts and lists.
+Every write goes through the store so the secondary indexes always agree
+with the records they point at.
+"""
+
+import functools
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from sortedcontainers import SortedList
+
+
+class Change(NamedTuple):
+    """A single write, as seen by store listeners"""
+    collection: str  # "users", "events", "comments", "favorites", "revocations" or "notifications"
+    op: str          # insert, update, delete, attend, unattend, waitlist, unwaitlist, comment,
+                     # purge, favorite, unfavorite, read, read_all, clear, or load (contents
+                     # replaced wholesale)
+    key: str         # id of the record written (the user id for read_all, the event id for purge)
+    data: Any        # the record, the updated fields, the user id, the comment or the purge count
+
+
+Listener = Callable[[List[Change]], None]
+
+
+def _write(method):
+    """Run a store write inside the coordinator's transaction, if one is attached.
+
+    Shared storage backends use this to take their cross-process write lock
+    and catch up on other processes' changes before the write checks
+    uniqueness or allocates an id.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.coordinator is None:
+            return method(self, *args, **kwargs)
+        with self.coordinator.transaction():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _numeric_id(value: str) -> Optional[int]:
+    return int(value) if isinstance(value, str) and value.isdigit() else None
+
+
+def _sequence(value: str) -> int:
+    """Sort key for ids allocated in order; ids that aren't numbers sort first"""
+    numeric = _numeric_id(value)
+    return numeric if numeric is not None else -1
+
+
+class _Collection:
+    """Shared read API, id allocation and change notification for the record stores"""
+
+    name = ""
+
+    def __init__(self):
+        self._records: Dict[str, Any] = {}
+        self._next_id = 1
+        self._listeners: List[Listener] = []
+        # Bumped on every write so readers can tell when cached views are stale
+        self.version = 0
+        # Set by shared storage backends; see _write
+        self.coordinator = None
+
+    def subscribe(self, listener: Listener):
+        """Call listener with the list of changes after every write"""
+        self._listeners.append(listener)
+
+    def __contains__(self, record_id) -> bool:
+        return record_id in self._records
+
+    def __getitem__(self, record_id) -> Dict[str, Any]:
+        return self._records[record_id]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, record_id, default=None):
+        return self._records.get(record_id, default)
+
+    def keys(self):
+        return self._records.keys()
+
+    def values(self):
+        return self._records.values()
+
+    def items(self):
+        return self._records.items()
+
+    # Persistence hooks
+    def dump(self) -> Dict[str, Any]:
+        """Full state for a snapshot"""
+        return {"records": self._records, "next_id": self._next_id}
+
+    def copy_state(self) -> Dict[str, Any]:
+        """dump(), copied so that later writes do not change it (for pickling on another thread).
+
+        Runs on the caller's thread and costs one pass over the records,
+        much less than pickling them, but not nothing.
+
+        Writes replace or mutate a record's top-level fields and the lists
+        and dicts directly inside them, so those are copied; anything
+        deeper is shared.
+        """
+        records = {}
+        for record_id, record in self._records.items():
+            copied = record.copy()
+            if isinstance(copied, dict):
+                for field, value in copied.items():
+                    if isinstance(value, (list, dict, set)):
+                        copied[field] = value.copy()
+            records[record_id] = copied
+        return {"records": records, "next_id": self._next_id}
+
+    def load(self, state: Dict[str, Any]):
+        """Replace the contents with a snapshot taken by dump()"""
+        self._records = state["records"]
+        self._next_id = state["next_id"]
+        self._rebuild_indexes()
+        self._emit("load", "")
+
+    def apply(self, change: Change):
+        """Re-run a logged change, e.g. while replaying a write-ahead log"""
+        raise NotImplementedError
+
+    def _rebuild_indexes(self):
+        pass
+
+    def _assign_id(self, record: Dict[str, Any]) -> str:
+        """Give the record the next sequential id unless it already has one"""
+        if not record.get("id"):
+            record["id"] = str(self._next_id)
+        numeric = _numeric_id(record["id"])
+        if numeric is not None and numeric >= self._next_id:
+            self._next_id = numeric + 1
+        return record["id"]
+
+    def _emit(self, op: str, key: str, data: Any = None):
+        self.version += 1
+        changes = [Change(self.name, op, key, data)]
+        for listener in self._listeners:
+            listener(changes)
+
+    def _emit_many(self, writes: List[Tuple[str, str, Any]]):
+        """Report a bulk write: one version bump and one listener call for all of its (op, key, data)"""
+        if not writes:
+            return
+        self.version += 1
+        changes = [Change(self.name, op, key, data) for op, key, data in writes]
+        for listener in self._listeners:
+            listener(changes)
+
+
+class UserStore(_Collection):
+    """Users keyed by id, with a unique email index"""
+
+    name = "users"
+
+    def __init__(self):
+        super().__init__()
+        self._by_email: Dict[str, str] = {}
+
+    def get_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        user_id = self._by_email.get(email)
+        return self._records[user_id] if user_id is not None else None
+
+    @_write
+    def insert(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        """Insert (or replace) a user, allocating an id if it has none"""
+        owner = self._by_email.get(user["email"])
+        if owner is not None and owner != user.get("id"):
+            raise ValueError("Email already registered")
+
+        user_id = self._assign_id(user)
+        if user_id in self._records:
+            self._unindex(self._records[user_id])
+        self._records[user_id] = user
+        self._by_email[user["email"]] = user_id
+        self._emit("insert", user_id, user)
+        return user
+
+    @_write
+    def insert_many(self, users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert new users as one write; raises ValueError, writing nothing, if an email is taken"""
+        emails = set()
+        for user in users:
+            if user["email"] in self._by_email or user["email"] in emails:
+                raise ValueError(f"Email already registered: {user['email']}")
+            emails.add(user["email"])
+        writes = []
+        for user in users:
+            user_id = self._assign_id(user)
+            self._records[user_id] = user
+            self._by_email[user["email"]] = user_id
+            writes.append(("insert", user_id, user))
+        self._emit_many(writes)
+        return users
+
+    @_write
+    def update(self, user_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply a partial update, keeping the email index in step"""
+        user = self._records[user_id]
+        email = fields.get("email")
+        if email is not None and email != user["email"]:
+            if email in self._by_email:
+                raise ValueError("Email already registered")
+            del self._by_email[user["email"]]
+            self._by_email[email] = user_id
+        user.update(fields)
+        self._emit("update", user_id, fields)
+        return user
+
+    @_write
+    def award(self, user_id: str, achievement: str, points: int) -> bool:
+        """Record an achievement and add its points in one write; returns False if already earned"""
+        user = self._records.get(user_id)
+        if user is None or achievement in user.get("achievements", ()):
+            return False
+        # Absolute values, so replaying the change can't add the points twice
+        fields = {"achievements": [*user.get("achievements", ()), achievement],
+                  "points": user.get("points", 0) + points}
+        user.update(fields)
+        self._emit("update", user_id, fields)
+        return True
+
+    @_write
+    def delete(self, user_id: str) -> Dict[str, Any]:
+        user = self._records.pop(user_id)
+        self._unindex(user)
+        self._emit("delete", user_id, user)
+        return user
+
+    @_write
+    def clear(self):
+        self._records.clear()
+        self._by_email.clear()
+        self._emit("clear", "")
+
+    def apply(self, change: Change):
+        if change.op == "insert":
+            self.insert(change.data)
+        elif change.op == "update":
+            self.update(change.key, change.data)
+        elif change.op == "delete":
+            self.delete(change.key)
+        elif change.op == "clear":
+            self.clear()
+
+    def _rebuild_indexes(self):
+        self._by_email = {user["email"]: user_id for user_id, user in self._records.items()}
+
+    def _unindex(self, user: Dict[str, Any]):
+        if self._by_email.get(user["email"]) == user["id"]:
+            del self._by_email[user["email"]]
+
+
+class EventStore(_Collection):
+    """Events keyed by id, indexed by category, date, creator and attendee.
+
+    An event with a capacity admits that many attendees; later ones join
+    its waitlist (event["waitlist"], first come first served) and are
+    promoted as seats free up. attend() and leave() check and write in one
+    store transaction, so concurrent requests can't oversell an event.
+    """
+
+    name = "events"
+
+    def __init__(self):
+        super().__init__()
+        self._by_category: Dict[str, Set[str]] = {}
+        self._by_creator: Dict[str, Set[str]] = {}
+        self._by_attendee: Dict[str, Set[str]] = {}
+        # Position of each attendee in event["attendees"], for O(1) removal
+        self._seats: Dict[str, Dict[str, int]] = {}
+        # Waitlist ticket of each queued user, and each event's tickets in
+        # order, so a user's place in event["waitlist"] is found in O(log n)
+        self._waiting: Dict[str, Dict[str, int]] = {}
+        self._tickets: Dict[str, SortedList] = {}
+        # Sorted (date, event_id) pairs; ISO dates sort lexicographically
+        self._by_date: List[Tuple[str, str]] = []
+
+    # Index lookups
+    def in_category(self, category: str) -> List[Dict[str, Any]]:
+        return self._resolve(self._by_category.get(category, ()))
+
+    def created_by(self, user_id: str) -> List[Dict[str, Any]]:
+        return self._resolve(self._by_creator.get(user_id, ()))
+
+    def attended_by(self, user_id: str) -> List[Dict[str, Any]]:
+        return self._resolve(self._by_attendee.get(user_id, ()))
+
+    def is_attending(self, event_id: str, user_id: str) -> bool:
+        return event_id in self._by_attendee.get(user_id, ())
+
+    def is_waitlisted(self, event_id: str, user_id: str) -> bool:
+        return user_id in self._waiting.get(event_id, ())
+
+    def waitlist_position(self, event_id: str, user_id: str) -> Optional[int]:
+        """1-based place of the user in the event's waitlist, or None"""
+        ticket = self._waiting.get(event_id, {}).get(user_id)
+        if ticket is None:
+            return None
+        return self._tickets[event_id].index(ticket) + 1
+
+    def seats_left(self, event_id: str) -> Optional[int]:
+        """Free seats, or None if the event has no capacity limit"""
+        event = self._records[event_id]
+        if not event.get("capacity"):
+            return None
+        return max(event["capacity"] - len(event["attendees"]), 0)
+
+    def between_dates(self, date_from: Optional[str] = None,
+                      date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Events dated within [date_from, date_to], in date order"""
+        start = bisect_left(self._by_date, (date_from,)) if date_from else 0
+        end = bisect_right(self._by_date, (date_to, "\uffff")) if date_to else len(self._by_date)
+        return [self._records[event_id] for _, event_id in self._by_date[start:end]]
+
+    def count_from_date(self, date_from: str) -> int:
+        """Number of events dated on or after date_from"""
+        return len(self._by_date) - bisect_left(self._by_date, (date_from,))
+
+    def page(self, limit: int, after: Optional[Tuple[str, str]] = None,
+             date_from: Optional[str] = None, date_to: Optional[str] = None,
+             category: Optional[str] = None,
+             created_by: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, str]]]:
+        """One page of events in (date, id) order, starting after the given sort key.
+
+        Returns the events and the sort key to resume from, or None when
+        there are no more matches.
+        """
+        start = bisect_left(self._by_date, (date_from,)) if date_from else 0
+        if after is not None:
+            start = max(start, bisect_right(self._by_date, tuple(after)))
+        end = bisect_right(self._by_date, (date_to, "\uffff")) if date_to else len(self._by_date)
+
+        candidates = None
+        if category is not None:
+            candidates = self._by_category.get(category, set())
+        if created_by is not None:
+            creator_ids = self._by_creator.get(created_by, set())
+            candidates = creator_ids if candidates is None else candidates & creator_ids
+
+        if candidates is not None and len(candidates) < end - start:
+            # Selective filter: walk the matching events instead of the date range
+            keys = sorted((self._records[event_id].get("date") or "", event_id)
+                          for event_id in candidates)
+            lower = bisect_left(keys, self._by_date[start]) if start < end else len(keys)
+            upper = bisect_right(keys, self._by_date[end - 1]) if start < end else len(keys)
+            matches = keys[lower:upper]
+        else:
+            matches = (self._by_date[i] for i in range(start, end)
+                       if candidates is None or self._by_date[i][1] in candidates)
+
+        events, last_key = [], None
+        for key in matches:
+            if len(events) == limit:
+                return events, last_key
+            events.append(self._records[key[1]])
+            last_key = key
+        return events, None
+
+    # Writes
+    @_write
+    def insert(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Insert (or replace) an event, allocating an id if it has none"""
+        event_id = self._assign_id(event)
+        if event_id in self._records:
+            self._unindex(self._records[event_id])
+        event.setdefault("attendees", [])
+        event.setdefault("waitlist", [])
+        self._records[event_id] = event
+        self._index(event)
+        self._emit("insert", event_id, event)
+        return event
+
+    @_write
+    def insert_many(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """insert() for many events as one write: one version bump, one list of changes"""
+        writes = []
+        for event in events:
+            event_id = self._assign_id(event)
+            if event_id in self._records:
+                self._unindex(self._records[event_id])
+            event.setdefault("attendees", [])
+            event.setdefault("waitlist", [])
+            self._records[event_id] = event
+            self._index(event, dated=False)
+            writes.append(("insert", event_id, event))
+        # Merge the batch into the date index with one sort (two sorted runs) instead of an insort each
+        dates = {event["id"]: event.get("date") or "" for event in events}
+        self._by_date.extend(sorted((event_date, event_id) for event_id, event_date in dates.items()))
+        self._by_date.sort()
+        self._emit_many(writes)
+        return events
+
+    @_write
+    def update(self, event_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply a partial update, re-indexing the event if needed"""
+        event = self._records[event_id]
+        self._unindex(event)
+        event.update(fields)
+        self._index(event)
+        self._emit("update", event_id, fields)
+        return event
+
+    @_write
+    def delete(self, event_id: str) -> Dict[str, Any]:
+        event = self._records.pop(event_id)
+        self._unindex(event)
+        self._emit("delete", event_id, event)
+        return event
+
+    @_write
+    def attend(self, event_id: str, user_id: str) -> str:
+        """Take a seat, or a waitlist place if the event is full.
+
+        Returns "attending" or "waitlisted" (also when the user already was).
+        """
+        if self.is_attending(event_id, user_id):
+            return "attending"
+        if self.is_waitlisted(event_id, user_id):
+            return "waitlisted"
+        if self.seats_left(event_id) == 0 or self._records[event_id]["waitlist"]:
+            self.add_to_waitlist(event_id, user_id)
+            return "waitlisted"
+        self.add_attendee(event_id, user_id)
+        return "attending"
+
+    @_write
+    def leave(self, event_id: str, user_id: str) -> Tuple[Optional[str], List[str]]:
+        """Give up a seat or waitlist place.
+
+        Returns what the user left ("attending", "waitlisted" or None) and
+        the users promoted from the waitlist into the freed seat.
+        """
+        if self.remove_attendee(event_id, user_id):
+            return "attending", self.promote(event_id)
+        if self.remove_from_waitlist(event_id, user_id):
+            return "waitlisted", []
+        return None, []
+
+    @_write
+    def promote(self, event_id: str) -> List[str]:
+        """Move waitlisted users into free seats, in order; returns who was promoted"""
+        waitlist = self._records[event_id]["waitlist"]
+        promoted = []
+        while waitlist and self.seats_left(event_id) != 0:
+            user_id = waitlist[0]
+            self.remove_from_waitlist(event_id, user_id)
+            self.add_attendee(event_id, user_id)
+            promoted.append(user_id)
+        return promoted
+
+    # Unconditional seat and waitlist writes; these are what gets logged and replayed
+    @_write
+    def add_attendee(self, event_id: str, user_id: str) -> bool:
+        """Add user_id to the event; returns False if already attending"""
+        if self.is_attending(event_id, user_id):
+            return False
+        self._seat(event_id, user_id)
+        self._emit("attend", event_id, user_id)
+        return True
+
+    @_write
+    def add_attendees(self, pairs: Iterable[Tuple[str, str]],
+                      waitlisted: Iterable[Tuple[str, str]] = ()) -> int:
+        """add_attendee() for many (event id, user id) pairs as one write; returns how many were added
+
+        The waitlisted pairs join the end of their event's waitlist first.
+        Users given a seat leave the waitlist in the same write.
+        """
+        writes = []
+        for event_id, user_id in waitlisted:
+            if not self.is_attending(event_id, user_id) and not self.is_waitlisted(event_id, user_id):
+                self._queue(event_id, user_id)
+                writes.append(("waitlist", event_id, user_id))
+        seated = 0
+        for event_id, user_id in pairs:
+            if self.is_attending(event_id, user_id):
+                continue
+            if self.is_waitlisted(event_id, user_id):
+                self._unqueue(event_id, user_id)
+                writes.append(("unwaitlist", event_id, user_id))
+            self._seat(event_id, user_id)
+            writes.append(("attend", event_id, user_id))
+            seated += 1
+        self._emit_many(writes)
+        return seated
+
+    @_write
+    def remove_attendee(self, event_id: str, user_id: str) -> bool:
+        """Remove user_id from the event; returns False if not attending"""
+        if not self.is_attending(event_id, user_id):
+            return False
+        # Move the last attendee into the freed slot rather than shifting the list
+        attendees = self._records[event_id]["attendees"]
+        seats = self._seats[event_id]
+        position = seats.pop(user_id)
+        last = attendees.pop()
+        if last != user_id:
+            attendees[position] = last
+            seats[last] = position
+        self._discard(self._by_attendee, user_id, event_id)
+        self._emit("unattend", event_id, user_id)
+        return True
+
+    @_write
+    def add_to_waitlist(self, event_id: str, user_id: str) -> bool:
+        if self.is_waitlisted(event_id, user_id):
+            return False
+        self._queue(event_id, user_id)
+        self._emit("waitlist", event_id, user_id)
+        return True
+
+    @_write
+    def remove_from_waitlist(self, event_id: str, user_id: str) -> bool:
+        if not self.is_waitlisted(event_id, user_id):
+            return False
+        self._unqueue(event_id, user_id)
+        self._emit("unwaitlist", event_id, user_id)
+        return True
+
+    @_write
+    def add_comment(self, event_id: str, comment: Dict[str, Any]) -> Dict[str, Any]:
+        """Embed a comment in the event (backend.py; simple_backend.py uses CommentStore)"""
+        self._records[event_id].setdefault("comments", []).append(comment)
+        self._emit("comment", event_id, comment)
+        return comment
+
+    @_write
+    def clear(self):
+        self._records.clear()
+        self._by_category.clear()
+        self._by_creator.clear()
+        self._by_attendee.clear()
+        self._seats.clear()
+        self._waiting.clear()
+        self._tickets.clear()
+        self._by_date.clear()
+        self._emit("clear", "")
+
+    def apply(self, change: Change):
+        if change.op == "insert":
+            self.insert(change.data)
+        elif change.op == "update":
+            self.update(change.key, change.data)
+        elif change.op == "delete":
+            self.delete(change.key)
+        elif change.op == "attend":
+            self.add_attendee(change.key, change.data)
+        elif change.op == "unattend":
+            self.remove_attendee(change.key, change.data)
+        elif change.op == "waitlist":
+            self.add_to_waitlist(change.key, change.data)
+        elif change.op == "unwaitlist":
+            self.remove_from_waitlist(change.key, change.data)
+        elif change.op == "comment":
+            self.add_comment(change.key, change.data)
+        elif change.op == "clear":
+            self.clear()
+
+    # Index maintenance
+    def _rebuild_indexes(self):
+        # One pass plus a single sort, rather than one insort per event
+        self._by_category, self._by_creator, self._by_attendee = {}, {}, {}
+        self._seats, self._waiting, self._tickets = {}, {}, {}
+        for event_id, event in self._records.items():
+            self._by_category.setdefault(event.get("category"), set()).add(event_id)
+            if event.get("created_by") is not None:
+                self._by_creator.setdefault(event["created_by"], set()).add(event_id)
+            for user_id in event["attendees"]:
+                self._by_attendee.setdefault(user_id, set()).add(event_id)
+            event.setdefault("waitlist", [])  # Snapshots from before waitlists existed
+            self._seats[event_id] = {user_id: i for i, user_id in enumerate(event["attendees"])}
+            self._ticket(event)
+        self._by_date = sorted((event.get("date") or "", event_id)
+                               for event_id, event in self._records.items())
+
+    def _resolve(self, event_ids) -> List[Dict[str, Any]]:
+        return [self._records[event_id] for event_id in event_ids]
+
+    def _seat(self, event_id: str, user_id: str):
+        attendees = self._records[event_id]["attendees"]
+        self._seats.setdefault(event_id, {})[user_id] = len(attendees)
+        attendees.append(user_id)
+        self._by_attendee.setdefault(user_id, set()).add(event_id)
+
+    def _queue(self, event_id: str, user_id: str):
+        self._records[event_id]["waitlist"].append(user_id)
+        tickets = self._tickets.setdefault(event_id, SortedList())
+        ticket = tickets[-1] + 1 if tickets else 0
+        self._waiting.setdefault(event_id, {})[user_id] = ticket
+        tickets.add(ticket)
+
+    def _unqueue(self, event_id: str, user_id: str):
+        # Tickets stay in waitlist order, so the user's ticket rank is their
+        # index in event["waitlist"]; no scan of the list is needed
+        waiting, tickets = self._waiting[event_id], self._tickets[event_id]
+        ticket = waiting.pop(user_id)
+        del self._records[event_id]["waitlist"][tickets.index(ticket)]
+        tickets.remove(ticket)
+        if not waiting:
+            del self._waiting[event_id], self._tickets[event_id]
+
+    def _ticket(self, event: Dict[str, Any]):
+        if event["waitlist"]:
+            self._waiting[event["id"]] = {user_id: i for i, user_id in enumerate(event["waitlist"])}
+            self._tickets[event["id"]] = SortedList(range(len(event["waitlist"])))
+
+    def _index(self, event: Dict[str, Any], dated: bool = True):
+        event_id = event["id"]
+        self._by_category.setdefault(event.get("category"), set()).add(event_id)
+        if event.get("created_by") is not None:
+            self._by_creator.setdefault(event["created_by"], set()).add(event_id)
+        for user_id in event["attendees"]:
+            self._by_attendee.setdefault(user_id, set()).add(event_id)
+        self._seats[event_id] = {user_id: i for i, user_id in enumerate(event["attendees"])}
+        self._ticket(event)
+        if dated:
+            insort(self._by_date, (event.get("date") or "", event_id))
+
+    def _unindex(self, event: Dict[str, Any]):
+        event_id = event["id"]
+        self._discard(self._by_category, event.get("category"), event_id)
+        self._discard(self._by_creator, event.get("created_by"), event_id)
+        for user_id in event["attendees"]:
+            self._discard(self._by_attendee, user_id, event_id)
+        self._seats.pop(event_id, None)
+        self._waiting.pop(event_id, None)
+        self._tickets.pop(event_id, None)
+        key = (event.get("date") or "", event_id)
+        position = bisect_left(self._by_date, key)
+        if position < len(self._by_date) and self._by_date[position] == key:
+            del self._by_date[position]
+
+    @staticmethod
+    def _discard(index: Dict[Any, Set[str]], key, event_id: str):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.discard(event_id)
+            if not bucket:
+                del index[key]
+
+
+class CommentStore(_Collection):
+    """Comments keyed by id, kept apart from the events they belong to.
+
+    Each event's comment ids are held oldest first in segments of at most
+    segment_size ids: posting appends to the last segment, deleting edits
+    one segment, and a page of comments reads only the ids it returns.
+    Ids are allocated in posting order, which is what pages follow.
+    """
+
+    name = "comments"
+
+    def __init__(self, segment_size: int = 256):
+        super().__init__()
+        self.segment_size = segment_size
+        self._by_event: Dict[str, List[List[str]]] = {}
+        self._counts: Dict[str, int] = {}
+
+    def count(self, event_id: str) -> int:
+        return self._counts.get(event_id, 0)
+
+    def latest(self, event_id: str, limit: int) -> List[Dict[str, Any]]:
+        """The event's newest limit comments, oldest first"""
+        if limit <= 0:
+            return []
+        comments, _ = self.page(event_id, limit=limit)
+        comments.reverse()
+        return comments
+
+    def page(self, event_id: str, before: Optional[str] = None,
+             limit: int = 20) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Comments posted before the comment id before (or the newest), newest first.
+
+        Returns the comments and the id to pass as before for the next page,
+        or None when there are no older comments.
+        """
+        before_number = _sequence(before) if before is not None else None
+        result: List[Dict[str, Any]] = []
+        for segment in reversed(self._by_event.get(event_id, ())):
+            end = len(segment)
+            if before_number is not None:
+                if _sequence(segment[0]) >= before_number:
+                    continue
+                end = bisect_left(segment, before_number, key=_sequence)
+            for index in range(end - 1, -1, -1):
+                if len(result) == limit:
+                    return result, result[-1]["id"]
+                result.append(self._records[segment[index]])
+        return result, None
+
+    @_write
+    def insert(self, comment: Dict[str, Any]) -> Dict[str, Any]:
+        """Add a comment to comment["event_id"], allocating an id if it has none"""
+        comment_id = self._assign_id(comment)
+        if comment_id in self._records:
+            self._unindex(self._records[comment_id])
+        self._records[comment_id] = comment
+        self._index(comment)
+        self._emit("insert", comment_id, comment)
+        return comment
+
+    @_write
+    def delete(self, comment_id: str) -> Dict[str, Any]:
+        comment = self._records.pop(comment_id)
+        self._unindex(comment)
+        self._emit("delete", comment_id, comment)
+        return comment
+
+    @_write
+    def purge(self, event_id: str) -> int:
+        """Delete every comment of an event (one logged change); returns how many"""
+        segments = self._by_event.pop(event_id, ())
+        for segment in segments:
+            for comment_id in segment:
+                del self._records[comment_id]
+        count = self._counts.pop(event_id, 0)
+        if count:
+            self._emit("purge", event_id, count)
+        return count
+
+    @_write
+    def clear(self):
+        self._records.clear()
+        self._by_event.clear()
+        self._counts.clear()
+        self._emit("clear", "")
+
+    def apply(self, change: Change):
+        if change.op == "insert":
+            self.insert(change.data)
+        elif change.op == "delete":
+            self.delete(change.key)
+        elif change.op == "purge":
+            self.purge(change.key)
+        elif change.op == "clear":
+            self.clear()
+
+    # Index maintenance
+    def _rebuild_indexes(self):
+        self._by_event, self._counts = {}, {}
+        ordered = sorted(self._records.values(), key=lambda c: _sequence(c["id"]))
+        for comment in ordered:
+            self._index(comment)
+
+    def _index(self, comment: Dict[str, Any]):
+        event_id, comment_id = comment["event_id"], comment["id"]
+        sequence = _sequence(comment_id)
+        segments = self._by_event.setdefault(event_id, [])
+        if not segments or _sequence(segments[-1][-1]) < sequence:
+            if not segments or len(segments[-1]) >= self.segment_size:
+                segments.append([])
+            segments[-1].append(comment_id)
+        else:
+            # Out of order (replaced or imported with an old id): insert into
+            # the first segment ending after it, splitting it if that
+            # overfills it, so every segment stays sorted and bounded
+            index = bisect_left(segments, sequence, key=lambda s: _sequence(s[-1]))
+            segment = segments[index]
+            insort(segment, comment_id, key=_sequence)
+            if len(segment) > self.segment_size:
+                half = len(segment) // 2
+                segments.insert(index + 1, segment[half:])
+                del segment[half:]
+        self._counts[event_id] = self._counts.get(event_id, 0) + 1
+
+    def _unindex(self, comment: Dict[str, Any]):
+        event_id, comment_id = comment["event_id"], comment["id"]
+        sequence = _sequence(comment_id)
+        segments = self._by_event[event_id]
+        index = bisect_left(segments, sequence, key=lambda s: _sequence(s[-1]))
+        while True:
+            # Ids that aren't numbers share a sort key; step past any ties
+            segment = segments[index]
+            position = bisect_left(segment, sequence, key=_sequence)
+            while position < len(segment) and segment[position] != comment_id:
+                position += 1
+            if position < len(segment):
+                break
+            index += 1
+        del segment[position]
+        if not segment:
+            del segments[index]
+        self._counts[event_id] -= 1
+        if not self._counts[event_id]:
+            del self._counts[event_id]
+            del self._by_event[event_id]
+
+
+class FavoriteStore(_Collection):
+    """Favorite event ids per user, keyed by user id"""
+
+    name = "favorites"
+
+    def for_user(self, user_id: str) -> List[str]:
+        return self._records.get(user_id, [])
+
+    @_write
+    def add(self, user_id: str, event_id: str) -> bool:
+        """Favorite an event; returns False if it already was"""
+        favorites = self._records.setdefault(user_id, [])
+        if event_id in favorites:
+            return False
+        favorites.append(event_id)
+        self._emit("favorite", user_id, event_id)
+        return True
+
+    @_write
+    def remove(self, user_id: str, event_id: str) -> bool:
+        """Unfavorite an event; returns False if it wasn't a favorite"""
+        favorites = self._records.get(user_id)
+        if not favorites or event_id not in favorites:
+            return False
+        favorites.remove(event_id)
+        self._emit("unfavorite", user_id, event_id)
+        return True
+
+    @_write
+    def clear(self):
+        self._records.clear()
+        self._emit("clear", "")
+
+    def apply(self, change: Change):
+        if change.op == "favorite":
+            self.add(change.key, change.data)
+        elif change.op == "unfavorite":
+            self.remove(change.key, change.data)
+        elif change.op == "clear":
+            self.clear()
+
+
+class RevocationStore(_Collection):
+    """Revoked access tokens keyed by their jti, kept until the token expires"""
+
+    name = "revocations"
+
+    @_write
+    def revoke(self, jti: str, user_id: str, expires_at: float) -> bool:
+        """Returns False if the token already was revoked"""
+        if jti in self._records:
+            return False
+        record = {"id": jti, "user_id": user_id, "expires_at": expires_at}
+        self._records[jti] = record
+        self._emit("insert", jti, record)
+        return True
+
+    @_write
+    def delete(self, jti: str) -> Dict[str, Any]:
+        record = self._records.pop(jti)
+        self._emit("delete", jti, record)
+        return record
+
+    def purge_expired(self, now: float) -> int:
+        """Forget revocations of tokens that have expired anyway"""
+        expired = [jti for jti, record in self._records.items() if record["expires_at"] <= now]
+        for jti in expired:
+            self.delete(jti)
+        return len(expired)
+
+    @_write
+    def clear(self):
+        self._records.clear()
+        self._emit("clear", "")
+
+    def apply(self, change: Change):
+        if change.op == "insert":
+            self.revoke(change.key, change.data["user_id"], change.data["expires_at"])
+        elif change.op == "delete":
+            self.delete(change.key)
+        elif change.op == "clear":
+            self.clear()
+
+
+class NotificationStore(_Collection):
+    """Notifications keyed by id, indexed by recipient, with read state.
+
+    Only the newest max_per_user notifications of each user are kept.
+    """
+
+    name = "notifications"
+
+    def __init__(self, max_per_user: int = 200):
+        super().__init__()
+        self.max_per_user = max_per_user
+        self._by_user: Dict[str, List[str]] = {}  # oldest first
+        self._unread: Dict[str, int] = {}
+
+    def for_user(self, user_id: str, limit: Optional[int] = None, unread_only: bool = False,
+                 after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Newest first; after restricts to ids newer than the given one"""
+        after_number = _numeric_id(after) if after is not None else None
+        result = []
+        for notification_id in reversed(self._by_user.get(user_id, ())):
+            if after_number is not None and _numeric_id(notification_id) <= after_number:
+                break
+            notification = self._records[notification_id]
+            if unread_only and notification["read"]:
+                continue
+            result.append(notification)
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def unread_count(self, user_id: str) -> int:
+        return self._unread.get(user_id, 0)
+
+    @_write
+    def insert(self, notification: Dict[str, Any], trim: bool = True) -> Dict[str, Any]:
+        """Add a notification for notification["user_id"], dropping that user's oldest beyond the cap"""
+        notification_id = self._add(notification)
+        self._emit("insert", notification_id, notification)
+
+        # The deletes are logged too, so replay must not trim a second time
+        user_ids = self._by_user[notification["user_id"]]
+        while trim and len(user_ids) > self.max_per_user:
+            self.delete(user_ids[0])
+        return notification
+
+    @_write
+    def insert_many(self, notifications: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """insert() for many notifications as one write: one version bump, one list of changes"""
+        writes = [("insert", self._add(notification), notification) for notification in notifications]
+        for user_id in {notification["user_id"] for notification in notifications}:
+            user_ids = self._by_user[user_id]
+            while len(user_ids) > self.max_per_user:
+                trimmed = self._records.pop(user_ids[0])
+                self._unindex(trimmed)
+                writes.append(("delete", trimmed["id"], trimmed))
+        self._emit_many(writes)
+        return notifications
+
+    @_write
+    def mark_read(self, notification_id: str) -> bool:
+        """Returns False if it already was read"""
+        notification = self._records[notification_id]
+        if notification["read"]:
+            return False
+        notification["read"] = True
+        user_id = notification["user_id"]
+        self._unread[user_id] -= 1
+        if not self._unread[user_id]:
+            del self._unread[user_id]
+        self._emit("read", notification_id)
+        return True
+
+    @_write
+    def mark_all_read(self, user_id: str) -> int:
+        """Mark every notification of user_id read; returns how many were unread"""
+        count = self._unread.pop(user_id, 0)
+        if count:
+            for notification_id in self._by_user.get(user_id, ()):
+                self._records[notification_id]["read"] = True
+            self._emit("read_all", user_id)
+        return count
+
+    @_write
+    def delete(self, notification_id: str) -> Dict[str, Any]:
+        notification = self._records.pop(notification_id)
+        self._unindex(notification)
+        self._emit("delete", notification_id, notification)
+        return notification
+
+    @_write
+    def clear(self):
+        self._records.clear()
+        self._by_user.clear()
+        self._unread.clear()
+        self._emit("clear", "")
+
+    def apply(self, change: Change):
+        if change.op == "insert":
+            self.insert(change.data, trim=False)
+        elif change.op == "read":
+            self.mark_read(change.key)
+        elif change.op == "read_all":
+            self.mark_all_read(change.key)
+        elif change.op == "delete":
+            self.delete(change.key)
+        elif change.op == "clear":
+            self.clear()
+
+    # Index maintenance
+    def _rebuild_indexes(self):
+        self._by_user, self._unread = {}, {}
+        ordered = sorted(self._records.values(), key=lambda n: _numeric_id(n["id"]) or 0)
+        for notification in ordered:
+            self._index(notification)
+
+    def _add(self, notification: Dict[str, Any]) -> str:
+        notification.setdefault("read", False)
+        notification_id = self._assign_id(notification)
+        if notification_id in self._records:
+            self._unindex(self._records[notification_id])
+        self._records[notification_id] = notification
+        self._index(notification)
+        return notification_id
+
+    def _index(self, notification: Dict[str, Any]):
+        user_id = notification["user_id"]
+        self._by_user.setdefault(user_id, []).append(notification["id"])
+        if not notification["read"]:
+            self._unread[user_id] = self._unread.get(user_id, 0) + 1
+
+    def _unindex(self, notification: Dict[str, Any]):
+        user_id = notification["user_id"]
+        user_ids = self._by_user.get(user_id)
+        if user_ids is not None:
+            user_ids.remove(notification["id"])
+            if not user_ids:
+                del self._by_user[user_id]
+        if not notification["read"]:
+            self._unread[user_id] -= 1
+            if not self._unread[user_id]:
+                del self._unread[user_id]
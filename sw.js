@@ -17,6 +17,7 @@ const STATIC_FILES = [
     '/collaboration.html',
     '/style.css',
     '/homepage.css',
+    '/session.js',
     '/auth-utils.js',
     '/api-integration.js',
     '/enhanced_script.js',
@@ -329,17 +330,14 @@ self.addEventListener('periodicsync', event => {
 
 async function updateContent() {
     try {
-        // Update events data
-        const eventsResponse = await fetch('/api/events?limit=20');
-        if (eventsResponse.ok) {
-            const cache = await caches.open(DYNAMIC_CACHE);
-            cache.put('/events', eventsResponse);
-        }
+        const cache = await caches.open(DYNAMIC_CACHE);
+
+        // Update events data: only what changed since the last sync
+        await syncEvents(cache);
 
         // Update dashboard data
         const dashboardResponse = await fetch('/api/dashboard');
         if (dashboardResponse.ok) {
-            const cache = await caches.open(DYNAMIC_CACHE);
             cache.put('/dashboard', dashboardResponse);
         }
 
@@ -349,6 +347,74 @@ async function updateContent() {
     }
 }
 
+// The page's access token, posted with AUTH_TOKEN. It is kept in the cache
+// because the worker's globals are lost whenever the browser stops it.
+const SESSION_KEY = '/sw-session';
+
+async function saveSession(token) {
+    const cache = await caches.open(DYNAMIC_CACHE);
+    await cache.put(SESSION_KEY, new Response(JSON.stringify({ token }), {
+        headers: { 'Content-Type': 'application/json' }
+    }));
+}
+
+async function sessionToken(cache) {
+    const response = await cache.match(SESSION_KEY);
+    return response ? (await response.json()).token : null;
+}
+
+// Drop the token and the user's synced data (logout, or the token was refused)
+async function forgetSession() {
+    const cache = await caches.open(DYNAMIC_CACHE);
+    await Promise.all([SESSION_KEY, '/sync-state', '/favorites'].map(key => cache.delete(key)));
+}
+
+// Merge /sync deltas into the cached events and favorites
+async function syncEvents(cache) {
+    const token = await sessionToken(cache);
+    if (!token) return; // Not logged in: /sync needs a token
+
+    const stateResponse = await cache.match('/sync-state');
+    let state = stateResponse ? await stateResponse.json() : { rev: null, epoch: null, events: {}, favorites: [] };
+
+    let hasMore = true;
+    while (hasMore) {
+        const params = new URLSearchParams();
+        if (state.rev !== null) {
+            params.set('since', state.rev);
+            params.set('epoch', state.epoch);
+        }
+        const response = await fetch(`/api/sync?${params}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (response.status === 401) {
+            // Expired or revoked: wait for the page to post a new token
+            console.warn('⚠️ Sync token refused, background sync paused until the next login');
+            await forgetSession();
+            return;
+        }
+        if (!response.ok) return;
+        const delta = await response.json();
+
+        if (delta.reset) {
+            state = { rev: null, epoch: null, events: {}, favorites: [] };
+        }
+        delta.events.upserted.forEach(event => { state.events[event.id] = event; });
+        delta.events.deleted.forEach(id => { delete state.events[id]; });
+        if (delta.favorites !== null) {
+            state.favorites = delta.favorites;
+        }
+        state.rev = delta.rev;
+        state.epoch = delta.epoch;
+        hasMore = delta.has_more;
+    }
+
+    const json = body => new Response(JSON.stringify(body), { headers: { 'Content-Type': 'application/json' } });
+    await cache.put('/sync-state', json(state));
+    await cache.put('/events', json(Object.values(state.events)));
+    await cache.put('/favorites', json(state.favorites));
+}
+
 async function checkForNewNotifications() {
     try {
         const response = await fetch('/api/notifications?since=lastSync');
@@ -382,8 +448,12 @@ self.addEventListener('message', event => {
             event.waitUntil(requestNotificationPermission(event.source));
             break;
 
+        case 'AUTH_TOKEN':
+            event.waitUntil(saveSession(data.token));
+            break;
+
         case 'LOGOUT':
-            clearUserCaches();
+            event.waitUntil(Promise.all([clearUserCaches(), forgetSession()]));
             break;
 
         case 'CLEAR_CACHE':
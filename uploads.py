@@ -0,0 +1,325 @@
+"""
+Upload Storage
+==============
+
+Streams uploads to disk in fixed-size chunks (file I/O runs on the
+threadpool), hashes them with SHA-256 on the way through and stores them
+content-addressed as <sha256>.<ext>, so the same file uploaded twice is
+kept once. Size limits depend on the content type and are enforced while
+streaming, as soon as the limit is crossed. The type is sniffed from the
+file's first bytes, and the lower of its limit and the declared type's
+applies, so a file labelled video/* only gets the video limit if it
+looks like a video.
+
+A multipart POST /upload/file is parsed, and spooled to disk, before the
+handler runs, so FormSizeLimit refuses one whose Content-Length is over
+UPLOAD_MAX_FORM_MB up front. Larger files (video) go through sessions.
+
+Large files can also be uploaded resumably: create a session, PUT the
+bytes in pieces at explicit offsets (after a dropped connection, ask the
+session for its offset and carry on from there), then complete it.
+Requests for the same session run one at a time, so two PUTs at the same
+offset cannot both pass the offset check and interleave their bytes.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import secrets
+import time
+import weakref
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+MB = 1024 * 1024
+
+# Configuration
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1 * MB)))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+
+# Per content-type size limits, longest matching prefix wins
+UPLOAD_SIZE_LIMITS = {
+    "image/": int(os.getenv("UPLOAD_MAX_IMAGE_MB", "20")) * MB,
+    "video/": int(os.getenv("UPLOAD_MAX_VIDEO_MB", "1024")) * MB,
+    "application/pdf": int(os.getenv("UPLOAD_MAX_PDF_MB", "50")) * MB,
+    "": int(os.getenv("UPLOAD_MAX_OTHER_MB", "25")) * MB,
+}
+MAX_UPLOAD_SIZE = max(UPLOAD_SIZE_LIMITS.values())
+# Whole multipart request to /upload/file
+MAX_FORM_SIZE = int(os.getenv("UPLOAD_MAX_FORM_MB", "64")) * MB
+
+SESSION_DIR = ".sessions"
+
+
+def size_limit(content_type: Optional[str]) -> int:
+    content_type = (content_type or "").lower()
+    prefix = max((p for p in UPLOAD_SIZE_LIMITS if content_type.startswith(p)), key=len)
+    return UPLOAD_SIZE_LIMITS[prefix]
+
+
+def sniff_type(head: bytes) -> Optional[str]:
+    """Content type from a file's first bytes, for the types with their own limit; None if unknown"""
+    if head.startswith((b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a", b"BM")):
+        return "image/"
+    if head[:4] == b"RIFF" and head[8:12] in (b"WEBP", b"AVI "):
+        return "image/" if head[8:12] == b"WEBP" else "video/"
+    if head[4:8] == b"ftyp":
+        return "image/" if head[8:12] in (b"heic", b"heix", b"avif", b"mif1") else "video/"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):  # Matroska / WebM
+        return "video/"
+    if head.startswith(b"%PDF-"):
+        return "application/pdf"
+    return None
+
+
+def content_limit(content_type: Optional[str], head: bytes) -> int:
+    """The declared type's limit, or the sniffed type's if that is lower"""
+    return min(size_limit(content_type), size_limit(sniff_type(head)))
+
+
+def file_extension(filename: Optional[str]) -> str:
+    """Lower-cased extension with the dot, or "" if missing or unsafe"""
+    _, ext = os.path.splitext(filename or "")
+    ext = ext.lower()
+    return ext if re.fullmatch(r"\.[a-z0-9]{1,10}", ext) else ""
+
+
+async def iter_upload(file: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File exceeds the {limit // MB} MB limit for this type")
+
+
+class FormSizeLimit:
+    """ASGI middleware: refuses a POST to path with no Content-Length or one over limit, before it is read"""
+
+    def __init__(self, app, path: str, limit: int = MAX_FORM_SIZE):
+        self.app = app
+        self.path = path
+        self.limit = limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == self.path:
+            length = dict(scope["headers"]).get(b"content-length", b"")
+            response = None
+            if not length.isdigit():
+                response = JSONResponse({"detail": "Content-Length required"}, status_code=411)
+            elif int(length) > self.limit:
+                response = JSONResponse({"detail": f"Upload exceeds the {self.limit // MB} MB limit; "
+                                                   "use an upload session"}, status_code=413)
+            if response is not None:
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class BlobStore:
+    """Content-addressed upload storage with resumable sessions"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.session_directory = os.path.join(directory, SESSION_DIR)
+        os.makedirs(self.session_directory, exist_ok=True)
+        # Running hashes of in-progress sessions; rebuilt from disk if lost
+        self._hashers: Dict[str, Any] = {}
+        # One lock per session, dropped once no request holds it
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    # One-shot uploads
+    async def save(self, chunks: AsyncIterator[bytes], filename: str,
+                   content_type: Optional[str]) -> Dict[str, Any]:
+        """Stream chunks to disk and store them under their content hash"""
+        limit = None
+        hasher = hashlib.sha256()
+        temp_path = os.path.join(self.session_directory, f"{secrets.token_hex(8)}.tmp")
+        size = 0
+        f = await run_in_threadpool(open, temp_path, "wb")
+        try:
+            async for chunk in chunks:
+                if limit is None:
+                    limit = content_limit(content_type, chunk)
+                size += len(chunk)
+                if size > limit:
+                    raise _too_large(limit)
+                await run_in_threadpool(self._write_chunk, f, hasher, chunk)
+        except BaseException:
+            await run_in_threadpool(self._discard, f, temp_path)
+            raise
+        await run_in_threadpool(f.close)
+        return await run_in_threadpool(self._commit, temp_path, hasher.hexdigest(), size, filename)
+
+    # Resumable uploads
+    async def create_session(self, filename: str, content_type: Optional[str],
+                             size: Optional[int] = None) -> Dict[str, Any]:
+        limit = size_limit(content_type)
+        if size is not None and size > limit:
+            raise _too_large(limit)
+
+        upload_id = secrets.token_hex(16)
+        session = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "content_type": content_type,
+            "size": size,
+            "created_at": time.time(),
+        }
+        await run_in_threadpool(self._create_session_files, session)
+        self._hashers[upload_id] = (hashlib.sha256(), 0)
+        return {**session, "offset": 0}
+
+    async def session(self, upload_id: str) -> Dict[str, Any]:
+        if not re.fullmatch(r"[0-9a-f]{32}", upload_id):
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        session = await run_in_threadpool(self._read_session, upload_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        return session
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Append bytes at offset, which must be where the session left off"""
+        async with self._session_lock(upload_id):
+            return await self._append(upload_id, offset, chunks)
+
+    async def complete(self, upload_id: str) -> Dict[str, Any]:
+        async with self._session_lock(upload_id):
+            return await self._complete(upload_id)
+
+    def _session_lock(self, upload_id: str) -> asyncio.Lock:
+        lock = self._locks.get(upload_id)
+        if lock is None:
+            lock = self._locks[upload_id] = asyncio.Lock()
+        return lock
+
+    async def _append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        session = await self.session(upload_id)
+        if offset != session["offset"]:
+            raise HTTPException(status_code=409, detail=f"Expected offset {session['offset']}",
+                                headers={"Upload-Offset": str(session["offset"])})
+        # The file's first bytes: already stored, or the first chunk of this request
+        head = await run_in_threadpool(self._read_head, upload_id) if offset else None
+        limit = None
+
+        hasher, hashed = self._hashers.get(upload_id, (None, -1))
+        if hashed != offset:
+            hasher = None  # Lost after a restart; complete() rehashes from disk
+        size = offset
+        f = await run_in_threadpool(open, self._session_data(upload_id), "ab")
+        try:
+            async for chunk in chunks:
+                if limit is None:
+                    limit = content_limit(session["content_type"], head if head is not None else chunk)
+                    if session["size"] is not None:
+                        limit = min(limit, session["size"])
+                size += len(chunk)
+                if size > limit:
+                    raise _too_large(limit)
+                await run_in_threadpool(self._write_chunk, f, hasher, chunk)
+        finally:
+            stored = await run_in_threadpool(self._close, f, self._session_data(upload_id))
+            if hasher is not None:
+                self._hashers[upload_id] = (hasher, stored)
+        return {**session, "offset": size}
+
+    async def _complete(self, upload_id: str) -> Dict[str, Any]:
+        session = await self.session(upload_id)
+        if session["size"] is not None and session["offset"] != session["size"]:
+            raise HTTPException(status_code=409, detail=f"Upload incomplete at offset {session['offset']}",
+                                headers={"Upload-Offset": str(session["offset"])})
+
+        data_path = self._session_data(upload_id)
+        hasher, hashed = self._hashers.pop(upload_id, (None, -1))
+        if hasher is None or hashed != session["offset"]:
+            hasher = await run_in_threadpool(self._hash_file, data_path)
+        blob = await run_in_threadpool(self._commit, data_path, hasher.hexdigest(),
+                                       session["offset"], session["filename"])
+        await run_in_threadpool(os.remove, self._session_meta(upload_id))
+        return {**blob, "content_type": session["content_type"]}
+
+    # Internals (run on the threadpool)
+    def _write_chunk(self, f, hasher, chunk: bytes):
+        if hasher is not None:
+            hasher.update(chunk)
+        f.write(chunk)
+
+    def _close(self, f, path: str) -> int:
+        """Close f; returns the size of the file at path"""
+        f.close()
+        return os.path.getsize(path)
+
+    def _create_session_files(self, session: Dict[str, Any]):
+        self._expire_sessions()
+        with open(self._session_meta(session["upload_id"]), "w") as f:
+            json.dump(session, f)
+        open(self._session_data(session["upload_id"]), "wb").close()
+
+    def _read_session(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._session_meta(upload_id)) as f:
+                session = json.load(f)
+            session["offset"] = os.path.getsize(self._session_data(upload_id))
+        except FileNotFoundError:
+            return None
+        return session
+
+    def _read_head(self, upload_id: str) -> bytes:
+        with open(self._session_data(upload_id), "rb") as f:
+            return f.read(16)
+
+    def _discard(self, f, path: str):
+        f.close()
+        os.remove(path)
+
+    def _commit(self, temp_path: str, digest: str, size: int, filename: str) -> Dict[str, Any]:
+        name = f"{digest}{file_extension(filename)}"
+        target = self.path(name)
+        deduplicated = os.path.exists(target)
+        if deduplicated:
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, target)
+        return {
+            "filename": name,
+            "original_filename": filename,
+            "size": size,
+            "sha256": digest,
+            "deduplicated": deduplicated,
+            "url": f"/uploads/{name}",
+        }
+
+    def _hash_file(self, path: str):
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        return hasher
+
+    def _session_meta(self, upload_id: str) -> str:
+        return os.path.join(self.session_directory, f"{upload_id}.json")
+
+    def _session_data(self, upload_id: str) -> str:
+        return os.path.join(self.session_directory, f"{upload_id}.part")
+
+    def _expire_sessions(self):
+        cutoff = time.time() - UPLOAD_SESSION_TTL
+        for name in os.listdir(self.session_directory):
+            path = os.path.join(self.session_directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    self._hashers.pop(name.split(".")[0], None)
+            except FileNotFoundError:
+                pass